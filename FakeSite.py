@@ -0,0 +1,264 @@
+"""
+A local stand-in for metal-archives.com, so the http engine can be checked without
+a network.
+
+FakeSite serves the pages in fixtures/extraction (see check_extraction.py) at the
+paths the site serves them at, and answers the list's json feed with every band
+there. The links in the pages point at the stand-in, so whatever a scrape follows
+stays local. MetalScrape, BandPool and collect_band_urls can all be pointed at it
+with their base argument.
+
+Each band can be listed several times under ids of its own, so a few pages are
+enough to fill a pool of workers, and every request can be slowed down by a fixed
+latency so requests overlap the way they do against the site.
+
+usage: python FakeSite.py [--fixtures DIR] [--port N] [--copies N] [--latency S]
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from lxml import html
+
+
+"""
+Class that serves the fixture pages over http from a thread of its own.
+"""
+class FakeSite:
+    # the directory of the fixture pages
+    _directory = ""
+
+    # the http server
+    _server = None
+
+    # the thread the server runs on
+    _thread = None
+
+    # the link of every band, (name, band path), sorted by name
+    _bands = None
+
+    # the id of the fixture page of every band id we list
+    _fixture_ids = None
+
+    # seconds each request takes
+    _latency = 0.0
+
+    # the requests answered, keyed by the kind of page
+    _requests = None
+
+    # the most requests that were being answered at the same time
+    _peak = 0
+
+    # the requests being answered right now
+    _active = 0
+
+    # guards _requests, _peak and _active
+    _lock = None
+
+    # the root every page was written against
+    _site = "https://www.metal-archives.com/"
+
+    # the paths we serve, the kind of page and the file it is read from
+    _routes = [
+        (re.compile(r"^/bands/[^/]+/(\d+)$"), "band", "bands"),
+        (re.compile(r"^/band/discography/id/(\d+)/tab/all$"), "discography", "discography"),
+        (re.compile(r"^/albums/.+/(\d+)$"), "release", "releases")
+    ]
+
+    """
+    Constructor for a FakeSite object. The server starts listening straight away.
+
+    params:
+        directory - the fixtures directory (DEFAULT="fixtures/extraction")
+        port - the port to listen on, 0 for any free one (DEFAULT=0)
+        copies - the times each band is listed, each copy under an id of its own (DEFAULT=1)
+        latency - seconds each request takes (DEFAULT=0.0)
+    """
+    def __init__(self, directory=os.path.join("fixtures", "extraction"), port=0, copies=1, latency=0.0):
+        self._directory = directory
+        self._latency = latency
+        self._lock = threading.Lock()
+        self.reset()
+
+        # the first copy keeps the fixture's id, the others get one made from it
+        self._bands = []
+        self._fixture_ids = dict()
+        for name, path in self.band_links():
+            slug, band_id = path.rsplit("/", 1)
+            for copy in range(copies):
+                copy_id = band_id if copy == 0 else str(int(band_id) * 1000 + copy)
+                self._fixture_ids[copy_id] = band_id
+                self._bands.append((name, slug + "/" + copy_id))
+        self._bands.sort()
+
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.answer(self)
+
+            # the check prints what it needs, not a line per request
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+
+    """
+    Returns the root of the stand-in, what base is set to so a scrape uses it.
+    """
+    def base(self):
+        return "http://127.0.0.1:" + str(self._server.server_address[1]) + "/"
+
+    """
+    Starts answering requests on a thread of its own.
+    """
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    """
+    Answers requests on this thread until interrupted.
+    """
+    def run(self):
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        self._server.server_close()
+
+    """
+    Stops the server.
+    """
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    """
+    Returns the requests answered of each kind of page and the most that were
+    answered at once.
+    """
+    def stats(self):
+        with self._lock:
+            return {"requests": dict(self._requests), "peak": self._peak}
+
+    """
+    Clears the request counters and the peak.
+    """
+    def reset(self):
+        with self._lock:
+            self._requests = dict()
+            self._peak = 0
+
+    """
+    Returns the id of the fixture page a band id we list is served from.
+
+    params:
+        band_id - the id in the band's url
+    """
+    def fixture_id(self, band_id):
+        return self._fixture_ids.get(band_id, band_id)
+
+    """
+    Reads the name and link of every band page in the fixtures.
+    """
+    def band_links(self):
+        links = []
+        for file in os.listdir(os.path.join(self._directory, "bands")):
+            with open(os.path.join(self._directory, "bands", file), "r", encoding="utf-8") as page:
+                link = html.fromstring(page.read()).cssselect("h1.band_name a")[0]
+            links.append((link.text_content(), urlparse(link.get("href")).path))
+        return links
+
+    """
+    Answers a request.
+
+    params:
+        handler - the request handler of the request
+    """
+    def answer(self, handler):
+        with self._lock:
+            self._active += 1
+            self._peak = max(self._peak, self._active)
+        try:
+            time.sleep(self._latency)
+            kind, body = self.page(handler.path)
+            with self._lock:
+                self._requests[kind] = self._requests.get(kind, 0) + 1
+
+            if body is None:
+                handler.send_error(404)
+                return
+
+            body = body.encode("utf-8")
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json" if kind == "list" else "text/html; charset=utf-8")
+            handler.send_header("Content-Length", str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    """
+    Returns the kind of page a path is and its body, None for a page we do not have.
+
+    params:
+        path - the path of the request, with its query string
+    """
+    def page(self, path):
+        url = urlparse(path)
+
+        match = re.match(r"^/browse/ajax-letter/l/(\w)/json/1$", url.path)
+        if match:
+            return "list", self.list_page(match.group(1), parse_qs(url.query))
+
+        for pattern, kind, folder in self._routes:
+            match = pattern.match(url.path)
+            if match:
+                page_id = self.fixture_id(match.group(1)) if kind != "release" else match.group(1)
+                file = os.path.join(self._directory, folder, page_id + ".html")
+                if not os.path.exists(file):
+                    return kind, None
+                with open(file, "r", encoding="utf-8") as page:
+                    return kind, page.read().replace(self._site, self.base())
+
+        return "other", None
+
+    """
+    Returns one page of the list's json feed, in the form the site serves it.
+
+    params:
+        letter - the letter of the list
+        query - the parsed query string
+    """
+    def list_page(self, letter, query):
+        start = int(query.get("iDisplayStart", ["0"])[0])
+        length = int(query.get("iDisplayLength", ["500"])[0])
+        bands = [(name, path) for name, path in self._bands if name.upper().startswith(letter.upper())]
+
+        rows = [['<a href="' + self.base() + path.lstrip("/") + '">' + escape(name) + '</a>', "", "", ""]
+                for name, path in bands[start:start + length]]
+        return json.dumps({"iTotalRecords": len(bands), "iTotalDisplayRecords": len(bands), "sEcho": 1, "aaData": rows})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the fixture pages as a local stand-in for the site.")
+    parser.add_argument("--fixtures", default=os.path.join("fixtures", "extraction"), help="the fixture pages")
+    parser.add_argument("--port", type=int, default=8000, help="the port to listen on")
+    parser.add_argument("--copies", type=int, default=1, help="times each band is listed")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds each request takes")
+    args = parser.parse_args()
+
+    site = FakeSite(args.fixtures, args.port, args.copies, args.latency)
+    print("serving " + str(len(site.band_links()) * args.copies) + " bands at " + site.base())
+    site.run()
@@ -0,0 +1,312 @@
+"""
+A local stand-in for the Spotify API, so MetalScrapeWrangle.py can be benchmarked
+and checked without credentials or a network.
+
+FakeSpotify has the same methods as the spotipy object the wrangle uses. Its data is
+generated from a MetalScrape.py json. Each band is found on "spotify" or not, and
+may have namesakes and lookalikes that the matching has to tell apart. Every
+choice is seeded by the band's url, so the same json always gives the same
+artists, albums, tracks and audio features. Each call can be slowed down by a
+fixed latency, and 429s can be injected at random or above a rate, the same way
+spotipy raises them.
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import hashlib
+import json
+import random
+import threading
+import time
+import unicodedata
+import urllib.parse
+from collections import deque
+from spotipy.exceptions import SpotifyException
+from MetalScrapeWrangle import normalize_text
+
+
+"""
+Class that answers the spotipy calls of the wrangle from generated data.
+"""
+class FakeSpotify:
+    # artist objects keyed by id
+    _artists = None
+
+    # artist ids keyed by the first word of their normalized name
+    _by_word = None
+
+    # album names keyed by artist id
+    _albums = None
+
+    # top track objects keyed by artist id
+    _tracks = None
+
+    # audio features keyed by track id, None for a track without any
+    _features = None
+
+    # the id of the real artist of each band url, None for a band that is not on spotify
+    _expected = None
+
+    # seconds each call takes
+    _latency = 0.05
+
+    # up to this many seconds are added to each call at random
+    _jitter = 0.0
+
+    # the chance that a call is answered with a 429
+    _error_rate = 0.0
+
+    # calls per second above which every call is answered with a 429, None for no limit
+    _max_rate = None
+
+    # the Retry-After sent with a 429
+    _retry_after = 1
+
+    # the most ids the endpoints that take many ids accept
+    _limits = {
+        "audio_features": 100
+    }
+
+    # calls and 429s keyed by endpoint
+    _calls = None
+    _rate_limited = None
+
+    # when the calls of the last second were made
+    _recent = None
+
+    # randomness for latency and 429s, the data does not use it
+    _rng = None
+
+    # guards the counters, _recent and _rng
+    _lock = None
+
+    """
+    Constructor for a FakeSpotify object.
+
+    param:
+        filename - json file from MetalScrape.py the data is generated from
+        latency - seconds each call takes (DEFAULT=0.05)
+        jitter - up to this many seconds added to each call at random (DEFAULT=0.0)
+        error_rate - the chance a call gets a 429 (DEFAULT=0.0)
+        max_rate - calls per second above which calls get a 429, None for no limit (DEFAULT=None)
+        retry_after - the Retry-After in seconds sent with a 429 (DEFAULT=1)
+        found - the share of bands that are on spotify (DEFAULT=0.7)
+        seed - changes every generated value (DEFAULT=0)
+    """
+    def __init__(self, filename="metal-scrape-reis-gadsden_by_R.json", latency=0.05, jitter=0.0, error_rate=0.0,
+                 max_rate=None, retry_after=1, found=0.7, seed=0):
+        self._latency = latency
+        self._jitter = jitter
+        self._error_rate = error_rate
+        self._max_rate = max_rate
+        self._retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self.reset()
+
+        self._artists = dict()
+        self._by_word = dict()
+        self._albums = dict()
+        self._tracks = dict()
+        self._features = dict()
+        self._expected = dict()
+
+        with open(filename, "r") as file:
+            scraped = json.load(file)
+
+        for url in scraped:
+            self.generate_band(url, scraped[url], found, seed)
+
+    """
+    Generates the artists a band's search will return.
+
+    params:
+        url - the band's url
+        band - the band's information
+        found - the share of bands that are on spotify
+        seed - changes every generated value
+    """
+    def generate_band(self, url, band, found, seed):
+        rng = random.Random(str(seed) + url)
+        name = band["Band name"]
+        genres = [genre.strip().lower() for genre in band["Genre"].replace("/", ",").split(",") if genre.strip()]
+        titles = [release["Name"] for release in band["Discography"]]
+
+        self._expected[url] = None
+        if rng.random() < found:
+            artist_id = make_id("artist", url)
+            self._expected[url] = artist_id
+
+            # the real artist has some of its releases on spotify, plus things the archives do not list
+            albums = rng.sample(titles, rng.randint(1, len(titles))) if titles else []
+            albums += ["Live " + str(rng.randint(1990, 2022)) for _ in range(rng.randint(0, 3))]
+            rng.shuffle(albums)
+            self.add_artist(rng, artist_id, name, genres[:rng.randint(0, len(genres))], albums)
+
+        # namesakes from other scenes and lookalike names the search also returns
+        for i in range(rng.choice([0, 0, 1, 1, 2, 3])):
+            decoy = name if rng.random() < 0.5 else name + " " + rng.choice(["Band", "Project", "Official", "Tribute"])
+            decoy_genres = rng.sample(["pop", "indie", "hip hop", "country", "edm", "heavy metal", "punk"], rng.randint(0, 2))
+            decoy_albums = ["Album " + str(rng.randint(1, 99)) for _ in range(rng.randint(0, 5))]
+            self.add_artist(rng, make_id("decoy", url, i), decoy, decoy_genres, decoy_albums)
+
+    """
+    Adds an artist with its albums, top tracks and their audio features.
+
+    params:
+        rng - the band's random generator
+        artist_id - the artist's id
+        name - the artist's name
+        genres - the artist's genres
+        albums - the names of the artist's albums
+    """
+    def add_artist(self, rng, artist_id, name, genres, albums):
+        self._artists[artist_id] = {
+            "id": artist_id,
+            "name": name,
+            "genres": genres,
+            "followers": {"total": int(10 ** rng.uniform(0, 6))},
+            "popularity": rng.randint(0, 80),
+            "type": "artist"
+        }
+        words = normalize_text(name).split()
+        if words:
+            self._by_word.setdefault(words[0], []).append(artist_id)
+
+        self._albums[artist_id] = [{"id": make_id("album", artist_id, i), "name": album} for i, album in enumerate(albums)]
+
+        tracks = []
+        for i in range(rng.choice([0, 3, 5, 10, 10, 10])):
+            track_id = make_id("track", artist_id, i)
+            tracks.append({"id": track_id, "name": "Track " + str(i + 1)})
+
+            # now and then spotify has no features for a track
+            self._features[track_id] = None if rng.random() < 0.02 else {
+                "danceability": round(rng.random(), 3),
+                "energy": round(rng.uniform(0.4, 1.0), 3),
+                "key": rng.randint(0, 11),
+                "loudness": round(rng.uniform(-20, -2), 3),
+                "mode": rng.randint(0, 1),
+                "speechiness": round(rng.uniform(0.02, 0.3), 4),
+                "acousticness": round(rng.random() ** 3, 4),
+                "instrumentalness": round(rng.random() ** 2, 4),
+                "liveness": round(rng.uniform(0.05, 0.6), 3),
+                "valence": round(rng.random(), 3),
+                "tempo": round(rng.uniform(70, 210), 3),
+                "id": track_id,
+                "type": "audio_features"
+            }
+        self._tracks[artist_id] = tracks
+
+    """
+    Counts a call, answers it with a 429 when one is due, and waits out its latency.
+
+    params:
+        endpoint - name of the spotipy method
+    """
+    def serve(self, endpoint):
+        with self._lock:
+            now = time.monotonic()
+            self._calls[endpoint] = self._calls.get(endpoint, 0) + 1
+
+            while self._recent and self._recent[0] <= now - 1:
+                self._recent.popleft()
+            self._recent.append(now)
+
+            limited = self._rng.random() < self._error_rate
+            if self._max_rate is not None and len(self._recent) > self._max_rate:
+                limited = True
+            if limited:
+                self._rate_limited[endpoint] = self._rate_limited.get(endpoint, 0) + 1
+
+            wait = self._latency + self._rng.uniform(0, self._jitter)
+
+        time.sleep(wait)
+        if limited:
+            raise SpotifyException(429, -1, "API rate limit exceeded", headers={"Retry-After": str(self._retry_after)})
+
+    """
+    Raises the 400 spotify answers with when too many ids are asked for at once.
+
+    params:
+        endpoint - name of the spotipy method
+        ids - the ids asked for
+    """
+    def check_ids(self, endpoint, ids):
+        if len(ids) > self._limits[endpoint]:
+            raise SpotifyException(400, -1, "Too many ids requested")
+
+    def search(self, q, limit=10, offset=0, type="track", market=None):
+        self.serve("search")
+
+        # the wrangle quotes the band name, the market is not modelled. Like spotify the
+        # match ignores case and accents but not punctuation, so "R.I.P." and "R:I:P"
+        # find different artists
+        query = fold_text(urllib.parse.unquote(q).strip())
+        words = normalize_text(query).split()
+        matches = []
+        if words:
+            matches = [self._artists[artist_id] for artist_id in self._by_word.get(words[0], [])
+                       if fold_text(self._artists[artist_id]["name"]).startswith(query)]
+
+        return {"artists": {"items": matches[offset:offset + limit], "total": len(matches), "limit": limit, "offset": offset}}
+
+    def artist_albums(self, artist_id, album_type=None, country=None, limit=20, offset=0):
+        self.serve("artist_albums")
+        albums = self._albums.get(artist_id, [])
+        return {"items": albums[offset:offset + limit], "total": len(albums), "limit": limit, "offset": offset}
+
+    def artist_top_tracks(self, artist_id, country="US"):
+        self.serve("artist_top_tracks")
+        return {"tracks": self._tracks.get(artist_id, [])}
+
+    def audio_features(self, tracks):
+        self.check_ids("audio_features", tracks)
+        self.serve("audio_features")
+        return [self._features.get(track_id) for track_id in tracks]
+
+    """
+    Returns the id of the real artist of a band url, None if the band is not on spotify.
+
+    params:
+        url - the band's url
+    """
+    def expected(self, url):
+        return self._expected.get(url)
+
+    """
+    Returns the calls made and the 429s sent, each keyed by endpoint.
+    """
+    def calls(self):
+        with self._lock:
+            return dict(self._calls), dict(self._rate_limited)
+
+    """
+    Clears the call counters.
+    """
+    def reset(self):
+        with self._lock:
+            self._calls = dict()
+            self._rate_limited = dict()
+
+
+"""
+Returns text without case or accents, its punctuation is kept.
+
+params:
+    text - the text to fold
+"""
+def fold_text(text):
+    text = unicodedata.normalize("NFKD", str(text))
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+"""
+Builds a spotify-looking id that is always the same for the same parts.
+
+params:
+    parts - anything that identifies the object
+"""
+def make_id(*parts):
+    return hashlib.sha1(":".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:22]
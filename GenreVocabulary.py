@@ -0,0 +1,124 @@
+"""
+One way of reading genres for the whole project.
+
+metal-archives writes a band's genres as "Heavy/Thrash Metal", "Death Metal (early);
+Gothic Rock (later)" and the like, spotify lists an artist's genres as "german thrash
+metal". genre_tokens turns any of these into the same lowercased genre names, with
+the eras and the word "metal" left out, since it says nothing about which metal.
+A genre that is only "metal" keeps it, so it still has a token to match on.
+GenreVocabulary gives every genre name an id the first time it is seen and turns a
+column of genre strings into a sparse band by genre matrix, so filtering bands by
+genre, scoring genre overlap and adding up features per genre are done with sparse
+matrix operations instead of string processing.
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import re
+import threading
+import numpy
+from scipy import sparse
+
+
+# the eras a genre can be marked with
+_eras = re.compile(r"\s*\((?:early|mid|later)\)")
+
+# what genres are separated by
+_separators = re.compile(r"[/,;]")
+
+
+"""
+Returns the genre names in a genre string, in the order they first appear and each
+only once. Anything that is not a string, such as a missing genre, has none.
+
+params:
+    genre - a genre string from metal-archives or a genre from spotify
+"""
+def genre_tokens(genre):
+    if not isinstance(genre, str):
+        return []
+
+    tokens = []
+    for part in _separators.split(_eras.sub("", genre.lower())):
+        words = part.split()
+        token = " ".join(word for word in words if word != "metal") or " ".join(words)
+        if token and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+"""
+Class that interns genre names as ids and builds genre matrices from them.
+"""
+class GenreVocabulary:
+    # genre name to id
+    _ids = None
+
+    # genre names in id order
+    _names = None
+
+    # several threads may intern genres at once
+    _lock = None
+
+    """
+    Constructor for a GenreVocabulary object.
+    """
+    def __init__(self):
+        self._ids = dict()
+        self._names = []
+        self._lock = threading.Lock()
+
+    """
+    Returns the id of a genre name, giving it one if it has none yet.
+
+    params:
+        token - a genre name from genre_tokens
+    """
+    def intern(self, token):
+        with self._lock:
+            if token not in self._ids:
+                self._ids[token] = len(self._names)
+                self._names.append(token)
+            return self._ids[token]
+
+    """
+    Returns the ids of the genres in a genre string.
+
+    params:
+        genre - a genre string
+        intern - give unseen genres an id, otherwise they are left out (DEFAULT=True)
+    """
+    def encode(self, genre, intern=True):
+        if intern:
+            return [self.intern(token) for token in genre_tokens(genre)]
+        return [self._ids[token] for token in genre_tokens(genre) if token in self._ids]
+
+    """
+    Builds a sparse matrix with a row per genre string and a column per genre id,
+    holding a 1 where the string has the genre.
+
+    params:
+        genres - the genre strings, one per row
+        intern - give unseen genres an id, otherwise they are left out (DEFAULT=True)
+    """
+    def matrix(self, genres, intern=True):
+        count = 0
+        rows = []
+        columns = []
+        for row, genre in enumerate(genres):
+            ids = self.encode(genre, intern)
+            rows += [row] * len(ids)
+            columns += ids
+            count = row + 1
+
+        return sparse.csr_matrix((numpy.ones(len(rows), dtype="int8"), (rows, columns)), shape=(count, len(self)))
+
+    """
+    Returns the genre names in id order.
+    """
+    def names(self):
+        with self._lock:
+            return list(self._names)
+
+    def __len__(self):
+        return len(self._names)
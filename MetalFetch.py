@@ -0,0 +1,1029 @@
+"""
+HTTP fetch engine for metal-archive.com band pages.
+
+This is an alternative to driving a full Firefox session for every band page.
+The band page is requested with a plain HTTP client and the same css paths that
+MetalScrape.py reads through selenium are pulled out with lxml. The discography
+table on a band page is loaded by javascript from a separate url, so we request
+that url directly instead of waiting for it to appear.
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from contextlib import contextmanager
+import requests
+from lxml import etree, html
+from lxml.cssselect import CSSSelector
+from selenium import webdriver
+from selenium.webdriver.firefox.options import Options
+from RateLimiter import parse_retry_after
+
+
+"""
+Raised whenever a band page could not be fetched or did not have the layout we expect.
+MetalScrape catches this to fall back onto the selenium path.
+"""
+class FetchError(Exception):
+    pass
+
+
+"""
+Class that fetches and parses band pages over plain HTTP.
+"""
+class BandFetcher:
+    # the base link of the site
+    _base = "https://www.metal-archives.com/"
+
+    # the session that holds our pooled connections
+    _session = None
+
+    # how long we wait on a single request before giving up
+    _timeout = 30
+
+    # value to hold the on-disk page cache, None when pages are not cached
+    _cache = None
+
+    # value to hold the rate limiter shared by every fetcher, None when requests are not paced
+    _limiter = None
+
+    # the times a request that got a 429 or 5xx is sent again
+    _retries = 3
+
+    # seconds before the first retry when there is no limiter to wait on and the
+    # site sent no Retry-After, it doubles with every retry
+    _backoff = 1.0
+
+    # the css paths are compiled once and shared by every fetcher
+    _band_name = CSSSelector("h1.band_name")
+    _info_left = CSSSelector("dl.float_left dd")
+    _years_active = CSSSelector("dl.clear dd")
+    _info_right = CSSSelector("dl.float_right dd")
+    _discog_rows = CSSSelector("table.display.discog tbody tr")
+    _discog_data = CSSSelector("td")
+    _discog_link = CSSSelector("td a")
+    _album_name = CSSSelector("h2.album_name")
+    _album_info = CSSSelector("#album_info dl")
+    _album_tracks = CSSSelector("table.display.table_lyrics tr.even, table.display.table_lyrics tr.odd")
+
+    """
+    Initialization method.
+
+    param:
+        base - the root of the site, can be pointed at a local copy for testing
+        timeout - seconds to wait on a single request
+        cache - a PageCache to revalidate pages against (DEFAULT=None)
+        limiter - a RateLimiter that paces the requests (DEFAULT=None)
+    """
+    def __init__(self, base=None, timeout=30, cache=None, limiter=None):
+        if base is not None:
+            self._base = base
+        self._timeout = timeout
+        self._cache = cache
+        self._limiter = limiter
+
+        # a session keeps the connection to the site open between bands
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = "Mozilla/5.0 (X11; Linux x86_64; rv:104.0) Gecko/20100101 Firefox/104.0"
+
+    """
+    Fetches a url and returns the body as text.
+
+    params:
+        url - page to request
+        params - query string values (DEFAULT=None)
+    """
+    def get_page(self, url, params=None):
+        response = self.request(url, params=params)
+        try:
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise FetchError(url + ": " + str(e))
+        return response.text
+
+    """
+    Sends a request through the rate limiter and reports how it went. A 429 or 5xx
+    is sent again once the limiter lets it, up to _retries times. Without a limiter
+    we wait out the Retry-After the site sent, or a backoff that doubles with every
+    retry, before sending it again.
+
+    params:
+        url - page to request
+        params - query string values (DEFAULT=None)
+        headers - extra request headers (DEFAULT=None)
+    """
+    def request(self, url, params=None, headers=None):
+        for attempt in range(self._retries + 1):
+            if self._limiter is not None:
+                self._limiter.acquire("site")
+
+            try:
+                response = self._session.get(url, params=params, headers=headers, timeout=self._timeout)
+            except requests.RequestException as e:
+                # no response is a failure, it must not count as a healthy one
+                if self._limiter is not None:
+                    self._limiter.report("site", None)
+                raise FetchError(url + ": " + str(e))
+
+            if self._limiter is not None:
+                self._limiter.report("site", response.status_code, response.headers.get("Retry-After"))
+
+            if response.status_code != 429 and response.status_code < 500:
+                break
+
+            if self._limiter is None and attempt < self._retries:
+                wait = parse_retry_after(response.headers.get("Retry-After"))
+                time.sleep(self._backoff * 2 ** attempt if wait is None else wait)
+
+        return response
+
+    """
+    Fetches a url through the page cache. A page we have seen before is requested
+    with its ETag and Last-Modified so the site can answer with an empty 304.
+    Returns the body and whether it changed since the last fetch.
+
+    params:
+        url - page to request
+    """
+    def get_cached_page(self, url):
+        if self._cache is None:
+            return self.get_page(url), True
+
+        entry = self._cache.get(url)
+        headers = dict()
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = self.request(url, headers=headers)
+        try:
+            if response.status_code != 304:
+                response.raise_for_status()
+        except requests.RequestException as e:
+            raise FetchError(url + ": " + str(e))
+
+        # nothing changed so we reuse the body we already have
+        if response.status_code == 304 and entry is not None:
+            body = self._cache.body(entry)
+            if body is not None:
+                self._cache.touch(url)
+                return body, False
+
+            # the body is gone, so the entry is a miss and the page is fetched in full
+            self._cache.remove(url)
+            response = self.request(url)
+            try:
+                response.raise_for_status()
+            except requests.RequestException as e:
+                raise FetchError(url + ": " + str(e))
+
+        changed = self._cache.put(url, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return response.text, changed
+
+    """
+    Gets the information for a band and returns it in the same form as
+    MetalScrape.get_band builds it. With a page cache, a band whose pages
+    have not changed is not parsed again.
+
+    params:
+        url - band page to scrape
+        release_urls - if a list is given the urls of the band's release pages are added to it (DEFAULT=None)
+    """
+    def fetch_band(self, url, release_urls=None):
+        band_page, band_changed = self.get_cached_page(url)
+        discog_page, discog_changed = self.get_cached_page(self.discography_url(url))
+
+        if release_urls is not None:
+            release_urls += self.parse_release_urls(discog_page)
+
+        if not band_changed and not discog_changed:
+            band_info = self._cache.get_parsed(url)
+            if band_info is not None:
+                return band_info
+
+        band_info = self.parse_band(band_page, discog_page)
+        if self._cache is not None:
+            self._cache.put_parsed(url, band_info)
+        return band_info
+
+    """
+    Gets one page of the alphabetical band list from the json feed the list
+    page's table is filled from. Returns the total number of bands under the
+    letter and the band urls on this page.
+
+    params:
+        letter - the letter of the list
+        start - index of the first band on the page
+        length - number of bands on the page, the site serves at most 500
+    """
+    def fetch_list_page(self, letter, start, length=500):
+        params = {
+            "sEcho": 1,
+            "iColumns": 4,
+            "iDisplayStart": start,
+            "iDisplayLength": length,
+            "iSortCol_0": 0,
+            "sSortDir_0": "asc",
+            "iSortingCols": 1
+        }
+        page = self.get_page(self._base + "browse/ajax-letter/l/" + letter.upper() + "/json/1", params=params)
+
+        try:
+            feed = json.loads(page)
+            total = int(feed["iTotalRecords"])
+
+            # the first cell of each row is the link to the band page
+            urls = [html.fragment_fromstring(row[0]).get("href") for row in feed["aaData"]]
+        except (ValueError, KeyError, IndexError, TypeError, etree.LxmlError) as e:
+            raise FetchError("unexpected band list feed: " + str(e))
+
+        return total, urls
+
+    """
+    Builds the url that the band page loads its discography table from.
+    Every band url ends with the id of the band.
+
+    params:
+        url - band page url
+    """
+    def discography_url(self, url):
+        band_id = url.rstrip("/").split("/")[-1]
+        return self._base + "band/discography/id/" + band_id + "/tab/all"
+
+    """
+    Parses the band page and the discography table into a band_info dictionary.
+
+    params:
+        band_page - html of the band page
+        discog_page - html of the discography table
+    """
+    def parse_band(self, band_page, discog_page):
+
+        # create a new dictionary that will hold the information
+        band_info = dict()
+
+        band_tree = parse_page(band_page)
+
+        # the page is missing one of our css paths, so it is not a band page we understand
+        try:
+            band_info["Band name"] = inner_text(self._band_name(band_tree)[0])
+
+            # Country of origin, Location, Status, and [Year] Formed In
+            info_left = self._info_left(band_tree)
+            band_info["Country of origin"] = inner_text(info_left[0])
+            band_info["Location"] = inner_text(info_left[1])
+            band_info["Status"] = inner_text(info_left[2])
+            band_info["Formed in"] = inner_text(info_left[3])
+
+            band_info["Years active"] = inner_text(self._years_active(band_tree)[0])
+
+            # Genre, Lyrical themes, Current/Last label
+            info_right = self._info_right(band_tree)
+            band_info["Genre"] = inner_text(info_right[0])
+            band_info["Lyrical themes"] = inner_text(info_right[1])
+            band_info["Current/Last label"] = inner_text(info_right[2])
+        except (IndexError, AttributeError, TypeError, ValueError) as e:
+            raise FetchError("unexpected band page layout: " + str(e))
+
+        band_info["Discography"] = self.parse_discography(discog_page)
+
+        return band_info
+
+    """
+    Parses the rows of a discography table.
+
+    params:
+        discog_page - html of the discography table
+    """
+    def parse_discography(self, discog_page):
+
+        # list to hold all discography projects
+        disco = []
+
+        discog_tree = parse_page(discog_page)
+        try:
+            for entry in self._discog_rows(discog_tree):
+                data = self._discog_data(entry)
+
+                # an empty discography is a single placeholder td
+                if len(data) <= 2:
+                    break
+
+                disco.append({
+                    "Name": inner_text(data[0]),
+                    "Type": inner_text(data[1]),
+                    "Year": inner_text(data[2])
+                })
+        except (IndexError, AttributeError, TypeError, ValueError) as e:
+            raise FetchError("unexpected discography layout: " + str(e))
+
+        return disco
+
+    """
+    Returns the url of each release page linked from a discography table.
+
+    params:
+        discog_page - html of the discography table
+    """
+    def parse_release_urls(self, discog_page):
+        discog_tree = parse_page(discog_page)
+        urls = []
+        for entry in self._discog_rows(discog_tree):
+            links = self._discog_link(entry)
+            if links and links[0].get("href"):
+                urls.append(links[0].get("href"))
+        return urls
+
+    """
+    Gets the information and track listing of a release page.
+
+    params:
+        url - release page to scrape
+    """
+    def fetch_release(self, url):
+        return self.parse_release(self.get_page(url))
+
+    """
+    Parses a release page into a dictionary. The release details are the dt/dd
+    pairs of the album info block, keyed by their dt label (Type, Release date,
+    Catalog ID, Label, Format, ...).
+
+    params:
+        release_page - html of the release page
+    """
+    def parse_release(self, release_page):
+        tree = parse_page(release_page)
+
+        release_info = dict()
+        try:
+            release_info["Name"] = inner_text(self._album_name(tree)[0])
+
+            for block in self._album_info(tree):
+                for dt, dd in zip(block.findall("dt"), block.findall("dd")):
+                    release_info[inner_text(dt).rstrip(":")] = inner_text(dd)
+
+            # each track row is number, title, length and a lyrics link
+            tracks = []
+            for row in self._album_tracks(tree):
+                data = row.findall("td")
+                if len(data) < 3:
+                    continue
+                tracks.append({
+                    "Number": inner_text(data[0]).rstrip("."),
+                    "Title": inner_text(data[1]),
+                    "Length": inner_text(data[2])
+                })
+            release_info["Tracks"] = tracks
+        except (IndexError, AttributeError, TypeError, ValueError) as e:
+            raise FetchError("unexpected release page layout: " + str(e))
+
+        return release_info
+
+
+"""
+Parses the html of a page. An empty or garbled body raises FetchError like any
+other page we cannot read, so the caller falls back onto selenium.
+
+params:
+    page - html of the page
+"""
+def parse_page(page):
+    try:
+        return html.fromstring(page)
+    except (etree.LxmlError, ValueError) as e:
+        raise FetchError("could not parse page: " + str(e))
+
+
+"""
+Returns the text of an element, cleaned with clean_text.
+
+params:
+    element - lxml element
+"""
+def inner_text(element):
+    return clean_text(element.text_content())
+
+
+"""
+Cleans the text of a field the same way on every engine. A browser's innerText
+keeps some whitespace at the ends of a field, a trailing space after a label or
+a release name, that the html does not tell us about, so rather than guess at it
+every engine collapses runs of whitespace (non-breaking spaces included) into one
+space and strips the ends. The http engine cleans lxml's text with it and the
+selenium paths clean innerText with it, so the same page gives the same band_info.
+
+params:
+    text - the text of a field
+"""
+def clean_text(text):
+    return " ".join(text.split())
+
+
+"""
+Class that scrapes many band pages at once with a pool of worker threads.
+Each worker has its own BandFetcher (and so its own connections) and pulls urls
+from a shared queue. No more than per_host requests are sent to a single host at
+the same time, however many workers there are.
+"""
+class BandPool:
+    # the number of worker threads
+    _workers = 4
+
+    # the most requests we allow in flight against one host
+    _per_host = 4
+
+    # the root of the site handed to each worker's fetcher
+    _base = None
+
+    # the page cache shared by every worker
+    _cache = None
+
+    # the rate limiter shared by every worker
+    _limiter = None
+
+    # one semaphore per host, shared by all workers
+    _host_slots = None
+
+    # guards _host_slots and the result dictionaries
+    _lock = None
+
+    """
+    Initialization method.
+
+    param:
+        workers - number of worker threads (DEFAULT=4)
+        per_host - most concurrent requests against one host (DEFAULT=4)
+        base - the root of the site, can be pointed at a local copy for testing
+        cache - a PageCache shared by the workers (DEFAULT=None)
+        limiter - a RateLimiter shared by the workers (DEFAULT=None)
+    """
+    def __init__(self, workers=4, per_host=4, base=None, cache=None, limiter=None):
+        self._workers = max(1, workers)
+        self._per_host = max(1, per_host)
+        self._base = base
+        self._cache = cache
+        self._limiter = limiter
+        self._host_slots = dict()
+        self._lock = threading.Lock()
+
+    """
+    Returns the semaphore that caps the requests against the host of a url.
+
+    params:
+        url - the url about to be requested
+    """
+    def host_slot(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self._per_host)
+            return self._host_slots[host]
+
+    """
+    Scrapes every url and returns two values, a dictionary of band_info keyed by
+    url in the same order as the urls were given, and a list of the urls that could
+    not be fetched so the caller can retry them another way. If on_band is given it
+    is called with (url, band_info) as soon as each band is scraped, from the worker
+    thread and without holding the pool's lock, and the bands are not kept, so the
+    dictionary comes back empty.
+
+    params:
+        urls - band pages to scrape
+        on_band - function called with each scraped band (DEFAULT=None)
+        on_release - function called with the url of each release found in a band's
+                     discography, from the worker thread that found it (DEFAULT=None)
+    """
+    def scrape(self, urls, on_band=None, on_release=None):
+        work = queue.Queue()
+        for url in urls:
+            work.put(url)
+
+        bands = dict()
+        failed = []
+
+        # the body of each worker thread
+        def worker():
+            fetcher = BandFetcher(base=self._base, cache=self._cache, limiter=self._limiter)
+            while True:
+                try:
+                    url = work.get_nowait()
+                except queue.Empty:
+                    return
+
+                release_urls = [] if on_release is not None else None
+                try:
+                    with self.host_slot(url):
+                        band_info = fetcher.fetch_band(url, release_urls)
+                except Exception as e:
+                    # any error only fails this url, the worker carries on with the next
+                    print("http fetch failed: " + url + ": " + str(e))
+                    with self._lock:
+                        failed.append(url)
+                    continue
+
+                # handed over outside the lock, the next stage may block to slow us down
+                if on_band is not None:
+                    on_band(url, band_info)
+                else:
+                    with self._lock:
+                        bands[url] = band_info
+
+                # handed over outside the lock as a full release queue blocks
+                if on_release is not None:
+                    for release_url in release_urls:
+                        on_release(release_url)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(self._workers, len(urls)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # put the results back in the order the urls were given
+        ordered = {url: bands[url] for url in urls if url in bands}
+        failed = set(failed)
+        failed = [url for url in urls if url in failed]
+        return ordered, failed
+
+
+"""
+Class that scrapes release pages in a second pipeline stage while the band pages
+are still being scraped. Release urls are handed over through a bounded queue, so
+when the release workers fall behind the band scraping waits for them instead of
+the queue growing, and memory stays flat however large the discographies are.
+Each release is written to its own json lines stream keyed by release url. With a
+frontier every release is recorded as pending, done or failed, so a resumed scrape
+can retry the failed ones and skip the ones already written.
+"""
+class ReleaseStage:
+    # the queue of release urls waiting to be scraped
+    _queue = None
+
+    # the worker threads
+    _threads = None
+
+    # the writer the releases are streamed to
+    _writer = None
+
+    # release urls that were already queued, several bands can share a split release
+    _seen = None
+
+    # release urls that could not be scraped
+    _failed = None
+
+    # guards _seen, _failed and the writer
+    _lock = None
+
+    # the ScrapeFrontier the releases are recorded in
+    _frontier = None
+
+    """
+    Initialization method.
+
+    param:
+        writer - a JsonlWriter the releases are written to
+        workers - number of worker threads (DEFAULT=2)
+        queue_size - the most release urls waiting at once (DEFAULT=100)
+        base - the root of the site (DEFAULT=None)
+        limiter - a RateLimiter shared with the band scraping (DEFAULT=None)
+        frontier - a ScrapeFrontier the releases are recorded in (DEFAULT=None)
+    """
+    def __init__(self, writer, workers=2, queue_size=100, base=None, limiter=None, frontier=None):
+        self._writer = writer
+        self._frontier = frontier
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._seen = set()
+        self._failed = []
+        self._lock = threading.Lock()
+
+        self._threads = [
+            threading.Thread(target=self.worker, args=(BandFetcher(base=base, limiter=limiter),), daemon=True)
+            for _ in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    """
+    Queues a release url, blocking while the queue is full. A release the frontier
+    has as done was written by an earlier run and is not queued again, nor is one
+    that has failed too many times.
+
+    params:
+        url - release page url
+    """
+    def put(self, url):
+        with self._lock:
+            if url in self._seen:
+                return
+            self._seen.add(url)
+        if self._frontier is not None:
+            if self._frontier.is_finished(url):
+                return
+            self._frontier.add([url])
+        self._queue.put(url)
+
+    """
+    The body of each worker thread.
+
+    params:
+        fetcher - the worker's own BandFetcher
+    """
+    def worker(self, fetcher):
+        while True:
+            url = self._queue.get()
+
+            # None tells the worker there is nothing more to do
+            if url is None:
+                self._queue.task_done()
+                return
+
+            # any error only fails this release, a dead worker would leave put blocked
+            # on a full queue and close waiting on it forever
+            try:
+                release_info = fetcher.fetch_release(url)
+                with self._lock:
+                    self._writer.write(url, release_info)
+                if self._frontier is not None:
+                    self._frontier.mark_done(url)
+            except Exception as e:
+                print("release fetch failed: " + url + ": " + str(e))
+                with self._lock:
+                    self._failed.append(url)
+                    # a failed release can be queued again by a retry
+                    self._seen.discard(url)
+                if self._frontier is not None:
+                    self._frontier.mark_failed(url)
+            finally:
+                self._queue.task_done()
+
+    """
+    Returns the release urls that could not be scraped.
+    """
+    def failed(self):
+        with self._lock:
+            return list(self._failed)
+
+    """
+    Waits for every release queued so far to be scraped or fail.
+    """
+    def drain(self):
+        self._queue.join()
+
+    """
+    Waits for every queued release to be scraped and closes the stream.
+    """
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._writer.close()
+
+
+"""
+Collects the band urls for a letter from the list's json feed. The first page
+tells us how many bands there are, the rest of the pages are fetched in parallel
+and put back together in list order.
+
+params:
+    letter - the letter of the list
+    num_bands - the most urls to return
+    workers - number of pages fetched at once (DEFAULT=4)
+    page_size - bands per page, the site serves at most 500 (DEFAULT=500)
+    base - the root of the site (DEFAULT=None)
+    limiter - a RateLimiter that paces the requests (DEFAULT=None)
+"""
+def collect_band_urls(letter, num_bands, workers=4, page_size=500, base=None, limiter=None):
+    total, urls = BandFetcher(base=base, limiter=limiter).fetch_list_page(letter, 0, page_size)
+
+    # the starting index of every page we still need
+    starts = list(range(page_size, min(total, num_bands), page_size))
+
+    # each thread keeps its own fetcher as sessions are not safe to share
+    local = threading.local()
+
+    def fetch(start):
+        if not hasattr(local, "fetcher"):
+            local.fetcher = BandFetcher(base=base, limiter=limiter)
+        return local.fetcher.fetch_list_page(letter, start, page_size)[1]
+
+    # map keeps the pages in the order they were asked for
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for page in executor.map(fetch, starts):
+            urls += page
+
+    return urls[:num_bands]
+
+
+"""
+Class that keeps fetched pages on disk between scrapes. Each url has a small json
+entry holding its fetch time, ETag, Last-Modified, the hash of its body and, for
+band pages, the band_info that was parsed from it. Bodies are stored once under
+the hash of their content, so two urls serving the same page share one file.
+"""
+class PageCache:
+    # the directory the cache lives in
+    _directory = ""
+
+    """
+    Initialization method.
+
+    param:
+        directory - where the cache is kept, it is created if it does not exist
+    """
+    def __init__(self, directory):
+        self._directory = directory
+        os.makedirs(os.path.join(directory, "entries"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "bodies"), exist_ok=True)
+
+    """
+    Returns the path of the entry for a url.
+
+    params:
+        url - the cached url
+    """
+    def entry_path(self, url):
+        return os.path.join(self._directory, "entries", hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+    """
+    Returns the path of a body from the hash of its content.
+
+    params:
+        content_hash - sha1 of the body
+    """
+    def body_path(self, content_hash):
+        return os.path.join(self._directory, "bodies", content_hash + ".html")
+
+    """
+    Returns the entry for a url, or None if it has not been cached.
+
+    params:
+        url - the cached url
+    """
+    def get(self, url):
+        try:
+            with open(self.entry_path(url), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    """
+    Returns the cached body of an entry, or None if the body file is missing, for
+    example after a partial cleanup.
+
+    params:
+        entry - an entry returned by get
+    """
+    def body(self, entry):
+        try:
+            with open(self.body_path(entry["content_hash"]), "r", encoding="utf-8") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    """
+    Drops the entry for a url, the next fetch of it is a miss.
+
+    params:
+        url - the cached url
+    """
+    def remove(self, url):
+        try:
+            os.remove(self.entry_path(url))
+        except FileNotFoundError:
+            pass
+
+    """
+    Stores a freshly fetched page and returns whether its content differs from what
+    was cached. A page whose body hashes the same keeps its parsed band_info.
+
+    params:
+        url - the fetched url
+        body - the page body
+        etag - the ETag header, if any
+        last_modified - the Last-Modified header, if any
+    """
+    def put(self, url, body, etag, last_modified):
+        content_hash = hashlib.sha1(body.encode("utf-8")).hexdigest()
+        entry = self.get(url)
+        changed = entry is None or entry.get("content_hash") != content_hash
+
+        if not os.path.exists(self.body_path(content_hash)):
+            self.write_file(self.body_path(content_hash), body)
+
+        new_entry = {
+            "url": url,
+            "fetched": time.time(),
+            "etag": etag,
+            "last_modified": last_modified,
+            "content_hash": content_hash
+        }
+        if not changed and "band_info" in entry:
+            new_entry["band_info"] = entry["band_info"]
+
+        self.write_file(self.entry_path(url), json.dumps(new_entry, ensure_ascii=False))
+        return changed
+
+    """
+    Records that a url was revalidated without changing.
+
+    params:
+        url - the cached url
+    """
+    def touch(self, url):
+        entry = self.get(url)
+        if entry is not None:
+            entry["fetched"] = time.time()
+            self.write_file(self.entry_path(url), json.dumps(entry, ensure_ascii=False))
+
+    """
+    Returns the band_info parsed from a cached band page, or None.
+
+    params:
+        url - the band page url
+    """
+    def get_parsed(self, url):
+        entry = self.get(url)
+        if entry is None:
+            return None
+        return entry.get("band_info")
+
+    """
+    Stores the band_info parsed from a band page next to its entry.
+
+    params:
+        url - the band page url
+        band_info - the parsed dictionary
+    """
+    def put_parsed(self, url, band_info):
+        entry = self.get(url)
+        if entry is not None:
+            entry["band_info"] = band_info
+            self.write_file(self.entry_path(url), json.dumps(entry, ensure_ascii=False))
+
+    """
+    Writes a file by replacing it whole, so a worker never reads half of one.
+
+    params:
+        path - file to write
+        text - the contents
+    """
+    def write_file(self, path, text):
+        temp = path + "." + str(threading.get_ident()) + ".tmp"
+        with open(temp, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(temp, path)
+
+
+"""
+Class that manages a pool of headless Firefox instances for the selenium path.
+Each driver is reused for many band pages and is quit and replaced after
+recycle_after pages, which caps how much memory a long running browser can leak.
+The drivers do not load images, stylesheets or fonts, and every request to a host
+other than the site is sent to a dead proxy so ads and third party scripts never load.
+"""
+class DriverPool:
+    # the most drivers open at once
+    _size = 2
+
+    # pages a driver loads before it is replaced
+    _recycle_after = 200
+
+    # the only host the drivers are allowed to reach
+    _site_host = "metal-archives.com"
+
+    # idle drivers waiting to be handed out, as [driver, pages loaded]
+    _idle = None
+
+    # the number of drivers currently open
+    _open = 0
+
+    # guards _idle and _open, and wakes a caller waiting for a driver when one is
+    # handed back or retired
+    _available = None
+
+    """
+    Initialization method.
+
+    param:
+        size - the most drivers open at once (DEFAULT=2)
+        recycle_after - pages a driver loads before it is replaced (DEFAULT=200)
+        site_host - the host the drivers may load resources from (DEFAULT="metal-archives.com")
+    """
+    def __init__(self, size=2, recycle_after=200, site_host="metal-archives.com"):
+        self._size = max(1, size)
+        self._recycle_after = max(1, recycle_after)
+        self._site_host = site_host
+        self._idle = []
+        self._open = 0
+        self._available = threading.Condition()
+
+    """
+    Returns the most drivers the pool will open at once.
+    """
+    def size(self):
+        return self._size
+
+    """
+    Starts a new headless driver that only loads what we read.
+    """
+    def start_driver(self):
+        options = Options()
+        options.add_argument("-headless")
+
+        # return as soon as the document is parsed, the discography wait covers the rest
+        options.page_load_strategy = "eager"
+
+        # no images, stylesheets or site fonts
+        options.set_preference("permissions.default.image", 2)
+        options.set_preference("permissions.default.stylesheet", 2)
+        options.set_preference("browser.display.use_document_fonts", 0)
+        options.set_preference("dom.disable_open_during_load", False)
+
+        # a proxy auto-config script that lets the site through and points
+        # every other host at a port nothing listens on
+        pac = (
+            "function FindProxyForURL(url, host) {"
+            " if (dnsDomainIs(host, '" + self._site_host + "')) return 'DIRECT';"
+            " return 'PROXY 127.0.0.1:9'; }"
+        )
+        options.set_preference("network.proxy.type", 2)
+        options.set_preference("network.proxy.autoconfig_url", "data:text/javascript," + pac)
+
+        return webdriver.Firefox(options=options)
+
+    """
+    Hands out a driver for the length of a with block, waiting for one to be free
+    if the pool is full.
+    """
+    @contextmanager
+    def driver(self):
+        with self._available:
+            while not self._idle and self._open >= self._size:
+                self._available.wait()
+
+            # an idle driver if there is one, otherwise there is room to open another
+            slot = None
+            if self._idle:
+                slot = self._idle.pop()
+            else:
+                self._open += 1
+
+        if slot is None:
+            try:
+                slot = [self.start_driver(), 0]
+            except Exception:
+                with self._available:
+                    self._open -= 1
+                    self._available.notify()
+                raise
+
+        try:
+            yield slot[0]
+        except Exception:
+            # a driver that errored may be in a bad state, so it is replaced
+            self.retire(slot)
+            raise
+
+        slot[1] += 1
+        if slot[1] >= self._recycle_after:
+            self.retire(slot)
+        else:
+            with self._available:
+                self._idle.append(slot)
+                self._available.notify()
+
+    """
+    Quits a driver and frees its place in the pool, a caller waiting for a driver
+    then opens a new one.
+
+    params:
+        slot - the [driver, pages loaded] pair
+    """
+    def retire(self, slot):
+        try:
+            slot[0].quit()
+        except Exception:
+            pass
+        with self._available:
+            self._open -= 1
+            self._available.notify()
+
+    """
+    Quits every idle driver.
+    """
+    def close(self):
+        with self._available:
+            idle = self._idle
+            self._idle = []
+        for slot in idle:
+            self.retire(slot)
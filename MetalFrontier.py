@@ -0,0 +1,211 @@
+"""
+Persistent scrape frontier for MetalScrape.py.
+
+Every band url that is discovered is recorded in a small sqlite database along
+with whether it is pending, done, or failed, how many times it was attempted
+and when it was last attempted. A scrape that is stopped part of the way through
+can then be restarted without redoing the bands that are already done, and bands
+that failed are retried with a backoff that doubles after every failure. The
+release pages found in the discographies are kept the same way, in a table of
+their own in the same database.
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import sqlite3
+import threading
+import time
+
+
+"""
+Class that keeps track of which bands still need to be scraped.
+"""
+class ScrapeFrontier:
+    # the sqlite connection
+    _conn = None
+
+    # the table the urls are kept in, "frontier" for bands
+    _table = "frontier"
+
+    # the worker pool marks bands from several threads
+    _lock = None
+
+    # seconds to wait before the first retry of a failed band
+    _backoff = 60
+
+    # the longest we ever wait before retrying
+    _max_backoff = 3600
+
+    # the number of failures after which a band is given up on
+    _max_attempts = 5
+
+    """
+    Initialization method.
+
+    param:
+        filename - the sqlite file, it is created if it does not exist
+        backoff - seconds before the first retry of a failed band (DEFAULT=60)
+        max_backoff - the longest wait before a retry (DEFAULT=3600)
+        max_attempts - failures before a band is given up on (DEFAULT=5)
+        table - the table the urls are kept in, "releases" for release pages (DEFAULT="frontier")
+    """
+    def __init__(self, filename, backoff=60, max_backoff=3600, max_attempts=5, table="frontier"):
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._max_attempts = max_attempts
+        self._table = table
+        self._lock = threading.Lock()
+
+        # the bands and the releases each have a connection to the same file
+        self._conn = sqlite3.connect(filename, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS " + self._table + " ("
+            "url TEXT PRIMARY KEY, position INTEGER, state TEXT, attempts INTEGER, last_attempt REAL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+    """
+    Returns True once the whole list of urls has been recorded.
+    """
+    def is_listed(self):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (self.listed_key(),)).fetchone()
+        return row is not None
+
+    """
+    Records newly discovered urls as pending. Urls already in the frontier keep their state.
+
+    params:
+        urls - band urls in list order
+    """
+    def add(self, urls):
+        with self._lock:
+            start = self._conn.execute("SELECT COUNT(*) FROM " + self._table).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO " + self._table + " VALUES (?, ?, 'pending', 0, NULL)",
+                [(url, start + i) for i, url in enumerate(urls)]
+            )
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, '1')", (self.listed_key(),))
+            self._conn.commit()
+
+    """
+    Returns every url in list order.
+    """
+    def urls(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT url FROM " + self._table + " ORDER BY position").fetchall()
+        return [row[0] for row in rows]
+
+    """
+    Returns the urls that should be scraped now, in list order. That is every pending
+    url plus the failed urls whose backoff has run out.
+
+    params:
+        now - the current time (DEFAULT=time.time())
+    """
+    def todo(self, now=None):
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url, state, attempts, last_attempt FROM " + self._table + " "
+                "WHERE state = 'pending' OR (state = 'failed' AND attempts < ?) ORDER BY position",
+                (self._max_attempts,)
+            ).fetchall()
+
+        urls = []
+        for url, state, attempts, last_attempt in rows:
+            if state == "failed" and self.retry_at(attempts, last_attempt) > now:
+                continue
+            urls.append(url)
+        return urls
+
+    """
+    Returns the time the next failed url that has not been given up on can be
+    retried, None if there is no such url.
+    """
+    def next_retry(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT attempts, last_attempt FROM " + self._table + " WHERE state = 'failed' AND attempts < ?",
+                (self._max_attempts,)
+            ).fetchall()
+
+        if not rows:
+            return None
+        return min(self.retry_at(attempts, last_attempt) for attempts, last_attempt in rows)
+
+    """
+    Returns the time a failed url can be retried, its backoff doubles with every failure.
+
+    params:
+        attempts - the times the url was attempted
+        last_attempt - the time of the last attempt
+    """
+    def retry_at(self, attempts, last_attempt):
+        return last_attempt + min(self._backoff * 2 ** (attempts - 1), self._max_backoff)
+
+    """
+    Returns True if a url is done or has failed too many times to be tried again.
+
+    params:
+        url - the url
+    """
+    def is_finished(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, attempts FROM " + self._table + " WHERE url = ?", (url,)
+            ).fetchone()
+        return row is not None and (row[0] == "done" or (row[0] == "failed" and row[1] >= self._max_attempts))
+
+    """
+    Returns the meta key that records the table's urls were listed, the bands keep
+    the key they always had.
+    """
+    def listed_key(self):
+        return "listed" if self._table == "frontier" else "listed:" + self._table
+
+    """
+    Marks a url as done.
+
+    params:
+        url - the band url
+    """
+    def mark_done(self, url):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE " + self._table + " SET state = 'done', attempts = attempts + 1, last_attempt = ? WHERE url = ?",
+                (time.time(), url)
+            )
+            self._conn.commit()
+
+    """
+    Marks a url as failed so it is retried after its backoff.
+
+    params:
+        url - the band url
+    """
+    def mark_failed(self, url):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE " + self._table + " SET state = 'failed', attempts = attempts + 1, last_attempt = ? WHERE url = ?",
+                (time.time(), url)
+            )
+            self._conn.commit()
+
+    """
+    Returns the number of urls in each state.
+    """
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM " + self._table + " GROUP BY state").fetchall()
+        return dict(rows)
+
+    """
+    Closes the database.
+    """
+    def close(self):
+        with self._lock:
+            self._conn.close()
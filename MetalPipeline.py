@@ -0,0 +1,181 @@
+"""
+Runs MetalScrape.py and the spotify matching of MetalScrapeWrangle.py at the same
+time instead of one after the other.
+
+The scrape mostly waits on metal-archives and the matching mostly waits on
+spotify, so there is no reason for either to wait on the other. Every band the
+scraper stores is put on a bounded queue, and a pool of match workers takes it
+from there and matches it on spotify straight away. Each match is recorded in the
+journal spotify_artist_search keeps. When the scrape is done the regular wrangle is
+run on its json lines file, it finds every band already matched in the journal and
+only has the top tracks left to get. A full queue makes the scraper wait, so the
+bands waiting to be matched never pile up in memory.
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import queue
+import threading
+from os.path import exists
+from MetalScrape import MetalScrape
+from MetalScrapeWrangle import MetalWrangle, bands_frame, country_codes
+from MetalStream import RowJournal
+from SpotifyCache import ResponseCache
+
+
+"""
+Class that matches bands on spotify one at a time as they come in, with the same
+rate limiter, cache and matching as MetalWrangle but without running its stages.
+"""
+class BandMatcher(MetalWrangle):
+    # the country codes, loaded once instead of for every band
+    _codes = None
+
+    """
+    Constructor for a BandMatcher object.
+
+    param:
+        cid - client id
+        scid - secret client id
+        workers - the number of bands matched at once
+        cache - sqlite file spotify responses are cached in, None to not cache
+    """
+    def __init__(self, cid, scid, workers, cache):
+        self._cid = cid
+        self._scid = scid
+        self._workers = workers
+        if cache is not None:
+            self._cache = ResponseCache(cache)
+        self.authorize_spotify()
+        self._codes = country_codes()
+
+    """
+    Returns the spotify id of a band, or None if it cannot be found.
+
+    param:
+        url - the url of the band page
+        band_info - the dictionary of the band's information
+    """
+    def match_band(self, url, band_info):
+        df = bands_frame([(url, band_info)])
+        mapped = self._codes.get(df.at[0, "Country of origin"])
+        df["Country code"] = [mapped]
+        return self.match_artist(self.match_rows(df)[0])
+
+    """
+    Closes the response cache.
+    """
+    def close(self):
+        if self._cache is not None:
+            self._cache.close()
+
+
+"""
+Class that connects the scraper to the matching through a bounded queue.
+"""
+class MetalPipeline:
+    # the bands scraped but not matched yet
+    _queue = None
+
+    # the matcher the workers share
+    _matcher = None
+
+    # the journal of spotify_artist_search the matches are recorded in
+    _journal = None
+
+    # the number of bands matched so far
+    _matched = 0
+
+    # guards _matched
+    _lock = None
+
+    # the MetalWrangle run once the scrape is done
+    _wrangle = None
+
+    """
+    Constructor for a MetalPipeline object. Scrapes the letter, matches its bands on
+    spotify as they are scraped, and then runs the rest of the wrangle.
+
+    param:
+        letter - What letter the bands we pull will begin with
+        num_bands - the number of bands to call
+        cid - client id
+        scid - secret client id
+        match_workers - the number of bands matched on spotify at once (DEFAULT=4)
+        queue_size - the most bands waiting to be matched before the scraper waits (DEFAULT=100)
+        cache - sqlite file spotify responses are cached in, None to not cache (DEFAULT="spotify_cache.db")
+        scrape_options - passed on to MetalScrape, such as engine, workers or resume
+    """
+    def __init__(self, letter, num_bands, cid, scid, match_workers=4, queue_size=100, cache="spotify_cache.db",
+                 **scrape_options):
+        # matches would be thrown away if the wrangle then loads an existing csv
+        if exists("spotify_artists_by_" + letter + ".csv"):
+            print("spotify_artists_by_" + letter + ".csv already exists, run MetalWrangle incrementally instead.")
+            exit(-1)
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._matched = 0
+        self._matcher = BandMatcher(cid, scid, match_workers, cache)
+        self._journal = RowJournal(self._matcher.journal_for("spotify_artists_by_" + letter + ".csv"))
+
+        workers = [threading.Thread(target=self.match_worker, daemon=True) for _ in range(match_workers)]
+        for worker in workers:
+            worker.start()
+
+        # the bands have to be streamed to disk, the wrangle reads them from there
+        scrape_options["stream"] = True
+        try:
+            MetalScrape(letter, num_bands, on_band=self.put_band, **scrape_options)
+        finally:
+            # one stop per worker, each is taken after the bands queued before it
+            for _ in workers:
+                self._queue.put(None)
+            for worker in workers:
+                worker.join()
+            self._journal.close()
+            self._matcher.close()
+
+        print(str(self._matched) + " bands matched while scraping.")
+
+        # every band is in the journal now, so this only gets the top tracks
+        self._wrangle = MetalWrangle(filename="./metal-scrape-reis-gadsden_by_" + letter + ".jsonl", cid=cid, scid=scid,
+                                     letter=letter, workers=match_workers, cache=cache)
+
+    """
+    Queues a band the scraper just stored. Blocks while the queue is full.
+
+    params:
+        url - the url of the band page
+        band_info - the dictionary of the band's information
+    """
+    def put_band(self, url, band_info):
+        # a band matched by an earlier run that was stopped is not matched again
+        if url not in self._journal:
+            self._queue.put((url, band_info))
+
+    """
+    Matches bands from the queue until it is told to stop.
+    """
+    def match_worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            url, band_info = item
+            try:
+                self._journal.record(url, self._matcher.match_band(url, band_info))
+            except Exception as e:
+                # the band stays out of the journal, so the wrangle matches it again at the end
+                print("Could not match " + url + ": " + str(e))
+                continue
+
+            with self._lock:
+                self._matched += 1
+
+    """
+    Returns a deep copy of the finished wrangle's DataFrame.
+    """
+    def get_df(self):
+        return self._wrangle.get_df()
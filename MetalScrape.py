@@ -21,13 +21,20 @@ author: Reis Gadsden 2022-08-30
 class: CS-5245 @ Appalachian State University
 """
 # needed imports
-import time
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as ec
+from MetalFetch import BandFetcher, BandPool, DriverPool, FetchError, PageCache, ReleaseStage, clean_text, collect_band_urls
+from MetalStream import JsonlWriter
+from MetalFrontier import ScrapeFrontier
+from RateLimiter import RateLimiter
 
 """
 Class that handles the scrapping and compilation of data.
@@ -39,6 +46,9 @@ class MetalScrape:
     # the url of alphabetical list we pull from
     _list_base = ""
 
+    # the letter of the list we pull from
+    _letter = ""
+
     # value to hold the selenium driver
     _driver = ""
 
@@ -51,6 +61,71 @@ class MetalScrape:
     # value that holds the number of bands to gather
     _num_bands = 0
 
+    # which engine band pages are fetched with, "http" or "selenium"
+    _engine = "http"
+
+    # value to hold the http band fetcher
+    _fetcher = None
+
+    # the number of band pages fetched at once by the http engine
+    _workers = 1
+
+    # the most band pages fetched at once from a single host
+    _per_host = 4
+
+    # value to hold the json lines writer when streaming
+    _writer = None
+
+    # value to hold the scrape frontier when resuming
+    _frontier = None
+
+    # value to hold the frontier of the release pages when resuming
+    _release_frontier = None
+
+    # value to hold the on-disk page cache
+    _cache = None
+
+    # value to hold the pool of headless drivers for band pages
+    _driver_pool = None
+
+    # value to hold the rate limiter every request to the site goes through
+    _limiter = None
+
+    # value to hold the release page stage, None when releases are not scraped
+    _release_stage = None
+
+    # guards the writer and the class dictionary when bands are stored from several threads
+    _store_lock = None
+
+    # called with every band once it is stored, None when nothing waits on the bands
+    _on_band = None
+
+    # how the selenium path reads a band page, "script" or "elements"
+    _extraction = "script"
+
+    # reads the whole band record inside the page so it costs one round trip
+    # instead of one per field, it reads the same css paths as read_band_elements
+    _extract_script = """
+        var left = document.querySelectorAll("dl.float_left dd");
+        var right = document.querySelectorAll("dl.float_right dd");
+        var rows = document.querySelectorAll("table.display.discog tbody tr");
+        var disco = [];
+        for (var i = 0; i < rows.length; i++) {
+            var data = rows[i].querySelectorAll("td");
+            if (data.length <= 2) {
+                break;
+            }
+            disco.push([data[0].innerText, data[1].innerText, data[2].innerText]);
+        }
+        return {
+            "name": document.querySelector("h1.band_name").innerText,
+            "left": [left[0].innerText, left[1].innerText, left[2].innerText, left[3].innerText],
+            "active": document.querySelector("dl.clear dd").innerText,
+            "right": [right[0].innerText, right[1].innerText, right[2].innerText],
+            "disco": disco
+        };
+    """
+
     """
     Initialization method.
     This method will set our class variables as well as make calls to other methods.
@@ -58,12 +133,121 @@ class MetalScrape:
     param:
         letter - What letter the bands we pull will begin with
         num_bands - the number of bands to call
+        engine - "http" to fetch band pages with a plain http client, falling back
+                 onto selenium if a page cannot be parsed, or "selenium" (DEFAULT="http")
+        workers - number of band pages the http engine fetches at once (DEFAULT=1)
+        per_host - most band pages fetched at once from a single host (DEFAULT=4)
+        stream - append each band to a json lines file as soon as it is scraped
+                 instead of holding every band until the end (DEFAULT=False)
+        resume - record every band in a frontier file so a stopped scrape picks up where
+                 it left off, bands and releases that are done are skipped and failed ones
+                 are retried with backoff. This implies stream (DEFAULT=False)
+        cache_dir - directory of a page cache the http engine revalidates band pages
+                    against, so an unchanged band is not downloaded or parsed again (DEFAULT=None)
+        drivers - when above 0, band pages that need selenium are loaded by a pool of this
+                  many headless, resource blocking drivers instead of the one list page
+                  driver, and the selenium engine scrapes with all of them at once (DEFAULT=0)
+        recycle_after - band pages a pooled driver loads before it is replaced (DEFAULT=200)
+        extraction - "script" to read a band page with selenium in a single script call, or
+                     "elements" to read each element on its own (DEFAULT="script")
+        releases - also scrape the release page of every release found by the http engine,
+                   with this many workers, into its own json lines file (DEFAULT=0)
+        on_band - function called with the url and band_info of every band once it is
+                  stored, so a later stage can start on it straight away (DEFAULT=None)
+        base - the root of the site, can be pointed at a local copy such as FakeSite
+               for testing (DEFAULT=None)
     """
-    def __init__(self, letter, num_bands):
+    def __init__(self, letter, num_bands, engine="http", workers=1, per_host=4, stream=False, resume=False, cache_dir=None,
+                 drivers=0, recycle_after=200, extraction="script", releases=0, on_band=None, base=None):
         # set our url and num_bands values
+        if base is not None:
+            self._base = base
         self._list_base = self._base + "lists/" + letter.upper()
+        self._letter = letter.upper()
         self._num_bands = num_bands
+        self._engine = engine
+        self._workers = workers
+        self._per_host = per_host
+        self._extraction = extraction
+        self._on_band = on_band
+
+        # a resumable scrape needs every finished band on disk
+        if resume:
+            self._frontier = ScrapeFrontier("./metal-scrape-frontier_by_" + letter + ".db")
+            stream = True
+
+        # when streaming each band goes straight to disk, only a scrape that resumes a
+        # frontier keeps the bands of the run before it, a new frontier starts the files over
+        append = resume and self._frontier.is_listed()
+        if stream:
+            self._writer = JsonlWriter("./metal-scrape-reis-gadsden_by_" + letter + ".jsonl", append=append)
+
+        if cache_dir is not None:
+            self._cache = PageCache(cache_dir)
+
+        self._store_lock = threading.Lock()
+
+        # the site budget adapts to how the site responds, the list budget paces
+        # the selenium list path where there is no response to adapt to
+        self._limiter = RateLimiter(rate=2.0, max_rate=20.0, increase=0.2, burst=per_host)
+        self._limiter.add_endpoint("list", rate=2.0, max_rate=2.0)
+
+        # release pages are scraped alongside the band pages, a resumable scrape
+        # records them in the same frontier file as the bands
+        if releases > 0:
+            if resume:
+                self._release_frontier = ScrapeFrontier("./metal-scrape-frontier_by_" + letter + ".db", table="releases")
+            self._release_stage = ReleaseStage(
+                JsonlWriter("./metal-scrape-releases_by_" + letter + ".jsonl", append=append),
+                workers=releases, base=self._base, limiter=self._limiter, frontier=self._release_frontier
+            )
+
+            # the releases a stopped scrape had queued or failed on are queued again
+            if self._release_frontier is not None:
+                self.queue_releases(self._release_frontier.todo())
+        # a local copy of the site is the only host its drivers may load from
+        if drivers > 0 and base is not None:
+            self._driver_pool = DriverPool(size=drivers, recycle_after=recycle_after, site_host=urlparse(base).hostname)
+        elif drivers > 0:
+            self._driver_pool = DriverPool(size=drivers, recycle_after=recycle_after)
+
+        # the http fetcher is cheap to create so we always have one ready
+        self._fetcher = BandFetcher(base=self._base, cache=self._cache, limiter=self._limiter)
+
+        # the http engine only needs a browser if a page has to fall back onto selenium
+        if self._engine == "selenium":
+            self.start_driver()
+
+        # gathers the urls for the specifed amount of bands
+        self.get_bands()
+
+        # wait for the release pages that are still queued, retrying the failed ones
+        if self._release_stage is not None:
+            if self._release_frontier is not None:
+                self.retry_failed(self._release_frontier, self.queue_releases, "releases", self._release_stage.drain)
+            self._release_stage.close()
 
+        # save our data to a json file
+        self.save_to_json(letter)
+
+        # close the web driver
+        if self._driver != "":
+            self._driver.close()
+        if self._driver_pool is not None:
+            self._driver_pool.close()
+
+        if self._frontier is not None:
+            print("frontier: " + str(self._frontier.counts()))
+            self._frontier.close()
+        if self._release_frontier is not None:
+            print("release frontier: " + str(self._release_frontier.counts()))
+            self._release_frontier.close()
+
+    """
+    This method opens firefox on the list page. It is called the first time the
+    selenium driver is needed.
+    """
+    def start_driver(self):
         # set our firefox profile and open the root page
         profile = webdriver.FirefoxProfile()
         profile.set_preference("dom.disable_open_during_load", False)
@@ -75,19 +259,108 @@ class MetalScrape:
         # get main window object
         self._main_window = self._driver.current_window_handle
 
-        # gathers the urls for the specifed amount of bands
-        self.get_bands()
+    """
+    This method gets the urls for the number of bands specified by the _num_bands value
+    and scrapes each band.
+    """
+    def get_bands(self):
+        # a resumed scrape already knows its urls
+        if self._frontier is not None and self._frontier.is_listed():
+            self.scrape_bands(self._frontier.todo())
+        else:
+            # the http engine reads the list's json feed, falling back onto clicking
+            # through the list if the feed cannot be read
+            urls = None
+            if self._engine == "http":
+                try:
+                    urls = collect_band_urls(self._letter, self._num_bands, workers=max(self._workers, 4), base=self._base,
+                                             limiter=self._limiter)
+                except FetchError as e:
+                    print("band list feed failed, using selenium: " + str(e))
+
+            if urls is None:
+                urls = self.get_band_urls_selenium()
+
+            # record the urls so a restart does not have to collect them again
+            if self._frontier is not None:
+                self._frontier.add(urls)
+                urls = self._frontier.todo()
+
+            self.scrape_bands(urls)
+
+        # failed bands are retried once their backoff runs out, until every band is
+        # done or has failed too many times to be tried again
+        if self._frontier is not None:
+            self.retry_failed(self._frontier, self.scrape_bands, "bands")
 
-        # save our data to a json file
-        self.save_to_json(letter)
+    """
+    This method waits out the backoff of the failed urls in a frontier and
+    scrapes them again, until none are left to retry.
 
-        # close the web driver
-        self._driver.close()
+    params:
+        frontier - the ScrapeFrontier of the bands or the releases
+        scrape - called with the urls to scrape again
+        name - what the urls are, for the message
+        wait_for - called before each look at the frontier, waits until the urls
+                   handed to scrape are done or failed (DEFAULT=None)
+    """
+    def retry_failed(self, frontier, scrape, name, wait_for=None):
+        while True:
+            if wait_for is not None:
+                wait_for()
+            retry = frontier.next_retry()
+            if retry is None:
+                return
+
+            wait = retry - time.time()
+            if wait > 0:
+                print("waiting " + str(round(wait)) + "s to retry failed " + name)
+                time.sleep(wait)
+            scrape(frontier.todo())
 
     """
-    This method gets the urls for the number of bands specified by the _num_bands value.
+    This method queues release urls on the release stage.
+
+    params:
+        urls - release page urls
     """
-    def get_bands(self):
+    def queue_releases(self, urls):
+        for url in urls:
+            self._release_stage.put(url)
+
+    """
+    This method scrapes each band in a list of urls.
+
+    params:
+        urls - band pages to scrape
+    """
+    def scrape_bands(self, urls):
+        # with more than one worker the http engine scrapes the bands concurrently
+        if self._engine == "http" and self._workers > 1:
+            self.get_bands_concurrent(urls)
+            return
+
+        # the selenium engine scrapes with every driver in the pool at once
+        if self._engine == "selenium" and self._driver_pool is not None and self._driver_pool.size() > 1:
+            with ThreadPoolExecutor(max_workers=self._driver_pool.size()) as executor:
+                list(executor.map(self.get_band, urls))
+
+            # put the class dictionary back in the order of the list
+            if self._writer is None:
+                self._bands = {url: self._bands[url] for url in urls if url in self._bands}
+            return
+
+        # loop over the urls and pass them to the get_band function
+        for url in urls:
+            self.get_band(url)
+
+    """
+    This method gets the urls by paging through the list in the selenium driver.
+    """
+    def get_band_urls_selenium(self):
+        if self._driver == "":
+            self.start_driver()
+
         # list to hold urls
         urls = []
 
@@ -115,9 +388,9 @@ class MetalScrape:
                 if len(urls) > self._num_bands:
                     break
 
-                # sleep to allow elements to update
+                # wait to allow elements to update
                 # helps avoid staleelement errors
-                time.sleep(0.5)
+                self._limiter.acquire("list")
 
             # if we are on the last page we stop trying to collect urls
             if len(self._driver.find_elements(By.CSS_SELECTOR, "a#bandListAlpha_next.next.paginate_button.paginate_button_disabled")) != 0:
@@ -130,9 +403,32 @@ class MetalScrape:
             self._driver.execute_script("arguments[0].scrollIntoView(true);", next_button)
             next_button.click()
 
-        # loop over the urls and pass them to the get_band function
-        for url in urls:
-            self.get_band(url)
+        return urls[:self._num_bands]
+
+    """
+    This method scrapes the band pages with a pool of http workers. Any band the
+    workers could not fetch is scraped with selenium afterwards.
+
+    params:
+        urls - band pages to scrape
+    """
+    def get_bands_concurrent(self, urls):
+        pool = BandPool(workers=self._workers, per_host=self._per_host, base=self._base, cache=self._cache,
+                        limiter=self._limiter)
+
+        on_release = None
+        if self._release_stage is not None:
+            on_release = self._release_stage.put
+
+        # every band goes through store_band as the workers finish it, so it is streamed
+        # or kept and handed to on_band the same way as on the other paths
+        _, failed = pool.scrape(urls, on_band=self.store_band, on_release=on_release)
+        for url in failed:
+            self.get_band_fallback(url)
+
+        # put the class dictionary back in the order of the list
+        if self._writer is None:
+            self._bands = {url: self._bands[url] for url in urls if url in self._bands}
 
     """
     This method gets the information for each band by going to its band page and
@@ -143,47 +439,173 @@ class MetalScrape:
     """
     def get_band(self, url):
 
-        # create a new dictionary that will hold the information
-        band_info = dict()
+        # try the http engine first, a page it cannot read is handed to selenium
+        if self._engine == "http":
+            release_urls = [] if self._release_stage is not None else None
+            try:
+                self.store_band(url, self._fetcher.fetch_band(url, release_urls))
+            except FetchError as e:
+                print("http fetch failed, using selenium: " + str(e))
+            else:
+                # the release stage picks these up while we move on to the next band
+                if release_urls:
+                    for release_url in release_urls:
+                        self._release_stage.put(release_url)
+                return
+
+        self.get_band_fallback(url)
+
+    """
+    This method scrapes a band with selenium. When resuming, a band that cannot be
+    scraped is marked as failed in the frontier instead of stopping the whole scrape.
+
+    params:
+        url - page to scrape
+    """
+    def get_band_fallback(self, url):
+        try:
+            band_info = self.get_band_selenium(url)
+        except Exception as e:
+            # without a frontier there is nowhere to record the failure
+            if self._frontier is None:
+                raise
+            print("scrape failed, will retry later: " + url + ": " + str(e))
+            self._frontier.mark_failed(url)
+            return
+
+        self.store_band(url, band_info)
+
+    """
+    This method keeps a scraped band, either by appending it to the json lines file
+    when streaming or by adding it to the class dictionary, and then hands it to on_band.
+
+    params:
+        url - the band page that was scraped
+        band_info - the dictionary of the band's information
+    """
+    def store_band(self, url, band_info):
+        with self._store_lock:
+            if self._writer is not None:
+                self._writer.write(url, band_info)
+
+                # only once the band is written can the frontier call it done
+                if self._frontier is not None:
+                    self._frontier.mark_done(url)
+            else:
+                # add all the bands info to the class dictionary
+                # decided to key on the url as keying by name can run into collisions as bands
+                # sometimes have the same name, but each url is unique
+                self._bands[url] = band_info
+
+        # handed on outside the lock, the next stage may block to slow us down
+        if self._on_band is not None:
+            self._on_band(url, band_info)
+
+    """
+    This method gets the information for a band with selenium, using a driver from
+    the pool if there is one and the list page driver otherwise.
+
+    params:
+        url - page to scrape
+    """
+    def get_band_selenium(self, url):
+        if self._driver_pool is not None:
+            with self._driver_pool.driver() as driver:
+                return self.read_band_page(driver, url)
+
+        if self._driver == "":
+            self.start_driver()
+        return self.read_band_page(self._driver, url)
+
+    """
+    This method gets the information for a band by loading its band page in a
+    selenium driver and reading each element.
+
+    params:
+        driver - the selenium driver to load the page in
+        url - page to scrape
+    """
+    def read_band_page(self, driver, url):
 
         # take the driver to the new page
-        self._driver.get(url)
+        driver.get(url)
 
-        # wait until discography table (this element takes the longest to load)
-        WebDriverWait(self._driver, 30).until(
-            ec.presence_of_all_elements_located((By.CSS_SELECTOR, "table.display.discog"))
+        # wait until the discography table has its first row (this element takes the
+        # longest to load, even an empty discography has a placeholder row)
+        WebDriverWait(driver, 30).until(
+            ec.presence_of_element_located((By.CSS_SELECTOR, "table.display.discog tbody tr"))
         )
 
+        if self._extraction == "script":
+            return self.read_band_script(driver)
+        return self.read_band_elements(driver)
+
+    """
+    This method reads a loaded band page with a single script call.
+
+    params:
+        driver - the selenium driver the band page is loaded in
+    """
+    def read_band_script(self, driver):
+        record = driver.execute_script(self._extract_script)
+
+        # build the dictionary in python so the keys are in the same order as read_band_elements
+        band_info = dict()
+        band_info["Band name"] = clean_text(record["name"])
+        band_info["Country of origin"] = clean_text(record["left"][0])
+        band_info["Location"] = clean_text(record["left"][1])
+        band_info["Status"] = clean_text(record["left"][2])
+        band_info["Formed in"] = clean_text(record["left"][3])
+        band_info["Years active"] = clean_text(record["active"])
+        band_info["Genre"] = clean_text(record["right"][0])
+        band_info["Lyrical themes"] = clean_text(record["right"][1])
+        band_info["Current/Last label"] = clean_text(record["right"][2])
+        band_info["Discography"] = [{"Name": clean_text(n), "Type": clean_text(t), "Year": clean_text(y)}
+                                    for n, t, y in record["disco"]]
+
+        return band_info
+
+    """
+    This method reads a loaded band page one element at a time.
+
+    params:
+        driver - the selenium driver the band page is loaded in
+    """
+    def read_band_elements(self, driver):
+
+        # create a new dictionary that will hold the information
+        band_info = dict()
+
         # get the name of the band and it to our dictionary
-        band_name = self._driver.find_element(By.CSS_SELECTOR, "h1.band_name").get_attribute("innerText")
+        band_name = clean_text(driver.find_element(By.CSS_SELECTOR, "h1.band_name").get_attribute("innerText"))
         band_info["Band name"] = band_name
 
         # get the information that is held in the dl.float_left dd css paths
         # this path is consistent on all pages and contains the following info:
         # Country of origin, Location, Status, and [Year] Formed In
-        info_left = self._driver.find_elements(By.CSS_SELECTOR, "dl.float_left dd")
-        band_info["Country of origin"] = info_left[0].get_attribute("innerText")
-        band_info["Location"] = info_left[1].get_attribute("innerText")
-        band_info["Status"] = info_left[2].get_attribute("innerText")
-        band_info["Formed in"] = info_left[3].get_attribute("innerText")
+        info_left = driver.find_elements(By.CSS_SELECTOR, "dl.float_left dd")
+        band_info["Country of origin"] = clean_text(info_left[0].get_attribute("innerText"))
+        band_info["Location"] = clean_text(info_left[1].get_attribute("innerText"))
+        band_info["Status"] = clean_text(info_left[2].get_attribute("innerText"))
+        band_info["Formed in"] = clean_text(info_left[3].get_attribute("innerText"))
 
         # get the years active information
-        years_active = self._driver.find_element(By.CSS_SELECTOR, "dl.clear dd")
-        band_info["Years active"] = years_active.get_attribute("innerText")
+        years_active = driver.find_element(By.CSS_SELECTOR, "dl.clear dd")
+        band_info["Years active"] = clean_text(years_active.get_attribute("innerText"))
 
         # get the information stored in the dl.float_right dd css paths
         # this path is consistent on all pages and contains the following information:
         # Genre, Lyrical themes, Current/Last label
-        info_right = self._driver.find_elements(By.CSS_SELECTOR, "dl.float_right dd")
-        band_info["Genre"] = info_right[0].get_attribute("innerText")
-        band_info["Lyrical themes"] = info_right[1].get_attribute("innerText")
-        band_info["Current/Last label"] = info_right[2].get_attribute("innerText")
+        info_right = driver.find_elements(By.CSS_SELECTOR, "dl.float_right dd")
+        band_info["Genre"] = clean_text(info_right[0].get_attribute("innerText"))
+        band_info["Lyrical themes"] = clean_text(info_right[1].get_attribute("innerText"))
+        band_info["Current/Last label"] = clean_text(info_right[2].get_attribute("innerText"))
 
         # list to hold all discography projects
         disco = []
 
         # all the discography information is contained in table rows so we loop over all the table rows
-        discog_table = self._driver.find_elements(By.CSS_SELECTOR, "table.display.discog tbody tr")
+        discog_table = driver.find_elements(By.CSS_SELECTOR, "table.display.discog tbody tr")
         for entry in discog_table:
 
             # dictionary to hold information on each release
@@ -199,9 +621,9 @@ class MetalScrape:
 
             # we can access the tds directly as there will always be four tds in a row
             # as long as there is a project in their discography
-            release_dict["Name"] = data[0].get_attribute("innerText")
-            release_dict["Type"] = data[1].get_attribute("innerText")
-            release_dict["Year"] = data[2].get_attribute("innerText")
+            release_dict["Name"] = clean_text(data[0].get_attribute("innerText"))
+            release_dict["Type"] = clean_text(data[1].get_attribute("innerText"))
+            release_dict["Year"] = clean_text(data[2].get_attribute("innerText"))
 
             # append the project info to the array
             disco.append(release_dict)
@@ -209,18 +631,20 @@ class MetalScrape:
         # add the discography list to our dictionary
         band_info["Discography"] = disco
 
-        # add all the bands info to the class dictionary
-        # decided to key on the url as keying by name can run into collisions as bands
-        # sometimes have the same name, but each url is unique
-        self._bands[url] = band_info
+        return band_info
 
     """
     This method will dump our class dictionary into a formatted json file.
+    When streaming every band is already on disk so the json lines file is just closed.
     
     params:
         letter - the letter that was chosen, we add this to the file name for clarity
     """
     def save_to_json(self, letter):
+        if self._writer is not None:
+            self._writer.close()
+            return
+
         with open("./metal-scrape-reis-gadsden_by_"+ letter +".json", "w+") as outfile:
             json.dump(self._bands, outfile, indent=2)
 
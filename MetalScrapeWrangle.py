@@ -10,8 +10,16 @@ git: https://github.com/reismgadsden/MetalScrape
 """
 IMPORTS
 """
+import glob
 import json
-import time
+import math
+import os
+import threading
+import unicodedata
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from difflib import SequenceMatcher
 from os.path import exists
 import numpy
 import pandas
@@ -19,6 +27,13 @@ import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 from spotipy.exceptions import SpotifyException
 import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+from GenreVocabulary import GenreVocabulary
+from MetalStream import RowJournal, read_jsonl
+from RateLimiter import RateLimiter
+from SpotifyCache import CachedSpotify, ResponseCache, search_key
+from WrangleStore import FEATURES, apply_schema, memory_report, read_bands, write_store
 
 
 """
@@ -37,24 +52,85 @@ class MetalWrangle:
     # will hold the spotipy object
     _spotify = ""
 
+    # will hold the rate limiter every api call goes through
+    _limiter = None
+
+    # will hold the layer that waits on the rate limiter and keeps the call budget
+    _limited = None
+
+    # the number of bands matched at once
+    _workers = 1
+
+    # will hold the batcher for the endpoints that take many ids at once
+    _batcher = None
+
+    # will hold the response cache, None when responses are not cached
+    _cache = None
+
+    # will hold the layer that shares identical searches and album lookups
+    _coalescer = None
+
+    # will hold the genre vocabulary the genres of bands and candidates are read with
+    _vocabulary = None
+
+    # the number of processes the bands are split across
+    _shards = 1
+
+    # the sqlite file of the response cache, each shard opens its own connection to it
+    _cache_file = None
+
+    # the share of the rate budget this wrangle gets, a shard only gets part of it
+    _rate_share = 1.0
+
+    # the most api calls this run may make, None for no limit
+    _budget = None
+
+    # the band urls in the order a plan from WranglePlanner.py has them, None for no plan
+    _plan = None
+
+    # the most candidates per band we look up albums for, None for all of them
+    _album_candidates = 3
+
+    # candidates whose name is less similar than this to the band's are left out
+    _min_name_similarity = 0.5
+
+    # the audio features we keep for each track
+    _audio_features = FEATURES
+
     """
     Constructor for a MetalScrapeWrangle object.
     
     param:
-        filename - json file to be loaded
+        filename - json file to be loaded, a .jsonl file from a streaming scrape is read lazily
         cid - client id
         scid - secret client id
         letter - the letter that was scraped for naming purposes
+        workers - the number of bands matched on spotify at once (DEFAULT=1)
+        cache - sqlite file spotify responses are cached in, None to not cache (DEFAULT="spotify_cache.db")
+        incremental - when the csvs from an earlier run exist, only match the bands that are new
+                      or changed since then and upsert them into the csvs (DEFAULT=False)
+        shards - when above 1, the bands are split into this many shards that are wrangled in
+                 their own processes, each with its own client, workers and an even share of
+                 the rate budget (DEFAULT=1)
+        budget - the most api calls this run makes, None for no limit (DEFAULT=None)
+        plan - csv from WranglePlanner.py, the bands are matched in its order (DEFAULT=None)
     """
-    def __init__(self, filename, cid, scid, letter):
+    def __init__(self, filename, cid, scid, letter, workers=1, cache="spotify_cache.db", incremental=False, shards=1,
+                 budget=None, plan=None):
 
         # will hold our json data if it can be loaded
         scraped = ""
 
         # attempt to load the json, abort if we cant
+        # a json lines file is not loaded here, its bands are read one at a time by build_df
         try:
-            with open(filename, "r") as file:
-                scraped = json.load(file)
+            if filename.endswith(".jsonl"):
+                if not exists(filename):
+                    raise FileNotFoundError(filename)
+                scraped = read_jsonl(filename)
+            else:
+                with open(filename, "r") as file:
+                    scraped = json.load(file)
         except FileNotFoundError:
             print("The json does not exist.")
             exit()
@@ -62,93 +138,74 @@ class MetalWrangle:
         # set our private client id fields
         self._cid = cid
         self._scid = scid
+        self._workers = workers
+        self._shards = shards
+        self._cache_file = cache
+        self._budget = budget
+
+        # the plan only decides the order the bands are matched in
+        if plan is not None:
+            if not exists(plan):
+                print("The plan does not exist.")
+                exit()
+            self._plan = list(pandas.read_csv(plan)["URL"])
+
+        # responses from earlier runs are reused so a rerun costs almost no api calls
+        if cache is not None:
+            self._cache = ResponseCache(cache)
 
         # authenticate our spotify api account
         self.authorize_spotify()
 
-        # will attempt to load an existing csv first
-        if exists("spotify_artists_by_" + letter + ".csv"):
-            self._df = pandas.read_csv("spotify_artists_by_" + letter + ".csv", index_col=0)
-        else:
-            self.build_df(scraped)
-            self.append_country_codes()
-            self.spotify_artist_search()
-            self._df.to_csv("spotify_artists_by_" + letter + ".csv")
-
-        # will attempt to load an existing first
-        if exists("compiled_artists_by_" + letter + ".csv"):
-            self.df = pandas.read_csv("compiled_artists_by_" + letter + ".csv", index_col=0)
-        else:
-            self.get_top_tracks()
-            self._df.to_csv("compiled_artists_by_" + letter + ".csv")
+        # with a budget the run stops once it has made that many calls, what it got
+        # done is in the journals and the next run carries on from there
+        try:
+            # only the new and changed bands are matched and merged into the csvs we have
+            if incremental and exists("spotify_artists_by_" + letter + ".csv"):
+                self.build_df(scraped)
+                self.append_country_codes()
+                self.incremental_artist_search("spotify_artists_by_" + letter + ".csv")
+                self.incremental_top_tracks("compiled_artists_by_" + letter + ".csv")
+                self.save_store("compiled_artists_by_" + letter)
+
+            # will attempt to load an existing csv first
+            elif exists("spotify_artists_by_" + letter + ".csv"):
+                self._df = apply_schema(pandas.read_csv("spotify_artists_by_" + letter + ".csv", index_col=0))
+            else:
+                self.build_df(scraped)
+                self.append_country_codes()
+                self.run_stage("search", "spotify_artists_by_" + letter + ".csv")
+                self.write_csv("spotify_artists_by_" + letter + ".csv")
+
+            # will attempt to load an existing first
+            if exists("compiled_artists_by_" + letter + ".csv"):
+                self.df = pandas.read_csv("compiled_artists_by_" + letter + ".csv", index_col=0)
+            else:
+                self.run_stage("top_tracks", "compiled_artists_by_" + letter + ".csv")
+                self.write_csv("compiled_artists_by_" + letter + ".csv")
+                self.save_store("compiled_artists_by_" + letter)
+        except BudgetSpent:
+            print("The budget of " + str(self._budget) + " api calls is spent, run again to carry on.")
+            if self._cache is not None:
+                self._cache.close()
+            exit()
+
+        print("memory:\n" + memory_report(self._df).to_string())
+        if self._coalescer is not None:
+            print("coalesced: " + str(self._coalescer.stats()))
+        if self._cache is not None:
+            print("cache: " + str(self._cache.stats()))
+            self._cache.close()
 
     """
-    Build a pandas DataFrame with data from MetalScrape.py
+    Build a pandas DataFrame with data from MetalScrape.py, see bands_frame.
     
     param:
-        json_info - our dictionary from loading a json
+        json_info - our dictionary from loading a json, or an iterable of (url, band_info)
+                    pairs such as the one read_jsonl returns
     """
     def build_df(self, json_info):
-
-        # create a dict with our column names and empty containers for data
-        data = {
-            "Band name": [],
-            "Country of origin": [],
-            "Location": [],
-            "Status": [],
-            "Formed in": [],
-            "Years active": [],
-            "Genre": [],
-            "Lyrical themes": [],
-            "Current/Last label": [],
-            "Discography": []
-        }
-
-        # loop over each object in the json object
-        for x in json_info:
-
-            # access the fields in the json object
-            for y in json_info[x]:
-
-                # discography and genres will need to be treated differently
-                if y != "Discography" and y!= "Genre":
-
-                    # if it is "N/A"
-                    if json_info[x][y] == "N/A":
-                        data[y].append(None)
-                        continue
-                    data[y].append(json_info[x][y])
-
-                # condition for genre
-                elif y == "Genre":
-                    # sometimes multiple genres are listed
-                    # ex: genre1/genre2
-                    # we need to split these so they can be formatted
-                    # genre1, genre2, ..., genreN
-                    split = json_info[x][y].split("/")
-
-                    # if our split is empty we do not have a genre
-                    if split == [""]:
-                        data[y].append(None)
-
-                    # otherwise join each element into a single string
-                    else:
-                        data[y].append(", ".join(split))
-
-                # condition for discography
-                else:
-
-                    # we want to hold this in a list so that we can
-                    # iterate over it
-                    disco = []
-
-                    # for each object in the discography only grab its name
-                    for z in json_info[x][y]:
-                        disco.append(z["Name"])
-                    data[y].append(disco)
-
-        # construct a pandas DataFrame with our data
-        self._df = pandas.DataFrame(data=data)
+        self._df = bands_frame(json_info)
 
     """
     Appends a ISO-3166 country code to each artist where
@@ -156,41 +213,267 @@ class MetalWrangle:
     narrow the scope of our spotify search since multiple
     artists can use the same name.
     """
-    def append_country_codes(self):
-        # open our csv and construct a dictionary where
+    def append_country_codes(self, codes=None):
+        # read our csv and construct a dictionary where
         # the key is the full name and the value is the code
-        country_codes_csv = open("is03166Codes.csv", "r")
-        country_codes = dict()
-        for line in country_codes_csv:
-            col = line.split(",")
-            if col[0] == "Name":   # skips the line if it is the header line
-                continue
-            country_codes[col[0]] = col[1].strip()
+        if codes is None:
+            codes = country_codes()
+
+        # map each country of origin onto its code, a country that is not
+        # in the dict or is empty gets None
+        mapped = self._df["Country of origin"].map(codes).to_numpy(dtype=object)
+        self._df["Country code"] = pandas.Series(numpy.where(pandas.isnull(mapped), None, mapped), index=self._df.index, dtype="category")
+
+    """
+    Matches only the bands that are new or changed since the csv of an earlier
+    spotify_artist_search was written, reuses the ids of the rest, and writes the
+    merged result back. Bands in the csv that are not in this scrape are kept.
 
-        # list to store our column data in
-        codes = []
+    param:
+        csv - the csv of an earlier spotify_artist_search
+    """
+    def incremental_artist_search(self, csv):
+        old = pandas.read_csv(csv, index_col=0)
+
+        # a csv from before urls were kept cannot be diffed
+        if "URL" not in old.columns:
+            print(csv + " has no URL column, matching every band.")
+            self.run_stage("search", csv)
+            self.write_csv(csv)
+            return
+
+        # a band needs matching if it is new or any field the match depends on changed
+        match_columns = ["Band name", "Country of origin", "Genre", "Discography"]
+        old_signature = dict(zip(old["URL"], self.row_signatures(old, match_columns)))
+        signature = self.row_signatures(self._df, match_columns)
+        todo = numpy.array([old_signature.get(url) != sig for url, sig in zip(self._df["URL"], signature)], dtype=bool)
+        print(str(int(todo.sum())) + " of " + str(len(self._df)) + " bands are new or changed.")
+
+        full = self._df
+        self._df = full[todo].reset_index(drop=True)
+        if not self._df.empty:
+            self.run_stage("search", csv)
+        else:
+            self._df["Spotify ID"] = []
 
-        # iterate over each row, get the country of origin
-        # if they have one, and get its country code
-        for index, row in self._df.iterrows():
+        self._df = self.merge_by_url(full, old, self._df, ["Spotify ID"])
+        self.write_csv(csv)
 
-            # condition if country of origin is in the dict
-            if row["Country of origin"] in country_codes:
-                codes.append(country_codes[row["Country of origin"]])
+    """
+    Gets the top tracks of only the bands whose spotify id is new or changed since
+    the csv of an earlier get_top_tracks was written, reuses the rest and writes
+    the merged result back.
 
-            # condtion if country of origin isnt in the dict or is empty
-            else:
-                codes.append(None)
+    param:
+        csv - the csv of an earlier get_top_tracks
+    """
+    def incremental_top_tracks(self, csv):
+        track_columns = ["Top tracks", "Top track IDs", "Top track names", "Top track features"]
+
+        old = None
+        if exists(csv):
+            old = pandas.read_csv(csv, index_col=0)
+            if "URL" not in old.columns:
+                print(csv + " has no URL column, getting top tracks for every band.")
+                old = None
+            elif "Top track names" not in old.columns:
+                old["Top track names"] = None
+
+        if old is None:
+            self.run_stage("top_tracks", csv)
+            self.write_csv(csv)
+            return
+
+        # a band needs its top tracks if it is new or was matched to a different artist
+        old_ids = dict(zip(old["URL"], old["Spotify ID"].fillna("")))
+        todo = numpy.array([old_ids.get(url) != artist_id for url, artist_id in zip(self._df["URL"], self._df["Spotify ID"].fillna(""))], dtype=bool)
+
+        full = self._df
+        self._df = full[todo].reset_index(drop=True)
+        if not self._df.empty:
+            self.run_stage("top_tracks", csv)
+        else:
+            for column in track_columns:
+                self._df[column] = []
 
-        # add the new column
-        self._df["Country code"] = codes
+        self._df = self.merge_by_url(full, old, self._df, track_columns)
+        self.write_csv(csv)
+
+    """
+    Returns the journal the rows of a csv are recorded in while it is being made.
+
+    param:
+        csv - the csv
+    """
+    def journal_for(self, csv, shard=None):
+        if shard is not None:
+            return csv[:-len(".csv")] + ".shard" + str(shard) + ".journal.jsonl"
+        return csv[:-len(".csv")] + ".journal.jsonl"
+
+    """
+    Writes the DataFrame to a csv. Once the csv holds every row its journal is no
+    longer needed, and is removed so a later run does not mistake it for work to resume.
+
+    param:
+        csv - the csv
+    """
+    def write_csv(self, csv):
+        # the stage's new columns and any merged rows get their dtypes back
+        self._df = apply_schema(self._df)
+        self._df.to_csv(csv)
+        for journal in [self.journal_for(csv)] + glob.glob(self.journal_for(csv, "*")):
+            if exists(journal):
+                os.remove(journal)
+
+    """
+    Runs a stage of the wrangle on the DataFrame, split across processes when
+    there is more than one shard.
+
+    param:
+        stage - "search" for spotify_artist_search or "top_tracks" for get_top_tracks
+        csv - the csv the stage's results are written to, its journal is named after it
+    """
+    def run_stage(self, stage, csv):
+        if self._shards > 1 and not self._df.empty:
+            self.run_sharded(stage, csv)
+        elif stage == "search":
+            self.spotify_artist_search(self.journal_for(csv))
+        else:
+            self.get_top_tracks(self.journal_for(csv))
+
+    """
+    Splits the DataFrame into shards by a hash of each band's normalized name, so
+    bands with the same name still share their searches, runs a stage on every
+    shard in its own process, and puts the rows back together in their original
+    order. Each shard keeps its own journal, so a stopped run resumes every shard.
+
+    Every shard gets an even share of what is left of the call budget, and the calls
+    the shards made are taken off it before the next stage, so the run as a whole
+    stays within its budget however many stages and shards it has.
+
+    param:
+        stage - "search" for spotify_artist_search or "top_tracks" for get_top_tracks
+        csv - the csv the stage's results are written to, its journals are named after it
+    """
+    def run_sharded(self, stage, csv):
+        shard_of = numpy.array([zlib.crc32(normalize_text(name).encode("utf-8")) % self._shards
+                                for name in self._df["Band name"]])
+
+        remaining = self._limited.remaining()
+
+        with ProcessPoolExecutor(max_workers=self._shards) as executor:
+            futures = [
+                executor.submit(run_shard, stage, self._df[shard_of == shard], self.journal_for(csv, shard),
+                                self._cid, self._scid, self._workers, self._cache_file, 1 / self._shards,
+                                remaining, self._plan)
+                for shard in range(self._shards) if (shard_of == shard).any()
+            ]
+
+            # a shard that spent its share raises BudgetSpent here, the shards that
+            # are still running stay within their own share
+            parts = []
+            for future in futures:
+                part, spent = future.result()
+                parts.append(part)
+                self._limited.charge(spent)
+
+        # every row kept its index, sorting on it restores the original order
+        self._df = pandas.concat(parts).sort_index()
+
+    """
+    Returns a string per row made from the given columns, in the same form whether
+    the rows were just built or read back from a csv.
+
+    param:
+        df - the DataFrame
+        columns - the columns that make up the signature
+    """
+    def row_signatures(self, df, columns):
+        # a list is written to a csv as its str, and an empty cell comes back as NaN
+        def as_text(value):
+            if isinstance(value, (list, str)):
+                return str(value)
+            return "" if pandas.isnull(value) else str(value)
+
+        parts = [[as_text(value) for value in df[column]] for column in columns]
+        return ["\x1f".join(values) for values in zip(*parts)]
+
+    """
+    Fills columns of a full DataFrame from an older one and a freshly computed part,
+    matching rows by url. The fresh values win, and rows only in the older one are
+    added at the end.
+
+    param:
+        full - the DataFrame of the current scrape
+        old - the DataFrame read back from an earlier run
+        updated - the rows that were just computed
+        columns - the columns to fill
+    """
+    def merge_by_url(self, full, old, updated, columns):
+        full = full.copy()
+        for column in columns:
+            values = dict(zip(old["URL"], old[column]))
+            values.update(zip(updated["URL"], updated[column]))
+            full[column] = [values.get(url) for url in full["URL"]]
+
+        leftover = old[~old["URL"].isin(full["URL"])]
+        return pandas.concat([full, leftover], ignore_index=True)
 
     """
     Authorizes our API calls
     """
     def authorize_spotify(self):
         client_credentials_manager = SpotifyClientCredentials(client_id=self._cid, client_secret=self._scid)
-        self._spotify = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+
+        # one session is shared by every worker, its pool keeps a connection open for each of them
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(10, self._workers))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        # spotipy only mounts its own retrying adapter on a session it builds itself, this
+        # adapter does not retry, so every 429 and 5xx reaches LimitedSpotify which reports
+        # it to the limiter and retries it once the limiter allows
+        spotify = spotipy.Spotify(client_credentials_manager=client_credentials_manager, requests_session=session)
+
+        self.wrap_spotify(spotify)
+
+    """
+    Puts the rate limiter, the response cache and the batcher in front of a spotipy
+    object, or anything with the same methods such as FakeSpotify.
+
+    param:
+        spotify - the spotipy object
+    """
+    def wrap_spotify(self, spotify):
+
+        # each endpoint gets its own budget, starting at the rate our old sleeps allowed,
+        # and every call also draws from the "spotify" budget shared by all endpoints
+        # a shard scales every budget down to its share
+        share = self._rate_share
+        self._limiter = RateLimiter(rate=1.0 * share, min_rate=0.2 * share, max_rate=10.0 * share, increase=0.1 * share)
+        self._limiter.add_endpoint("spotify", rate=2.0 * share, max_rate=20.0 * share, increase=0.2 * share, burst=self._workers)
+        self._limiter.add_endpoint("artist_top_tracks", rate=0.5 * share)
+        self._limiter.add_endpoint("audio_features", rate=0.5 * share)
+
+        # a shard gets the same share of the call budget as of the rate
+        budget = None if self._budget is None else int(self._budget * share)
+        self._limited = LimitedSpotify(spotify, self._limiter, budget=budget)
+        self._spotify = self._limited
+
+        # the cache sits in front of the limiter so a hit does not wait on it
+        if self._cache is not None:
+            self._spotify = CachedSpotify(self._spotify, self._cache)
+
+        # bands with the same name share their search and album lookups, whether they
+        # are matched at once or one after the other
+        self._coalescer = CoalescingSpotify(self._spotify)
+        self._spotify = self._coalescer
+
+        self._batcher = SpotifyBatcher(self._spotify)
+
+        # the genres of the bands and of the candidates share one set of ids
+        self._vocabulary = GenreVocabulary()
 
     """
     This method will attempt to find the artist on spotify using 3 different methods.
@@ -200,270 +483,376 @@ class MetalWrangle:
            of the results and see if we have matches.
         3. Finally if we have no albums but several matches attempt the same comparison accept with
            genres. This method will be the most inaccurate.
-    """
-    def spotify_artist_search(self):
-
-        # empty to list to hold our artist ids
-        spotify_id = []
-
-        # loop over each row of the dataframe
-        for index, row in self._df.iterrows():
-
-            # print the index to show progress
-            print(index)
 
-            # boolean values for comparison methods
-            skip_album = False
-            skip_genre = False
-
-            # set skip_album (this is bad coding)
-            if pandas.isnull(row["Discography"]):
-                skip_album = True
-            if pandas.isnull(row["Genre"]):
-                skip_genre = True
-            """
-            the above values should have been set like so if I was good
-            
-            skip_album = pandas.isnull(row["Discography"])
-            skip_genre = pandas.isnull(row["Genre"])
-            
-            alternatively instead of creating these values here we could
-            have just used pandas.isnull(row[xxx]) in each spot where we
-            used one the skip_xxx variables
-            """
-
-            # boolean value that lets us now if our first query returns an error
-            # this happens because not every ISO-3166 code is registered in spotify
-            # as a valid market.
-            error = False
-            try:
+    Each band's id is recorded in the journal as soon as it is found, and bands the
+    journal already has are not matched again, so a run that was stopped continues
+    where it left off. The column is built from the journal at the end.
 
-                # sleep to avoid 429 error (too many requests)
-                time.sleep(1)
+    param:
+        journal - json lines file the results are recorded in, None to not keep one (DEFAULT=None)
+    """
+    def spotify_artist_search(self, journal=None):
 
-                # attempt to grab the 20 artists matching our band's name based of market
-                # throws SpotifyException if the country code is an invalid market
-                artists = self._spotify.search(urllib.parse.quote(row["Band name"]), limit=20, offset=0, type='artist', market=row["Country code"])
-            except SpotifyException as e:
-                # print(e)
-                # print("Value: " + row["Country code"] + "; Type: " + str(type(row["Country code"])))
-                # exit()
-                error = True
+        rows = self.match_rows(self._df)
+        keys = self.row_keys()
 
-            # this will reattempt to find the artist by not limiting the market
-            if error or artists["artists"]["total"] == 0 or pandas.isnull(row["Country code"]):
-                if not pandas.isnull(row["Country code"]):
+        journal = RowJournal(journal)
+        todo = [(key, row) for key, row in zip(keys, rows) if key not in journal]
+        if len(todo) < len(rows):
+            print(str(len(rows) - len(todo)) + " bands already matched, resuming.")
 
-                    # sleep to avoid 429 error (too many requests)
-                    time.sleep(1)
+        # the bands go in the order of the plan, so a budget is spent on the cheapest
+        # and most likely matches first, bands the plan does not have go last
+        if self._plan is not None:
+            order = {url: position for position, url in enumerate(self._plan)}
+            todo.sort(key=lambda each: order.get(each[0], len(order)))
 
-                    # make a API call with the spotipy wrapper object
-                    artists = self._spotify.search(urllib.parse.quote(row["Band name"]), limit=20, offset=0, type='artist', market=None)
+        # matches a band and records it straight away
+        def match_and_record(each):
+            key, row = each
+            journal.record(key, self.match_artist(row))
 
-                # if this result returns no artists we append None and start at the next row
-                if artists["artists"]["total"] == 0:
-                    spotify_id.append(None)
-                    continue
+        try:
+            # with more than one worker many bands are matched at once
+            if self._workers > 1:
+                with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                    try:
+                        for index, _ in enumerate(executor.map(match_and_record, todo)):
+                            print(index)
+                    except BaseException:
+                        # do not wait on the bands that have not started when we are stopped
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        raise
+            else:
+                for index, each in enumerate(todo):
 
-            # condition 1
-            if skip_genre and skip_album and artists["artists"]["total"] == 1:
+                    # print the index to show progress
+                    print(index)
+                    match_and_record(each)
+        finally:
+            journal.close()
 
-                # appends the id from the first (and only) item returned
-                spotify_id.append(artists["artists"]["items"][0]["id"])
+        # set the column from our now complete journal
+        self._df["Spotify ID"] = [journal.get(key) for key in keys]
 
-                # restart the loop on the next row
-                continue
-            else:
+    """
+    Returns the rows of a DataFrame ready to be handed to match_artist.
 
-                # boolean value that will tell whether we found the artist or not
-                found = False
+    param:
+        df - the bands, with their country codes
+    """
+    def match_rows(self, df):
+
+        # each row is handed over as a plain dictionary, which is much cheaper than iterrows,
+        # an empty value of any dtype is handed over as None
+        rows = [
+            {column: (None if not isinstance(value, list) and pandas.isnull(value) else value) for column, value in row.items()}
+            for row in df.to_dict("records")
+        ]
+
+        # the genres of every band are read once into a band by genre matrix, each
+        # row gets the ids of its genres from it
+        genres = self._vocabulary.matrix(df["Genre"])
+
+        # the normalized discography titles of each band are worked out once, so
+        # checking an album against them is a set lookup
+        for index, row in enumerate(rows):
+            discography = row["Discography"] if isinstance(row["Discography"], list) else []
+            row["Title set"] = frozenset(normalize_text(title) for title in discography)
+            row["Genre ids"] = genres.indices[genres.indptr[index]:genres.indptr[index + 1]]
+        return rows
 
-                # gets the spotify ids for each artist returned by API
-                for item in artists["artists"]["items"]:
-                    artist_id = item["id"]
+    """
+    Returns the key each row is recorded under in a journal, its band url, or its
+    index for a DataFrame from before urls were kept.
+    """
+    def row_keys(self):
+        if "URL" in self._df.columns:
+            return list(self._df["URL"])
+        return [str(index) for index in self._df.index]
 
-                    # condtion 2
-                    # if the row has discography, query the api for at most 15 albums from each artist
-                    # this only gets the albums for one artist at a time so we dont end up making
-                    # unnecessary calls
-                    if not skip_album:
+    """
+    Finds the spotify id of a single band, or None if it cannot be found.
+    See spotify_artist_search for the three methods used.
 
-                        # sleep to avoid 429 error (too many requests)
-                        time.sleep(1)
+    param:
+        row - the band's row as a dictionary
+    """
+    def match_artist(self, row):
 
-                        # gets up to 15 albums from an artist from an artist id
-                        albums = self._spotify.artist_albums(artist_id, album_type=None, country=None, limit=15, offset=0)
+        # boolean values for comparison methods, a band without any
+        # discography titles has nothing to compare albums against
+        skip_album = not row["Title set"]
+        skip_genre = pandas.isnull(row["Genre"])
 
-                        # loop over each item in the returned result and see if the
-                        # name of an album is present within or discography list
-                        for album in albums["items"]:
+        # boolean value that lets us now if our first query returns an error
+        # this happens because not every ISO-3166 code is registered in spotify
+        # as a valid market.
+        error = False
+        try:
 
-                            # if there is a match we set our found value to true
-                            # and break out of the loop as we do not need to make sure
-                            # all things match
-                            if album["name"] in row["Discography"]:
-                                found = True
-                                spotify_id.append(artist_id)
-                                break
+            # attempt to grab the 20 artists matching our band's name based of market
+            # throws SpotifyException if the country code is an invalid market
+            artists = self._spotify.search(urllib.parse.quote(row["Band name"]), limit=20, offset=0, type='artist', market=row["Country code"])
+        except SpotifyException as e:
+            # print(e)
+            # print("Value: " + row["Country code"] + "; Type: " + str(type(row["Country code"])))
+            # exit()
+            error = True
+
+        # this will reattempt to find the artist by not limiting the market
+        if error or artists["artists"]["total"] == 0 or pandas.isnull(row["Country code"]):
+            if not pandas.isnull(row["Country code"]):
+
+                # make a API call with the spotipy wrapper object
+                artists = self._spotify.search(urllib.parse.quote(row["Band name"]), limit=20, offset=0, type='artist', market=None)
+
+            # if this result returns no artists there is nothing to match
+            if artists["artists"]["total"] == 0:
+                return None
+
+        # condition 1
+        if skip_genre and skip_album and artists["artists"]["total"] == 1:
+
+            # the id from the first (and only) item returned
+            return artists["artists"]["items"][0]["id"]
+
+        # the number of candidates we have looked up albums for
+        albums_checked = 0
+
+        # the candidates, best first, with the obviously wrong ones left out
+        for item, overlap in self.rank_candidates(row, artists["artists"]["items"]):
+            artist_id = item["id"]
+
+            # boolean value that will tell whether we found the artist or not
+            found = False
+
+            # condtion 2
+            # if the row has discography, query the api for at most 15 albums from each artist
+            # this only gets the albums for one artist at a time so we dont end up making
+            # unnecessary calls, and only for the best few candidates as the first
+            # album match is the one we keep
+            if not skip_album:
+                if self._album_candidates is not None and albums_checked >= self._album_candidates:
+                    break
+                albums_checked += 1
+
+                # gets up to 15 albums from an artist from an artist id
+                albums = self._spotify.artist_albums(artist_id, album_type=None, country=None, limit=15, offset=0)
+
+                # loop over each item in the returned result and see if the
+                # name of an album is present within or discography titles
+                for album in albums["items"]:
+
+                    # if there is a match we set our found value to true
+                    # and break out of the loop as we do not need to make sure
+                    # all things match
+                    if normalize_text(album["name"]) in row["Title set"]:
+                        found = True
+                        break
 
-                    # condition 3
-                    elif not skip_genre:
+            # condition 3
+            # the artist shares at least one genre with the band
+            elif not skip_genre:
+                found = overlap > 0
 
-                        # loop over each item in the genres and compare
-                        for genres in item["genres"]:
-                            if genres.lower() in row["Genre"].lower().split("/"):
-                                found = True
-                                spotify_id.append(spotify_id)
-                                break
+            # stuff to do only if we found a match
+            if found:
+                return artist_id
 
-                    # stuff to do only if we found a match
-                    if found:
+        # if we got results back but did not find a match the row gets an empty value
+        return None
 
-                        # loop over each genre in the returned result
-                        for genres in item["genres"]:
+    """
+    Ranks the artists a search returned for a band using only what the search
+    already told us, so the expensive album lookups go to the likely candidates
+    first. The score is mostly how close the names are, then how many genres
+    overlap, then how many followers the artist has. Candidates whose name is
+    not close to the band's are left out. Returns (artist, genres in common) pairs.
 
-                            # append genre with comma and space before if we have no data in the genre
-                            # column or the genre is not already present in said column
-                            # we dont need to split on a / anymore but it does not break functionality
-                            if pandas.isnull(row["Genre"]) and (genres.lower() not in row["Genre"].lower().split("/")):
-                                row["Genre"] += ", " + genres
+    param:
+        row - the band's row as a dictionary
+        items - the artists returned by the search
+    """
+    def rank_candidates(self, row, items):
+        name = normalize_text(row["Band name"])
+
+        # a candidate by genre matrix, genres no band has cannot overlap so they are
+        # left out, and the band's columns summed up are the genres in common
+        genres = self._vocabulary.matrix([", ".join(item.get("genres", [])) for item in items], intern=False)
+        overlaps = numpy.asarray(genres[:, row["Genre ids"]].sum(axis=1)).ravel()
+
+        scored = []
+        for position, item in enumerate(items):
+            similarity = SequenceMatcher(None, name, normalize_text(item["name"])).ratio()
+            if similarity < self._min_name_similarity:
+                continue
 
-                            # if the column value is empty we just set it to the first genre
-                            elif pandas.isnull(row["Genre"]):
-                                row["Genre"] = genres
+            followers = (item.get("followers") or dict()).get("total") or 0
 
-                        # start the loop over on the next row
-                        break
+            score = 3 * similarity + overlaps[position] + 0.1 * math.log10(followers + 1)
 
-                # if we got results back but did not find a match we need to append None
-                # so that the dataframe has an empty value for that row
-                if not found:
-                    spotify_id.append(None)
+            # ties keep the order spotify returned them in
+            scored.append((-score, position, item))
 
-        # set the row equal to our now populated list
-        self._df["Spotify ID"] = spotify_id
+        scored.sort(key=lambda each: each[:2])
+        return [(item, overlaps[position]) for _, position, item in scored]
 
     """
     Gets the top (at most 10) tracks for each artist that we were able to find,
     and gets the names, ids, and audio features for each one.
+
+    The result of a row only depends on its artist, so the journal records each
+    artist's top tracks as soon as they are known, and its finished names, ids and
+    features as soon as their audio features are in. Artists the journal already
+    has are skipped, and the columns are built from the journal at the end.
+
+    param:
+        journal - json lines file the results are recorded in, None to not keep one (DEFAULT=None)
     """
-    def get_top_tracks(self):
+    def get_top_tracks(self, journal=None):
+
+        # the artist id of each row, None where we could not find the artist
+        artist_ids = [None if pandas.isnull(artist_id) else artist_id for artist_id in self._df["Spotify ID"]]
+        found = list(dict.fromkeys(artist_id for artist_id in artist_ids if artist_id is not None))
 
-        # lists to hold our new column(s) data
+        journal = RowJournal(journal)
+        try:
+            # first pass, the top tracks of every artist, this endpoint only takes one artist
+            # so it is the only call we still make per artist
+            todo = [artist_id for artist_id in found if "tracks:" + artist_id not in journal and artist_id not in journal]
+            if len(todo) < len(found):
+                print(str(len(found) - len(todo)) + " artists already have top tracks, resuming.")
+
+            def tracks_and_record(artist_id):
+                tracks = self.artist_top_tracks(artist_id)
+                journal.record("tracks:" + artist_id, [{"id": item["id"], "name": item["name"]} for item in tracks])
+
+            if self._workers > 1:
+                with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                    try:
+                        list(executor.map(tracks_and_record, todo))
+                    except BaseException:
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        raise
+            else:
+                for artist_id in todo:
+                    tracks_and_record(artist_id)
+
+            # second pass, the audio features of the tracks, batched across artists so
+            # each request is filled close to the endpoint's maximum, every artist is
+            # finished as soon as its batch is in
+            todo = [artist_id for artist_id in found if artist_id not in journal]
+            batch = []
+            batch_size = 0
+            for artist_id in todo + [None]:
+                size = 0 if artist_id is None else len(journal.get("tracks:" + artist_id))
+                if batch and (artist_id is None or batch_size + size > self._batcher.limit("audio_features")):
+                    self.finish_artists(batch, journal)
+                    batch = []
+                    batch_size = 0
+                if artist_id is not None:
+                    batch.append(artist_id)
+                    batch_size += size
+        finally:
+            journal.close()
+
+        # third pass, scatter the results from the journal back onto each row
         top_tracks = list()
         top_track_ids = list()
+        top_track_names = list()
         top_tracks_features = list()
-
-        # loop over each row of the dataframe
-        for index, row in self._df.iterrows():
+        for index, artist_id in enumerate(artist_ids):
 
             # print the index to show progress
             print(index)
 
-            # we want to skip over rows where there is no artist id
-            if not pandas.isnull(row["Spotify ID"]):
+            # if we do not have an id for an artist, or the artist has no top tracks,
+            # we just append None as we want an empty value in that column for that row
+            result = None if artist_id is None else journal.get(artist_id)
+            if result is None:
+                top_tracks.append(None)
+                top_track_ids.append(None)
+                top_track_names.append(None)
+                top_tracks_features.append(None)
+                continue
 
-                # sleep to avoid 429 error (too many requests)
-                time.sleep(2)
+            # our final list will look like:
+            # list(list(dict(), dict(), ...), list(dict(), dict(), ...), ...)
+            top_tracks.append(", ".join(result["names"]))
+            top_track_ids.append(", ".join(result["ids"]))
+            top_track_names.append(result["names"])
+            top_tracks_features.append(result["features"])
 
-                # query the api for an artists top tracks
-                artist_top_tracks = self._spotify.artist_top_tracks(artist_id=row["Spotify ID"])
+        # create new columns for each of our 4 lists, the joined names are kept for
+        # reading and the list of them so a name holding a comma stays whole
+        self._df["Top tracks"] = top_tracks
+        self._df["Top track IDs"] = top_track_ids
+        self._df["Top track names"] = top_track_names
+        self._df["Top track features"] = top_tracks_features
 
-                # if the returned result is empty
-                if not artist_top_tracks["tracks"]:
+    """
+    Gets the audio features of a batch of artists' top tracks and records each
+    artist's finished names, ids and features in the journal.
 
-                    # since the result is empty we just want have an empty cell for these values
-                    # so we append a None
-                    top_tracks.append(None)
-                    top_track_ids.append(None)
-                    top_tracks_features.append(None)
+    param:
+        artist_ids - the artists, their top tracks are already in the journal
+        journal - the RowJournal
+    """
+    def finish_artists(self, artist_ids, journal):
+        features = self._batcher.audio_features(
+            [item["id"] for artist_id in artist_ids for item in journal.get("tracks:" + artist_id)])
 
-                    # start the loop over on the next row
-                    continue
+        for artist_id in artist_ids:
 
-                # two lists to hold values for track name
-                # and track id
-                top = []
-                top_ids = []
+            # lists to hold the track names, ids and audio features
+            top = []
+            top_ids = []
+            top_features = []
 
-                # loop over the each track in the returned result and
-                # append the names and ids of each track
-                for item in artist_top_tracks["tracks"]:
-                    top.append(item["name"])
-                    top_ids.append(item["id"])
+            tracks = journal.get("tracks:" + artist_id)
+            for item in tracks:
+                song = features.get(item["id"])
 
-                # empty list to hold the audio features for each track
-                top_features = []
+                # sometimes a result will be none for a track
+                # im not sure why this happens as a valid track id
+                # will return None, we leave the track out
+                if song is None:
+                    continue
 
-                # sleep to avoid 429 error (too many requests)
-                time.sleep(2)
+                top.append(item["name"])
+                top_ids.append(item["id"])
+                top_features.append({feature: song[feature] for feature in self._audio_features})
 
-                # API call to get the audio features for a track
-                audio_features = self._spotify.audio_features(top_ids)
+            # an artist without any top tracks gets an empty value, one whose tracks all
+            # came back without audio features gets empty strings and lists
+            result = None
+            if tracks:
+                result = {"names": top, "ids": top_ids, "features": top_features}
+            journal.record(artist_id, result)
 
-                # loop over the each element in the returned result
-                # we do this by index so that if we get  bad result we
-                # can change values at the index in our two lists that
-                # hold track name and id
-                for i in range(0, len(audio_features)):
+    """
+    Returns the top tracks of an artist.
 
-                    # attempt to construct a dictionary with values from the result
-                    try:
-                        song_features = {
-                            "danceability" : audio_features[i]["danceability"],
-                            "energy": audio_features[i]["energy"],
-                            "key": audio_features[i]["key"],
-                            "loudness": audio_features[i]["loudness"],
-                            "mode": audio_features[i]["mode"],
-                            "speechiness": audio_features[i]["speechiness"],
-                            "acousticness": audio_features[i]["acousticness"],
-                            "instrumentalness": audio_features[i]["instrumentalness"],
-                            "liveness": audio_features[i]["liveness"],
-                            "valence": audio_features[i]["valence"],
-                            "tempo": audio_features[i]["tempo"]
-                        }
-
-                        # appends this dictionary to our list
-                        top_features.append(song_features)
-
-                    # sometimes a result will be none for a track
-                    # im not sure why this happens as a valid track id
-                    # will return None
-                    except TypeError as e:
-
-                        # set values at that index to none, we dont need to worry
-                        # about appending a None to our audio features as these two
-                        # lists will end up becoming single strings with each value
-                        # that is not None being seperated by commas
-                        top[i] = None
-                        top_ids[i] = None
-
-                # remove any none values in this list with list comprehension
-                top = [t for t in top if not pandas.isnull(t)]
-                top_ids = [i for i in top_ids if not pandas.isnull(i)]
-
-                # create strings from our lists
-                top_tracks.append(", ".join(top))
-                top_track_ids.append(", ".join(top_ids))
-
-                # append the entire list to the master list
-                # our final list will look like:
-                # list(list(dict(), dict(), ...), list(dict(), dict(), ...), ...)
-                top_tracks_features.append(top_features)
-
-                # start the loop over on the next row
-                continue
+    param:
+        artist_id - the spotify id of the artist
+    """
+    def artist_top_tracks(self, artist_id):
+        return self._spotify.artist_top_tracks(artist_id=artist_id)["tracks"]
 
-            # if we do not have an id for an artist we just append None as
-            # we want an empty value in that column for that row
-            top_tracks.append(None)
-            top_track_ids.append(None)
-            top_tracks_features.append(None)
+    """
+    Writes the DataFrame as a typed bands table and a long format tracks table next
+    to the csv, see WrangleStore.py. The csv is already written, so a missing parquet
+    engine only costs us the typed copy.
 
-        # create new columns for each of our 3 lists
-        self._df["Top tracks"] = top_tracks
-        self._df["Top track IDs"] = top_track_ids
-        self._df["Top track features"] = top_tracks_features
+    param:
+        prefix - the path the two files are named from
+    """
+    def save_store(self, prefix):
+        try:
+            write_store(self._df, prefix)
+        except ImportError as e:
+            print("Could not write " + prefix + " parquet files: " + str(e))
 
     """
     This simply returns a deep copy of our DataFrame object.
@@ -472,6 +861,459 @@ class MetalWrangle:
         return self._df.copy(deep=True)
 
 
+"""
+Class that runs one stage of the wrangle on one shard of the bands, in a process of
+its own. It authorizes its own client with its share of the rate budget and opens
+its own connection to the response cache.
+"""
+class ShardWrangle(MetalWrangle):
+
+    """
+    Constructor for a ShardWrangle object.
+
+    param:
+        stage - "search" for spotify_artist_search or "top_tracks" for get_top_tracks
+        df - the shard's rows
+        journal - the shard's journal
+        cid - client id
+        scid - secret client id
+        workers - the number of bands matched at once in this shard
+        cache - sqlite file spotify responses are cached in, None to not cache
+        rate_share - the share of the rate budget and the call budget this shard gets
+        budget - what is left of the call budget of the whole run, None for no limit
+        plan - the band urls in the order of the plan, None for no plan
+    """
+    def __init__(self, stage, df, journal, cid, scid, workers, cache, rate_share, budget, plan):
+        self._df = df
+        self._cid = cid
+        self._scid = scid
+        self._workers = workers
+        self._rate_share = rate_share
+        self._budget = budget
+        self._plan = plan
+        if cache is not None:
+            self._cache = ResponseCache(cache)
+        self.authorize_spotify()
+
+        try:
+            if stage == "search":
+                self.spotify_artist_search(journal)
+            else:
+                self.get_top_tracks(journal)
+        finally:
+            if self._cache is not None:
+                self._cache.close()
+
+
+"""
+Runs a stage on a shard and returns its rows and the api calls it made, see
+ShardWrangle. This is what a worker process of run_sharded calls.
+"""
+def run_shard(stage, df, journal, cid, scid, workers, cache, rate_share, budget, plan):
+    shard = ShardWrangle(stage, df, journal, cid, scid, workers, cache, rate_share, budget, plan)
+    return shard.get_df(), shard._limited.spent()
+
+
+"""
+Raised by LimitedSpotify once the call budget of the run is spent. Everything done
+until then is in the journals, so the next run carries on from there.
+"""
+class BudgetSpent(Exception):
+    pass
+
+
+"""
+Class that wraps a spotipy object so every call waits on the rate limiter and
+reports back how it went. A 429, a 5xx, a dropped connection or a timeout is
+retried once the limiter allows it.
+"""
+class LimitedSpotify:
+    # the spotipy object
+    _spotify = None
+
+    # the rate limiter, each method is its own endpoint
+    _limiter = None
+
+    # the times a call that got a 429 or 5xx is made again
+    _retries = 3
+
+    # the calls that may still be made, None for no limit
+    _budget = None
+
+    # the calls made so far, retries included
+    _spent = 0
+
+    # guards _budget and _spent
+    _lock = None
+
+    """
+    Constructor for a LimitedSpotify object.
+
+    param:
+        spotify - the spotipy object
+        limiter - the rate limiter
+        retries - times a 429 or 5xx is retried (DEFAULT=3)
+        budget - the most calls made, retries included, None for no limit (DEFAULT=None)
+    """
+    def __init__(self, spotify, limiter, retries=3, budget=None):
+        self._spotify = spotify
+        self._limiter = limiter
+        self._retries = retries
+        self._budget = budget
+        self._lock = threading.Lock()
+
+    """
+    Takes one call from the budget, raises BudgetSpent when there is none left.
+    """
+    def spend(self):
+        with self._lock:
+            if self._budget is not None:
+                if self._budget <= 0:
+                    raise BudgetSpent()
+                self._budget -= 1
+            self._spent += 1
+
+    """
+    Takes calls made somewhere else, such as in a shard's process, from the budget.
+
+    param:
+        calls - the number of calls made
+    """
+    def charge(self, calls):
+        with self._lock:
+            if self._budget is not None:
+                self._budget = max(0, self._budget - calls)
+            self._spent += calls
+
+    """
+    Returns the calls that may still be made, None for no limit.
+    """
+    def remaining(self):
+        with self._lock:
+            return self._budget
+
+    """
+    Returns the calls made so far.
+    """
+    def spent(self):
+        with self._lock:
+            return self._spent
+
+    """
+    Makes a call through the rate limiter.
+
+    param:
+        endpoint - name of the spotipy method
+        args, kwargs - passed on to the spotipy method
+    """
+    def call(self, endpoint, *args, **kwargs):
+        for attempt in range(self._retries + 1):
+            self.spend()
+            self._limiter.acquire(endpoint)
+            self._limiter.acquire("spotify")
+            try:
+                result = getattr(self._spotify, endpoint)(*args, **kwargs)
+            except SpotifyException as e:
+                # an error without a real http status says nothing about the rate, it is
+                # not reported and is for the caller
+                status = e.http_status
+                if not isinstance(status, int) or not 100 <= status < 600:
+                    raise
+
+                headers = e.headers or dict()
+                self._limiter.report(endpoint, status, headers.get("Retry-After"))
+                self._limiter.report("spotify", status, headers.get("Retry-After"))
+
+                # only a 429 or 5xx is worth another try, anything else is for the caller
+                if (status == 429 or status >= 500) and attempt < self._retries:
+                    continue
+                raise
+            except (requests.ConnectionError, requests.Timeout):
+                # no response at all is a failure, the limiter slows down before we try again
+                self._limiter.report(endpoint, None)
+                self._limiter.report("spotify", None)
+                if attempt < self._retries:
+                    continue
+                raise
+            self._limiter.report(endpoint, 200)
+            self._limiter.report("spotify", 200)
+            return result
+
+    def search(self, *args, **kwargs):
+        return self.call("search", *args, **kwargs)
+
+    def artist_albums(self, *args, **kwargs):
+        return self.call("artist_albums", *args, **kwargs)
+
+    def artist_top_tracks(self, *args, **kwargs):
+        return self.call("artist_top_tracks", *args, **kwargs)
+
+    def audio_features(self, *args, **kwargs):
+        return self.call("audio_features", *args, **kwargs)
+
+
+"""
+Class that makes identical searches and album lookups only once. A search is keyed
+by its query and market the way the response cache keys it, so bands with the same
+name share one search, and bands that share candidates share their album lists. A call another
+thread is already making is waited on instead of being made again, and the results
+of the most recent calls are kept so a repeat after that is answered from memory.
+"""
+class CoalescingSpotify:
+    # the object calls are passed on to
+    _spotify = None
+
+    # a future per call key that is still being made
+    _in_flight = None
+
+    # the result per call key of the calls that are done, least recently used first
+    _done = None
+
+    # the most results kept in _done
+    _max_entries = 10000
+
+    # calls made and calls answered from another call, keyed by endpoint
+    _stats = None
+
+    # guards _in_flight, _done and _stats
+    _lock = None
+
+    """
+    Constructor for a CoalescingSpotify object.
+
+    param:
+        spotify - the spotipy object (or a wrapper around it)
+        max_entries - the most finished results kept (DEFAULT=10000)
+    """
+    def __init__(self, spotify, max_entries=10000):
+        self._spotify = spotify
+        self._in_flight = dict()
+        self._done = OrderedDict()
+        self._max_entries = max_entries
+        self._stats = dict()
+        self._lock = threading.Lock()
+
+    """
+    Returns the result of a call, making it only if no identical call is in flight
+    or was made recently.
+
+    param:
+        endpoint - name of the spotipy method
+        key - the key identical calls share
+        call - function that makes the call
+    """
+    def coalesce(self, endpoint, key, call):
+        with self._lock:
+            counts = self._stats.setdefault(endpoint, {"calls": 0, "shared": 0})
+            if key in self._done:
+                self._done.move_to_end(key)
+                counts["shared"] += 1
+                return self._done[key]
+
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+                counts["calls"] += 1
+            else:
+                counts["shared"] += 1
+
+        if owner:
+            try:
+                result = call()
+            except BaseException as e:
+                # a failed call is not kept, the next caller tries again
+                future.set_exception(e)
+                with self._lock:
+                    del self._in_flight[key]
+            else:
+                # the result is kept before the future is let go of, so no caller
+                # can find neither and make the call again
+                with self._lock:
+                    self._done[key] = result
+                    if len(self._done) > self._max_entries:
+                        self._done.popitem(last=False)
+                    del self._in_flight[key]
+                future.set_result(result)
+
+        return future.result()
+
+    """
+    Returns the calls made and the calls shared of each endpoint.
+    """
+    def stats(self):
+        with self._lock:
+            return {endpoint: dict(self._stats[endpoint]) for endpoint in self._stats}
+
+    def search(self, q, limit=10, offset=0, type="track", market=None):
+        key = ("search", search_key(q), market, limit, offset, type)
+        return self.coalesce("search", key, lambda: self._spotify.search(q, limit=limit, offset=offset, type=type, market=market))
+
+    def artist_albums(self, artist_id, album_type=None, country=None, limit=20, offset=0):
+        key = ("artist_albums", artist_id, album_type, country, limit, offset)
+        return self.coalesce("artist_albums", key, lambda: self._spotify.artist_albums(
+            artist_id, album_type=album_type, country=country, limit=limit, offset=offset))
+
+    def artist_top_tracks(self, *args, **kwargs):
+        return self._spotify.artist_top_tracks(*args, **kwargs)
+
+    def audio_features(self, *args, **kwargs):
+        return self._spotify.audio_features(*args, **kwargs)
+
+
+"""
+Class that batches lookups by id across many artists. The ids are collected,
+deduplicated and sent in requests filled to each endpoint's maximum, and the
+results are handed back keyed by id so they can be scattered onto their rows.
+"""
+class SpotifyBatcher:
+    # the spotipy object (or a wrapper around it)
+    _spotify = None
+
+    # the most ids each endpoint takes in one request
+    _limits = {
+        "audio_features": 100
+    }
+
+    """
+    Constructor for a SpotifyBatcher object.
+
+    param:
+        spotify - the spotipy object
+    """
+    def __init__(self, spotify):
+        self._spotify = spotify
+
+    """
+    Looks up every id and returns a dictionary of id to result. An id spotify
+    has no result for maps to None.
+
+    param:
+        endpoint - name of the spotipy method
+        ids - the ids to look up, duplicates and None are skipped
+        key - the key the results are listed under in the response, None if the
+              response is the list itself
+    """
+    def lookup(self, endpoint, ids, key):
+        unique = list(dict.fromkeys(item_id for item_id in ids if item_id is not None))
+        size = self._limits[endpoint]
+
+        results = dict()
+        for start in range(0, len(unique), size):
+            chunk = unique[start:start + size]
+            response = getattr(self._spotify, endpoint)(chunk)
+            if key is not None:
+                response = response[key]
+
+            # the results come back in the same order as the ids we sent
+            for item_id, item in zip(chunk, response):
+                results[item_id] = item
+
+        return results
+
+    """
+    Returns the audio features of many tracks, 100 per request.
+
+    param:
+        ids - spotify track ids
+    """
+    def audio_features(self, ids):
+        return self.lookup("audio_features", ids, None)
+
+    """
+    Returns the most ids an endpoint takes in one request.
+
+    param:
+        endpoint - name of the spotipy method
+    """
+    def limit(self, endpoint):
+        return self._limits[endpoint]
+
+
+"""
+Builds a pandas DataFrame of bands from the data of MetalScrape.py.
+
+The bands are read in a single pass that only keeps each field's value (and
+only the names from the discography), the cleanup of every column is then
+done in bulk on whole columns.
+
+params:
+    json_info - a dictionary loaded from a json, or an iterable of (url, band_info)
+                pairs such as the one read_jsonl returns
+"""
+def bands_frame(json_info):
+    # our column names, in the order of a band_info dictionary
+    columns = [
+        "Band name",
+        "Country of origin",
+        "Location",
+        "Status",
+        "Formed in",
+        "Years active",
+        "Genre",
+        "Lyrical themes",
+        "Current/Last label",
+        "Discography",
+        "URL"
+    ]
+    fields = columns[:-2]
+
+    # a dictionary is walked by its items, anything else is already (url, band_info) pairs
+    if isinstance(json_info, dict):
+        json_info = json_info.items()
+
+    # one row per band, for each object in the discography we only grab its name,
+    # the url is kept so later runs can tell which bands they already have
+    rows = [
+        [band[field] for field in fields] + [[release["Name"] for release in band["Discography"]], url]
+        for url, band in json_info
+    ]
+
+    # construct a pandas DataFrame with our data
+    df = pandas.DataFrame.from_records(rows, columns=columns)
+    if df.empty:
+        return df
+
+    # "N/A" means no value, genre and discography are treated differently
+    for column in fields:
+        if column == "Genre":
+            continue
+        values = df[column].to_numpy(dtype=object)
+        df[column] = numpy.where(values == "N/A", None, values)
+
+    # sometimes multiple genres are listed
+    # ex: genre1/genre2
+    # these are formatted as genre1, genre2, ..., genreN
+    # and an empty genre means we do not have a genre
+    genre = df["Genre"].to_numpy(dtype=object)
+    joined = df["Genre"].str.replace("/", ", ", regex=False).to_numpy(dtype=object)
+    df["Genre"] = numpy.where(genre == "", None, joined)
+    return apply_schema(df)
+
+
+"""
+Returns a dictionary of country name to ISO-3166 code.
+"""
+def country_codes():
+    # keep_default_na stops Namibia's code "NA" from being read as empty
+    codes = pandas.read_csv("is03166Codes.csv", keep_default_na=False)
+    return dict(zip(codes["Name"], codes["Code"]))
+
+
+"""
+Normalizes a band name or a title so that small differences in case, accents and
+punctuation do not stop two of them from matching.
+
+params:
+    text - the text to normalize
+"""
+def normalize_text(text):
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return " ".join("".join(c if c.isalnum() else " " for c in text).split())
+
+
 """
 This public method will attempt allows us to get a complete DataFrame in another file
 without having to create an instance of the class in that file. It also allows us to
@@ -483,8 +1325,17 @@ params:
     secret - the secret client id (DEFAULT=None)
     csv - the name of our csv file (DEFAULT=None)
     json - the name of our json file (DEFAULT=None)
+    store - the prefix of the parquet files written by save_store, the bands
+            table is returned, its tracks are read with WrangleStore.read_tracks (DEFAULT=None)
 """
-def get_wrangle(client=None, secret=None, csv=None, json=None) -> pandas.DataFrame:
+def get_wrangle(client=None, secret=None, csv=None, json=None, store=None) -> pandas.DataFrame:
+
+    # the typed copy is read before anything else, it needs no parsing
+    if store is not None:
+        if exists(store + "_bands.parquet"):
+            return read_bands(store)
+        print("The store is not readable.")
+        exit(-1)
 
     # we either need a csv or json to have any data at all
     # so we abort if either of these values are empty
@@ -501,7 +1352,7 @@ def get_wrangle(client=None, secret=None, csv=None, json=None) -> pandas.DataFra
 
     # check if the csv given exists and if not abort
     if exists(csv):
-        return pandas.read_csv(csv, index_col=0)
+        return apply_schema(pandas.read_csv(csv, index_col=0))
     else:
         print(".csv is not readable.")
         exit(-1)
@@ -0,0 +1,179 @@
+"""
+Streaming storage for scraped bands.
+
+Instead of one big json document written at the end of a scrape, each band is
+appended to a json lines file as soon as it is scraped. Every line is a single
+compact object {url: band_info}, so joining every line back together gives the
+same dictionary that MetalScrape.save_to_json writes. The same format backs the
+journal MetalScrapeWrangle.py records its results in.
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import json
+import os
+import threading
+
+
+"""
+Class that appends band records to a json lines file.
+"""
+class JsonlWriter:
+    # the open file we append to
+    _file = None
+
+    # the number of records written between each fsync
+    _sync_every = 50
+
+    # the number of records written since the last fsync
+    _unsynced = 0
+
+    """
+    Initialization method.
+
+    param:
+        filename - json lines file to append to, it is created if it does not exist
+        sync_every - records written between forcing the file onto disk (DEFAULT=50)
+        append - keep what the file already holds, otherwise it is emptied first. A reader
+                 keeps the first record of a url, so a fresh run must not append to an
+                 old one (DEFAULT=True)
+    """
+    def __init__(self, filename, sync_every=50, append=True):
+        self._file = open(filename, "a" if append else "w", encoding="utf-8")
+
+        # a crash can leave a half written line behind, start ours on a fresh line
+        # so the first band we append is not lost with it
+        if self._file.tell() > 0:
+            with open(filename, "rb") as existing:
+                existing.seek(-1, os.SEEK_END)
+                if existing.read(1) != b"\n":
+                    self._file.write("\n")
+
+        self._sync_every = max(1, sync_every)
+        self._unsynced = 0
+
+    """
+    Appends a single band to the file.
+
+    params:
+        url - the url of the band page, used as the key
+        band_info - the dictionary of the band's information
+    """
+    def write(self, url, band_info):
+        self._file.write(json.dumps({url: band_info}, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+        # a flush hands the line to the os, an fsync makes sure it survives a crash
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self._sync_every:
+            self.sync()
+
+    """
+    Forces everything written so far onto disk.
+    """
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    """
+    Syncs and closes the file.
+    """
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+
+"""
+Lazily reads a json lines file written by JsonlWriter, yielding (url, band_info)
+one band at a time. A half written last line from a crashed scrape is skipped, and
+a band that was written twice by a resumed scrape is only yielded the first time.
+
+params:
+    filename - json lines file to read
+"""
+def read_jsonl(filename):
+    # only the urls are kept in memory, not the bands
+    seen = set()
+
+    with open(filename, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            for url in record:
+                if url in seen:
+                    continue
+                seen.add(url)
+                yield url, record[url]
+
+
+"""
+Class that records the result of each row of a long running job as soon as it is
+known, so a job that is stopped part of the way through picks up where it left
+off. Results are appended to a json lines file as {key: result} and the ones
+already in the file are read back when it is opened. Without a file the results
+are only kept in memory.
+"""
+class RowJournal:
+    # the results so far keyed by row key
+    _results = None
+
+    # the writer results are appended with, None without a file
+    _writer = None
+
+    # rows are recorded from several threads
+    _lock = None
+
+    """
+    Initialization method.
+
+    param:
+        filename - json lines file of the journal, None to keep it in memory (DEFAULT=None)
+    """
+    def __init__(self, filename=None):
+        self._results = dict()
+        self._lock = threading.Lock()
+
+        if filename is not None:
+            if os.path.exists(filename):
+                self._results = dict(read_jsonl(filename))
+            self._writer = JsonlWriter(filename)
+
+    def __contains__(self, key):
+        return key in self._results
+
+    def __len__(self):
+        return len(self._results)
+
+    """
+    Returns the result of a row, or a default if it has none yet.
+
+    params:
+        key - the row's key
+        default - returned for a row without a result (DEFAULT=None)
+    """
+    def get(self, key, default=None):
+        return self._results.get(key, default)
+
+    """
+    Records the result of a row.
+
+    params:
+        key - the row's key
+        result - anything json can hold
+    """
+    def record(self, key, result):
+        with self._lock:
+            self._results[key] = result
+            if self._writer is not None:
+                self._writer.write(key, result)
+
+    """
+    Syncs and closes the file.
+    """
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
@@ -0,0 +1,223 @@
+"""
+Adaptive rate limiter shared by MetalScrape.py and MetalScrapeWrangle.py.
+
+Each endpoint gets a token bucket. The rate of the bucket is adjusted with AIMD,
+it climbs by a small step after every healthy response and is cut in half after a
+429 or a 5xx, so we run as fast as the remote side allows instead of sleeping for
+a fixed worst case time. A Retry-After header pauses the endpoint for as long as
+the remote side asks.
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+"""
+Class that hands out permission to make requests at an adaptive rate.
+"""
+class TokenBucket:
+    # requests per second we currently allow
+    _rate = 1.0
+
+    # the lowest and highest the rate may go
+    _min_rate = 0.2
+    _max_rate = 10.0
+
+    # how much the rate climbs after a healthy response
+    _increase = 0.1
+
+    # what the rate is multiplied by after a 429 or 5xx
+    _decrease = 0.5
+
+    # the most tokens that can be saved up
+    _burst = 1
+
+    # tokens currently available
+    _tokens = 1.0
+
+    # when the tokens were last topped up
+    _last = 0.0
+
+    # no requests are allowed before this time
+    _blocked_until = 0.0
+
+    # guards everything above
+    _lock = None
+
+    """
+    Initialization method.
+
+    param:
+        rate - starting requests per second
+        min_rate - lowest requests per second
+        max_rate - highest requests per second
+        increase - requests per second added after each healthy response
+        decrease - factor the rate is multiplied by after a 429 or 5xx
+        burst - the most requests that can go out back to back
+    """
+    def __init__(self, rate, min_rate, max_rate, increase, decrease, burst):
+        self._rate = rate
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._increase = increase
+        self._decrease = decrease
+        self._burst = max(1, burst)
+        self._tokens = 1.0
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    """
+    Blocks until a request may be made.
+    """
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+                self._last = now
+
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = max(self._blocked_until - now, (1 - self._tokens) / self._rate)
+            time.sleep(wait)
+
+    """
+    Adjusts the rate from the status of a response.
+
+    params:
+        status - the http status code, None for a request that failed without a
+                 response, such as a connection error or a timeout
+        retry_after - seconds the remote side asked us to wait (DEFAULT=None)
+    """
+    def report(self, status, retry_after=None):
+        with self._lock:
+            if status is None or status == 429 or status >= 500:
+                self._rate = max(self._min_rate, self._rate * self._decrease)
+                self._tokens = 0.0
+                if retry_after is not None:
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+            elif status < 400:
+                self._rate = min(self._max_rate, self._rate + self._increase)
+
+    """
+    Returns the current requests per second.
+    """
+    def rate(self):
+        with self._lock:
+            return self._rate
+
+
+"""
+Class that keeps a token bucket per endpoint. Endpoints that were not given their
+own budget with add_endpoint get one with the default settings the first time they are used.
+"""
+class RateLimiter:
+    # the buckets keyed by endpoint
+    _buckets = None
+
+    # the settings new buckets are made with
+    _defaults = None
+
+    # guards _buckets
+    _lock = None
+
+    """
+    Initialization method.
+
+    param:
+        rate - starting requests per second (DEFAULT=1.0)
+        min_rate - lowest requests per second (DEFAULT=0.2)
+        max_rate - highest requests per second (DEFAULT=10.0)
+        increase - requests per second added after each healthy response (DEFAULT=0.1)
+        decrease - factor the rate is multiplied by after a 429 or 5xx (DEFAULT=0.5)
+        burst - the most requests that can go out back to back (DEFAULT=1)
+    """
+    def __init__(self, rate=1.0, min_rate=0.2, max_rate=10.0, increase=0.1, decrease=0.5, burst=1):
+        self._buckets = dict()
+        self._defaults = {
+            "rate": rate,
+            "min_rate": min_rate,
+            "max_rate": max_rate,
+            "increase": increase,
+            "decrease": decrease,
+            "burst": burst
+        }
+        self._lock = threading.Lock()
+
+    """
+    Gives an endpoint its own budget. Any setting not passed uses the default.
+
+    params:
+        endpoint - name of the endpoint
+        settings - any of rate, min_rate, max_rate, increase, decrease, burst
+    """
+    def add_endpoint(self, endpoint, **settings):
+        values = dict(self._defaults)
+        values.update(settings)
+        with self._lock:
+            self._buckets[endpoint] = TokenBucket(**values)
+
+    """
+    Returns the bucket of an endpoint, making it if needed.
+
+    params:
+        endpoint - name of the endpoint
+    """
+    def bucket(self, endpoint):
+        with self._lock:
+            if endpoint not in self._buckets:
+                self._buckets[endpoint] = TokenBucket(**self._defaults)
+            return self._buckets[endpoint]
+
+    """
+    Blocks until a request to an endpoint may be made.
+
+    params:
+        endpoint - name of the endpoint (DEFAULT="default")
+    """
+    def acquire(self, endpoint="default"):
+        self.bucket(endpoint).acquire()
+
+    """
+    Reports the status of a response from an endpoint.
+
+    params:
+        endpoint - name of the endpoint
+        status - the http status code, None for a request that failed without a response
+        retry_after - the Retry-After header value, in seconds or as an http date (DEFAULT=None)
+    """
+    def report(self, endpoint, status, retry_after=None):
+        self.bucket(endpoint).report(status, parse_retry_after(retry_after))
+
+    """
+    Returns the current requests per second of every endpoint.
+    """
+    def rates(self):
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {endpoint: buckets[endpoint].rate() for endpoint in buckets}
+
+
+"""
+Turns a Retry-After header into seconds, or None if there is none or it cannot be read.
+
+params:
+    value - the header value, a number of seconds or an http date
+"""
+def parse_retry_after(value):
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
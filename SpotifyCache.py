@@ -0,0 +1,265 @@
+"""
+Persistent response cache for the Spotify calls MetalScrapeWrangle.py makes.
+
+Every response is stored in a sqlite database keyed by the endpoint and its
+normalized parameters, and is reused until it is older than the time to live of
+its endpoint. Audio features practically never change so they live a long time,
+top tracks change so they expire sooner. Calls that take a list of ids are cached
+per id, so a batch only requests the ids that are not cached yet. An id spotify
+had no result for is not cached, as a valid track now and then comes back without
+audio features and may have them on the next run. The database
+is kept under a maximum number of entries by evicting the least recently used.
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import json
+import sqlite3
+import threading
+import time
+
+
+"""
+Class that stores responses in sqlite.
+"""
+class ResponseCache:
+    # the sqlite connection
+    _conn = None
+
+    # guards the connection and the stats
+    _lock = None
+
+    # seconds each endpoint's responses are kept, None keeps them forever
+    _ttl = {
+        "search": 7 * 24 * 3600,
+        "artist_albums": 30 * 24 * 3600,
+        "artist_top_tracks": 7 * 24 * 3600,
+        "audio_features": None
+    }
+
+    # the most entries kept before the least recently used are evicted
+    _max_entries = 500000
+
+    # puts between each check of the size
+    _check_every = 1000
+
+    # puts since the size was last checked
+    _puts = 0
+
+    # hits and misses keyed by endpoint
+    _stats = None
+
+    # a read only cache looks responses up without marking them as used
+    _read_only = False
+
+    """
+    Constructor for a ResponseCache object.
+
+    param:
+        filename - the sqlite file, it is created if it does not exist
+        ttl - a dictionary of endpoint to seconds that overrides the default times to live (DEFAULT=None)
+        max_entries - the most entries kept (DEFAULT=500000)
+        read_only - only look responses up, a dry run should not change what is evicted (DEFAULT=False)
+    """
+    def __init__(self, filename, ttl=None, max_entries=500000, read_only=False):
+        self._ttl = dict(self._ttl)
+        if ttl is not None:
+            self._ttl.update(ttl)
+        self._max_entries = max_entries
+        self._puts = 0
+        self._stats = dict()
+        self._read_only = read_only
+        self._lock = threading.Lock()
+
+        # the sharded wrangle opens the same file from several processes, write ahead
+        # logging lets them read while one writes and the timeout waits out the writes
+        self._conn = sqlite3.connect(filename, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, endpoint TEXT, stored REAL, accessed REAL, body TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+
+    """
+    Builds the key of a call from its endpoint and parameters.
+
+    param:
+        endpoint - name of the endpoint
+        params - dictionary of the call's parameters
+    """
+    def make_key(self, endpoint, params):
+        return endpoint + ":" + json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+    """
+    Returns whether a key is cached and fresh, and its response.
+
+    param:
+        endpoint - name of the endpoint
+        key - key built by make_key
+    """
+    def get(self, endpoint, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT stored, body FROM responses WHERE key = ?", (key,)).fetchone()
+
+            ttl = self._ttl.get(endpoint)
+            hit = row is not None and (ttl is None or row[0] + ttl > now)
+
+            counts = self._stats.setdefault(endpoint, {"hits": 0, "misses": 0})
+            if hit:
+                counts["hits"] += 1
+                if not self._read_only:
+                    self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                    self._conn.commit()
+                return True, json.loads(row[1])
+
+            counts["misses"] += 1
+            return False, None
+
+    """
+    Stores a response.
+
+    param:
+        endpoint - name of the endpoint
+        key - key built by make_key
+        response - the response, anything json can hold
+    """
+    def put(self, endpoint, key, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, endpoint, now, now, json.dumps(response, separators=(",", ":")))
+            )
+            self._conn.commit()
+
+            self._puts += 1
+            if self._puts >= self._check_every:
+                self._puts = 0
+                self.evict()
+
+    """
+    Deletes the least recently used entries beyond _max_entries. Called with the lock held.
+    """
+    def evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self._max_entries:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                (count - self._max_entries,)
+            )
+            self._conn.commit()
+
+    """
+    Returns the hits and misses of each endpoint.
+    """
+    def stats(self):
+        with self._lock:
+            return {endpoint: dict(self._stats[endpoint]) for endpoint in self._stats}
+
+    """
+    Closes the database.
+    """
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+"""
+Class that wraps a spotipy object (or LimitedSpotify) with a ResponseCache. It has
+the same methods the wrangle uses, so it can stand in for the spotipy object.
+"""
+class CachedSpotify:
+    # the object calls are passed on to on a miss
+    _spotify = None
+
+    # the response cache
+    _cache = None
+
+    """
+    Constructor for a CachedSpotify object.
+
+    param:
+        spotify - the spotipy object
+        cache - the ResponseCache
+    """
+    def __init__(self, spotify, cache):
+        self._spotify = spotify
+        self._cache = cache
+
+    """
+    Returns a cached response, or makes the call and caches it.
+
+    param:
+        endpoint - name of the spotipy method
+        params - the call's keyword parameters
+        key_params - the normalized parameters the key is built from (DEFAULT=params)
+    """
+    def call(self, endpoint, params, key_params=None):
+        key = self._cache.make_key(endpoint, params if key_params is None else key_params)
+        hit, response = self._cache.get(endpoint, key)
+        if hit:
+            return response
+
+        response = getattr(self._spotify, endpoint)(**params)
+        self._cache.put(endpoint, key, response)
+        return response
+
+    """
+    Looks up many ids, caching each id on its own so only the missing ones are requested.
+    A None result is handed back but not cached, so the id is asked for again next time.
+    Returns the results in the order of the ids.
+
+    param:
+        endpoint - name of the spotipy method
+        ids - the ids to look up
+        unwrap - function that takes the response and returns the list of results
+    """
+    def call_ids(self, endpoint, ids, unwrap):
+        results = dict()
+        missing = []
+        for item_id in ids:
+            hit, response = self._cache.get(endpoint, self._cache.make_key(endpoint, {"id": item_id}))
+            if hit:
+                results[item_id] = response
+            elif item_id not in missing:
+                missing.append(item_id)
+
+        if missing:
+            for item_id, item in zip(missing, unwrap(getattr(self._spotify, endpoint)(missing))):
+                results[item_id] = item
+                if item is not None:
+                    self._cache.put(endpoint, self._cache.make_key(endpoint, {"id": item_id}), item)
+
+        return [results[item_id] for item_id in ids]
+
+    def search(self, q, limit=10, offset=0, type="track", market=None):
+        params = {"q": q, "limit": limit, "offset": offset, "type": type, "market": market}
+
+        key_params = dict(params)
+        key_params["q"] = search_key(q)
+        return self.call("search", params, key_params)
+
+    def artist_albums(self, artist_id, album_type=None, country=None, limit=20, offset=0):
+        return self.call("artist_albums", {"artist_id": artist_id, "album_type": album_type, "country": country,
+                                           "limit": limit, "offset": offset})
+
+    def artist_top_tracks(self, artist_id, country="US"):
+        return self.call("artist_top_tracks", {"artist_id": artist_id, "country": country})
+
+    def audio_features(self, tracks):
+        return self.call_ids("audio_features", tracks, lambda response: response)
+
+
+"""
+Returns the form of a search query that searches are cached and shared under. The
+search is not case sensitive so neither is its key, but its punctuation matters,
+so a query is only ever answered with the response to that same query.
+
+params:
+    q - the query, as it is sent to spotify
+"""
+def search_key(q):
+    return q.strip().lower()
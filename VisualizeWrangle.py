@@ -1,8 +1,10 @@
 from datetime import datetime
-import ast
 import MetalScrapeWrangle as msw
+import WrangleStore
+from GenreVocabulary import GenreVocabulary
 import numpy
 import pandas
+from scipy import sparse
 import matplotlib.pyplot as plt
 from matplotlib import patches
 import seaborn
@@ -12,6 +14,7 @@ import random
 
 class VisualizeWrangle:
     _df = ""
+    _tracks = None
     _genres = dict()
     _colors = [
         "b",
@@ -54,8 +57,14 @@ class VisualizeWrangle:
         "peru"
     ]
 
-    def __init__(self, csv=None, json_file=None, cid=None, scid=None, genres=None):
-        self._df = msw.get_wrangle(csv=csv, json=json_file, client=cid, secret=scid)
+    def __init__(self, csv=None, json_file=None, cid=None, scid=None, genres=None, store=None):
+        self._df = msw.get_wrangle(csv=csv, json=json_file, client=cid, secret=scid, store=store)
+
+        # one row per top track, from the store if we have one
+        if store is not None:
+            self._tracks = WrangleStore.read_tracks(store)
+        else:
+            self._tracks = WrangleStore.tracks_from_df(self._df)
         self.clean_df()
 
         self.build_genres()
@@ -111,65 +120,27 @@ class VisualizeWrangle:
         self._df = self._df.loc[~self._df["Spotify ID"].isnull()]
 
     def build_genres(self):
-        for index, row in self._df.iterrows():
-            if not pandas.isnull(row["Genre"]) and not pandas.isnull(row["Top track features"]):
-                for genre in row["Genre"].split(", "):
-                    items = genre.lower().replace(" (early)", "").replace(" (later)", "").replace("metal", "").split(";")
-                    convert_string = ast.literal_eval(row["Top track features"])
-                    danceability = []
-                    energy = []
-                    key = []
-                    loudness = []
-                    mode = []
-                    speechiness = []
-                    acousticness = []
-                    instrumentalness = []
-                    liveness = []
-                    valence = []
-                    tempo = []
-                    for i in items:
-                        item = i.strip()
-                        for song in convert_string:
-                            danceability.append(song["danceability"])
-                            energy.append(song["energy"])
-                            key.append(song["key"])
-                            loudness.append(song["loudness"])
-                            mode.append(song["mode"])
-                            speechiness.append(song["speechiness"])
-                            acousticness.append(song["acousticness"])
-                            instrumentalness.append(song["instrumentalness"])
-                            liveness.append(song["liveness"])
-                            valence.append(song["valence"])
-                            tempo.append(song["tempo"])
-
-                        if item in self._genres:
-                            self._genres[item]["danceability"] += danceability
-                            self._genres[item]["energy"] += energy
-                            self._genres[item]["key"] += key
-                            self._genres[item]["loudness"] += loudness
-                            self._genres[item]["mode"] += mode
-                            self._genres[item]["speechiness"] += speechiness
-                            self._genres[item]["acousticness"] += acousticness
-                            self._genres[item]["instrumentalness"] += instrumentalness
-                            self._genres[item]["liveness"] += liveness
-                            self._genres[item]["valence"] += valence
-                            self._genres[item]["tempo"] += tempo
-                        else:
-                            new = {
-                                "danceability": danceability,
-                                "energy": energy,
-                                "key": key,
-                                "loudness": loudness,
-                                "mode": mode,
-                                "speechiness": speechiness,
-                                "acousticness": acousticness,
-                                "instrumentalness": instrumentalness,
-                                "liveness": liveness,
-                                "valence": valence,
-                                "tempo": tempo,
-                            }
-
-                            self._genres[item] = new
+        features = WrangleStore.FEATURES
+
+        # a band by genre matrix and a track by band matrix, together they say
+        # which tracks are in which genre
+        vocabulary = GenreVocabulary()
+        bands = vocabulary.matrix(self._df["Genre"])
+        tracks = self._tracks[self._tracks["Band key"].isin(self._df.index)]
+        band_rows = self._df.index.get_indexer(tracks["Band key"])
+        track_bands = sparse.csr_matrix((numpy.ones(len(tracks), dtype="int8"), (numpy.arange(len(tracks)), band_rows)),
+                                        shape=(len(tracks), len(self._df)))
+
+        # a column per genre holding its tracks, in the order of the tracks table
+        track_genres = (track_bands @ bands).tocsc()
+        track_genres.sort_indices()
+        values = {feature: tracks[feature].to_numpy() for feature in features}
+
+        for genre, name in enumerate(vocabulary.names()):
+            rows = track_genres.indices[track_genres.indptr[genre]:track_genres.indptr[genre + 1]]
+            if len(rows) == 0:
+                continue
+            self._genres[name] = {feature: values[feature][rows].tolist() for feature in features}
 
     def calc_genres(self):
         for genre in self._genres:
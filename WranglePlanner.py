@@ -0,0 +1,460 @@
+"""
+Dry run of MetalScrapeWrangle.py. Tells how many api calls a wrangle still needs
+and how long they take, before any of them are made.
+
+Every band is run through the real matching against the response cache alone. A
+band whose searches and album lookups are all cached costs nothing and its match is
+known. At the first call that is not cached the replay stops, and the rest of the
+band is estimated from priors: how often a search in the band's market comes back
+empty, how many album lookups a band takes, how often a band is matched and how
+many top tracks an artist has. The priors come from the full R wrangle and are
+replaced by what the cache shows once it holds enough bands. The journals of a
+stopped run and the csvs of a finished stage count the same way they do for the wrangle.
+
+The plan orders the bands cheapest and most likely to match first, and marks the
+ones a call budget covers. Handing the plan and the budget to MetalWrangle makes it
+match the bands in that order and stop once the budget is spent.
+
+usage: python WranglePlanner.py --json FILE --letter L [--cache FILE] [--rate N] [--budget N] [--plan FILE]
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import argparse
+import datetime
+import glob
+import json
+from os.path import exists
+import pandas
+from GenreVocabulary import GenreVocabulary
+from MetalScrapeWrangle import MetalWrangle, SpotifyBatcher
+from MetalStream import read_jsonl
+from SpotifyCache import CachedSpotify, ResponseCache
+from WrangleStore import apply_schema
+
+
+"""
+Raised by CacheOnly for a call that is not cached.
+"""
+class NotCached(Exception):
+
+    """
+    Constructor for a NotCached exception.
+
+    param:
+        endpoint - name of the spotipy method
+        params - the call's keyword parameters
+    """
+    def __init__(self, endpoint, params):
+        super().__init__(endpoint)
+        self.endpoint = endpoint
+        self.params = params
+
+
+"""
+Class that stands in for spotify behind a CachedSpotify. Only the calls that are not
+cached reach it, and it answers every one of them with NotCached.
+"""
+class CacheOnly:
+
+    def __getattr__(self, endpoint):
+        def call(*args, **params):
+            raise NotCached(endpoint, params)
+        return call
+
+
+"""
+Class that answers the calls of the matching from the response cache and counts the
+calls it answered for the band being replayed.
+"""
+class CacheReplay:
+    # the cache in front of CacheOnly, None when there is no cache
+    _cached = None
+
+    # calls answered from the cache by endpoint, since the last start
+    _calls = None
+
+    """
+    Constructor for a CacheReplay object.
+
+    param:
+        cache - the ResponseCache, None when there is no cache
+    """
+    def __init__(self, cache):
+        self._calls = dict()
+        if cache is not None:
+            self._cached = CachedSpotify(CacheOnly(), cache)
+
+    """
+    Starts counting the calls of another band.
+    """
+    def start(self):
+        self._calls = dict()
+
+    """
+    Returns the calls answered from the cache by endpoint, since the last start.
+    """
+    def calls(self):
+        return dict(self._calls)
+
+    """
+    Answers a call from the cache, raises NotCached when it is not there.
+
+    param:
+        endpoint - name of the spotipy method
+        params - the call's keyword parameters
+    """
+    def call(self, endpoint, **params):
+        if self._cached is None:
+            raise NotCached(endpoint, params)
+
+        response = getattr(self._cached, endpoint)(**params)
+        self._calls[endpoint] = self._calls.get(endpoint, 0) + 1
+        return response
+
+    def search(self, q, limit=10, offset=0, type="track", market=None):
+        return self.call("search", q=q, limit=limit, offset=offset, type=type, market=market)
+
+    def artist_albums(self, artist_id, album_type=None, country=None, limit=20, offset=0):
+        return self.call("artist_albums", artist_id=artist_id, album_type=album_type, country=country, limit=limit,
+                         offset=offset)
+
+    def artist_top_tracks(self, artist_id, country="US"):
+        return self.call("artist_top_tracks", artist_id=artist_id, country=country)
+
+
+"""
+Class that plans a wrangle, see the top of the file.
+"""
+class WranglePlanner(MetalWrangle):
+    # the priors, taken from the full R wrangle
+    #   fallback - searches in a market that come back empty and are made again without one
+    #   albums - album lookups for a band with a discography
+    #   match - bands that are matched
+    #   tracks - top tracks of an artist
+    _priors = {
+        "fallback": 0.03,
+        "albums": 1.07,
+        "match": 0.15,
+        "tracks": 8.9
+    }
+
+    # the bands the cache has to answer in full before its numbers replace the priors
+    _calibrate_after = 50
+
+    # the lowest chance of a match a band is ranked with, so an unlikely band is not free
+    _min_chance = 0.01
+
+    # the response cache, None when there is none
+    _cache = None
+
+    # calls per second the wall time is worked out at
+    _rate = 2.0
+
+    # the most api calls the run may make, None for no limit
+    _budget = None
+
+    # the result of replaying each band, in the order of the DataFrame
+    _replays = None
+
+    # the plan, one row per band
+    _plan_df = None
+
+    # the stages that are finished already
+    _done = None
+
+    """
+    Constructor for a WranglePlanner object.
+
+    param:
+        filename - json file the wrangle is run on, a .jsonl file from a streaming scrape is read lazily
+        letter - the letter that was scraped, the csvs and journals of the wrangle are named after it
+        cache - sqlite file of the wrangle's response cache, None to plan without one (DEFAULT="spotify_cache.db")
+        rate - calls per second, the rate the wrangle's limiter starts at is the default, it climbs
+               from there so the wall time errs long (DEFAULT=2.0)
+        budget - the most api calls the run may make, None for no limit (DEFAULT=None)
+    """
+    def __init__(self, filename, letter, cache="spotify_cache.db", rate=2.0, budget=None):
+        self._rate = rate
+        self._budget = budget
+        self._priors = dict(self._priors)
+        self._vocabulary = GenreVocabulary()
+        self._done = set()
+
+        # a dry run does not create a cache, and does not change what is evicted from one
+        if cache is not None and exists(cache):
+            self._cache = ResponseCache(cache, read_only=True)
+        self._spotify = CacheReplay(self._cache)
+
+        search_csv = "spotify_artists_by_" + letter + ".csv"
+        tracks_csv = "compiled_artists_by_" + letter + ".csv"
+
+        # the bands come from the csv of a finished search, otherwise from the json
+        if exists(search_csv):
+            self._df = apply_schema(pandas.read_csv(search_csv, index_col=0))
+            self._done.add("search")
+        else:
+            try:
+                if filename.endswith(".jsonl"):
+                    if not exists(filename):
+                        raise FileNotFoundError(filename)
+                    scraped = read_jsonl(filename)
+                else:
+                    with open(filename, "r") as file:
+                        scraped = json.load(file)
+            except FileNotFoundError:
+                print("The json does not exist.")
+                exit()
+            self.build_df(scraped)
+            self.append_country_codes()
+
+        if exists(tracks_csv):
+            self._done.add("top_tracks")
+
+        try:
+            self.replay_bands(self.read_journals(search_csv))
+            self.calibrate()
+            self.estimate(self.read_journals(tracks_csv))
+            self.schedule()
+        finally:
+            if self._cache is not None:
+                self._cache.close()
+
+    """
+    Returns what the journals of a stage hold, without opening them for writing.
+
+    param:
+        csv - the csv of the stage, its journals are named after it
+    """
+    def read_journals(self, csv):
+        results = dict()
+        for journal in [self.journal_for(csv)] + glob.glob(self.journal_for(csv, "*")):
+            if exists(journal):
+                results.update(read_jsonl(journal))
+        return results
+
+    """
+    Runs the matching of every band against the cache. A band the search already
+    has an answer for is not replayed.
+
+    param:
+        journal - what the journals of the search hold
+    """
+    def replay_bands(self, journal):
+        self._replays = []
+
+        if "search" in self._done:
+            for artist_id in self._df["Spotify ID"]:
+                self._replays.append({"known": True, "id": None if pandas.isnull(artist_id) else artist_id})
+            return
+
+        for key, row in zip(self.row_keys(), self.match_rows(self._df)):
+            if key in journal:
+                self._replays.append({"known": True, "id": journal[key]})
+                continue
+
+            self._spotify.start()
+            try:
+                artist_id = self.match_artist(row)
+                self._replays.append({"known": True, "id": artist_id, "calls": self._spotify.calls(),
+                                      "market": row["Country code"] is not None, "albums": bool(row["Title set"])})
+            except NotCached as e:
+                self._replays.append({"known": False, "miss": e.endpoint, "params": e.params,
+                                      "calls": self._spotify.calls(), "albums": bool(row["Title set"])})
+
+    """
+    Replaces the priors with what the cache shows, once it answered enough bands in full.
+    """
+    def calibrate(self):
+        replayed = [replay for replay in self._replays if replay["known"] and "calls" in replay]
+        if len(replayed) < self._calibrate_after:
+            return
+
+        in_market = [replay for replay in replayed if replay["market"]]
+        if in_market:
+            searches = sum(replay["calls"].get("search", 0) for replay in in_market)
+            self._priors["fallback"] = max(0.0, searches / len(in_market) - 1)
+
+        with_albums = [replay for replay in replayed if replay["albums"]]
+        if with_albums:
+            self._priors["albums"] = sum(replay["calls"].get("artist_albums", 0) for replay in with_albums) / len(with_albums)
+
+        self._priors["match"] = sum(replay["id"] is not None for replay in replayed) / len(replayed)
+
+    """
+    Works out the calls each band still needs from the replays and the priors.
+
+    param:
+        journal - what the journals of the top tracks hold
+    """
+    def estimate(self, journal):
+        priors = self._priors
+        batch = SpotifyBatcher(None).limit("audio_features")
+
+        # the top tracks of the artists the cache has tell how many an artist has
+        if self._cache is not None and "top_tracks" not in self._done:
+            counts = []
+            for replay in self._replays:
+                if replay["known"] and replay["id"] is not None:
+                    self._spotify.start()
+                    try:
+                        counts.append(len(self.artist_top_tracks(replay["id"])))
+                    except NotCached:
+                        pass
+            if len(counts) >= self._calibrate_after:
+                priors["tracks"] = sum(counts) / len(counts)
+
+        rows = []
+        seen = set()
+        for replay in self._replays:
+            row = {"Known": replay["known"], "search": 0.0, "artist_albums": 0.0, "artist_top_tracks": 0.0,
+                   "audio_features": 0.0}
+
+            if replay["known"]:
+                row["Match chance"] = 0.0 if replay["id"] is None else 1.0
+            else:
+                row["Match chance"] = priors["match"]
+
+                # a search in the band's market that misses may be made again without one
+                if replay["miss"] == "search":
+                    row["search"] = 1 + (priors["fallback"] if replay["params"]["market"] is not None else 0)
+                    row["artist_albums"] = priors["albums"] if replay["albums"] else 0.0
+
+                # the lookups the cache answered are done, the one that missed is not
+                else:
+                    done = replay["calls"].get("artist_albums", 0)
+                    remaining = max(1.0, priors["albums"] - done)
+                    if self._album_candidates is not None:
+                        remaining = min(remaining, self._album_candidates - done)
+                    row["artist_albums"] = remaining
+
+            # the top tracks, only once for an artist several bands matched
+            if "top_tracks" not in self._done:
+                if not replay["known"]:
+                    row["artist_top_tracks"] = priors["match"]
+                    row["audio_features"] = priors["match"] * priors["tracks"] / batch
+                elif replay["id"] is not None and replay["id"] not in seen:
+                    seen.add(replay["id"])
+                    row["artist_top_tracks"], tracks = self.top_track_calls(replay["id"], journal)
+                    row["audio_features"] = tracks / batch
+
+            row["Search calls"] = row["search"] + row["artist_albums"]
+            row["Calls"] = row["Search calls"] + row["artist_top_tracks"] + row["audio_features"]
+            rows.append(row)
+
+        plan = pandas.DataFrame(rows, index=self._df.index)
+        plan.insert(0, "URL", self.row_keys())
+        plan.insert(1, "Band name", list(self._df["Band name"]))
+        self._plan_df = plan
+
+    """
+    Returns the top tracks calls an artist still needs, and the number of its tracks
+    whose audio features are not cached.
+
+    param:
+        artist_id - the spotify id of the artist
+        journal - what the journals of the top tracks hold
+    """
+    def top_track_calls(self, artist_id, journal):
+        if artist_id in journal:
+            return 0.0, 0
+
+        if "tracks:" + artist_id in journal:
+            tracks = journal["tracks:" + artist_id]
+            calls = 0.0
+        else:
+            self._spotify.start()
+            try:
+                tracks = self.artist_top_tracks(artist_id)
+                calls = 0.0
+            except NotCached:
+                return 1.0, self._priors["tracks"]
+
+        if self._cache is None:
+            return calls, len(tracks)
+
+        missing = 0
+        for item in tracks:
+            hit, _ = self._cache.get("audio_features", self._cache.make_key("audio_features", {"id": item["id"]}))
+            if not hit:
+                missing += 1
+        return calls, missing
+
+    """
+    Orders the bands cheapest and most likely to match first, and marks the ones the
+    budget covers. The wrangle searches every band before it gets any top tracks, so
+    a band is covered when its search fits in the budget.
+    """
+    def schedule(self):
+        plan = self._plan_df
+        plan["Priority"] = plan["Search calls"] / plan["Match chance"].clip(lower=self._min_chance)
+        plan = plan.sort_values(["Priority", "Search calls"], kind="stable")
+        plan["Cumulative calls"] = plan["Search calls"].cumsum()
+
+        if self._budget is None:
+            plan["Scheduled"] = True
+        else:
+            plan["Scheduled"] = plan["Cumulative calls"] <= self._budget
+        self._plan_df = plan
+
+    """
+    Prints the calls still needed, the wall time they take and what the budget covers.
+    """
+    def report(self):
+        plan = self._plan_df
+        endpoints = ["search", "artist_albums", "artist_top_tracks", "audio_features"]
+        totals = {endpoint: plan[endpoint].sum() for endpoint in endpoints}
+        total = sum(totals.values())
+
+        print(str(len(plan)) + " bands, " + str(int(plan["Known"].sum())) + " of them already searched or answered by the cache")
+        print("priors: " + ", ".join(name + " " + "{:.2f}".format(value) for name, value in self._priors.items()))
+        print("calls still needed: " + ", ".join(endpoint + " " + str(round(totals[endpoint])) for endpoint in endpoints)
+              + " (" + str(round(total)) + " in all)")
+        print("about " + str(datetime.timedelta(seconds=round(total / self._rate))) + " at " + str(self._rate) + " calls/sec")
+        print("about " + str(round(plan["Match chance"].sum())) + " bands matched")
+
+        if self._budget is not None:
+            scheduled = plan[plan["Scheduled"]]
+            searched = scheduled["Search calls"].sum()
+            print("a budget of " + str(self._budget) + " calls searches " + str(len(scheduled)) + " of " + str(len(plan))
+                  + " bands for about " + str(round(searched)) + " calls, about "
+                  + str(round(scheduled["Match chance"].sum())) + " of them matched")
+
+            if len(scheduled) == len(plan):
+                tracks = total - searched
+                if searched + tracks <= self._budget:
+                    print("the top tracks take about " + str(round(tracks)) + " more calls, the budget covers the whole wrangle")
+                else:
+                    print("the top tracks take about " + str(round(tracks)) + " more calls, about "
+                          + str(round(searched + tracks - self._budget)) + " past the budget")
+
+    """
+    Writes the plan to a csv MetalWrangle can be handed.
+
+    param:
+        csv - the csv
+    """
+    def write_plan(self, csv):
+        self._plan_df.to_csv(csv, index=False)
+
+    """
+    Returns a deep copy of the plan.
+    """
+    def get_plan(self) -> pandas.DataFrame:
+        return self._plan_df.copy(deep=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate the api calls and time a wrangle still needs.")
+    parser.add_argument("--json", default="metal-scrape-reis-gadsden_by_R.json", help="json from MetalScrape.py")
+    parser.add_argument("--letter", default="R", help="the letter that was scraped")
+    parser.add_argument("--cache", default="spotify_cache.db", help="the wrangle's response cache")
+    parser.add_argument("--rate", type=float, default=2.0, help="calls per second")
+    parser.add_argument("--budget", type=int, default=None, help="the most api calls the run may make")
+    parser.add_argument("--plan", default=None, help="csv to write the plan to, for MetalWrangle")
+    args = parser.parse_args()
+
+    planner = WranglePlanner(args.json, args.letter, cache=args.cache, rate=args.rate, budget=args.budget)
+    planner.report()
+    if args.plan is not None:
+        planner.write_plan(args.plan)
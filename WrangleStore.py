@@ -0,0 +1,226 @@
+"""
+Typed storage for the result of MetalScrapeWrangle.py.
+
+A csv can only hold text, so the discography and the audio features of the top
+tracks were written as the repr of python lists and had to be parsed back with
+literal_eval. Here the wrangle is kept as two parquet files instead:
+
+    <prefix>_bands.parquet  - one row per band, the discography as a real list of strings
+    <prefix>_tracks.parquet - one row per top track, keyed by the band it belongs to,
+                              with one float column per audio feature
+
+Both are columnar, so reading every feature of every track is a single read of a
+few float columns. Parquet needs pyarrow (or fastparquet) to be installed.
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import ast
+import numpy
+import pandas
+
+
+# the audio features kept for each track, one column each in the tracks table
+FEATURES = [
+    "danceability",
+    "energy",
+    "key",
+    "loudness",
+    "mode",
+    "speechiness",
+    "acousticness",
+    "instrumentalness",
+    "liveness",
+    "valence",
+    "tempo"
+]
+
+# the columns of a wrangle that move into the tracks table
+TRACK_COLUMNS = ["Top tracks", "Top track IDs", "Top track names", "Top track features"]
+
+# the dtype of each column of a wrangle. The same few countries, statuses, labels
+# and genres repeat over and over, so they are stored once as categories, the year
+# is a nullable integer instead of a float, and the rest of the text is kept as
+# strings instead of python objects. The lists stay objects.
+SCHEMA = {
+    "Band name": "string",
+    "Country of origin": "category",
+    "Location": "string",
+    "Status": "category",
+    "Formed in": "Int16",
+    "Years active": "string",
+    "Genre": "category",
+    "Lyrical themes": "string",
+    "Current/Last label": "category",
+    "URL": "string",
+    "Country code": "category",
+    "Spotify ID": "string",
+    "Top tracks": "string",
+    "Top track IDs": "string"
+}
+
+
+"""
+Returns the dtype text columns are stored as, backed by arrow when pyarrow is installed.
+"""
+def string_dtype():
+    try:
+        return pandas.StringDtype("pyarrow")
+    except ImportError:
+        return pandas.StringDtype()
+
+
+"""
+Gives the columns of a wrangle the dtypes in SCHEMA. Columns that are not in the
+DataFrame are skipped, so it works at every stage of the wrangle.
+
+params:
+    df - the wrangle
+"""
+def apply_schema(df):
+    for column, dtype in SCHEMA.items():
+        if column not in df.columns:
+            continue
+        if dtype == "string":
+            df[column] = df[column].astype(string_dtype())
+        elif dtype == "Int16":
+            df[column] = pandas.to_numeric(df[column], errors="coerce").round().astype("Int16")
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+"""
+Returns the bytes each column of a DataFrame takes, counting the python objects
+an object column points to, largest first, with the total at the end.
+
+params:
+    df - any DataFrame
+"""
+def memory_report(df):
+    usage = df.memory_usage(deep=True, index=False).sort_values(ascending=False)
+    usage["Total"] = usage.sum()
+    return usage
+
+
+"""
+Builds the long format tracks table of a wrangle. The band key of each track is the
+index of its band's row. A wrangle read back from a csv still has its lists as text,
+those are parsed here once per band so nothing after this has to.
+
+params:
+    df - the wrangle, with the columns get_top_tracks adds
+"""
+def tracks_from_df(df):
+    keys = []
+    positions = []
+    ids = []
+    names = []
+    values = {feature: [] for feature in FEATURES}
+
+    # a csv written before the names were kept as a list only has them joined
+    track_names = df["Top track names"] if "Top track names" in df.columns else [None] * len(df)
+
+    for key, track_ids, song_names, joined, features in zip(
+            df.index, df["Top track IDs"], track_names, df["Top tracks"], df["Top track features"]):
+        if not isinstance(features, list):
+            if not isinstance(features, str):
+                continue
+            features = ast.literal_eval(features)
+        if not features:
+            continue
+
+        track_ids = track_ids.split(", ")
+        song_names = split_names(song_names, joined, len(features))
+
+        for position, (track_id, song_name, song) in enumerate(zip(track_ids, song_names, features)):
+            keys.append(key)
+            positions.append(position)
+            ids.append(track_id)
+            names.append(song_name)
+            for feature in FEATURES:
+                values[feature].append(song[feature])
+
+    tracks = pandas.DataFrame({
+        "Band key": numpy.array(keys, dtype="int64"),
+        "Position": numpy.array(positions, dtype="int8"),
+        "Track ID": ids,
+        "Track name": names
+    })
+    for feature in FEATURES:
+        tracks[feature] = numpy.array(values[feature], dtype="float64")
+    return tracks
+
+
+"""
+Returns the name of each of a band's tracks. The names are taken from the list
+get_top_tracks keeps. Only a wrangle from before that list was kept has to split
+the joined names, and since a name can hold ", " itself they are split only where
+the number of pieces matches the number of tracks.
+
+params:
+    song_names - the list of names, or its text from a csv, None if there is none
+    joined - the names joined with ", "
+    count - the number of tracks
+"""
+def split_names(song_names, joined, count):
+    if isinstance(song_names, str):
+        song_names = ast.literal_eval(song_names)
+    if isinstance(song_names, list) and len(song_names) == count:
+        return song_names
+
+    parts = joined.split(", ") if isinstance(joined, str) else []
+    return parts if len(parts) == count else [None] * count
+
+
+"""
+Writes a wrangle as a bands table and a tracks table.
+
+params:
+    df - the wrangle, with the columns get_top_tracks adds
+    prefix - the path the two files are named from
+"""
+def write_store(df, prefix):
+    df = df.reset_index(drop=True)
+    tracks = tracks_from_df(df)
+
+    bands = df.drop(columns=[column for column in TRACK_COLUMNS if column in df.columns])
+    bands.insert(0, "Band key", bands.index.astype("int64"))
+
+    # a discography read back from a csv is still text
+    if "Discography" in bands.columns:
+        bands["Discography"] = [
+            ast.literal_eval(value) if isinstance(value, str) else (value if isinstance(value, list) else None)
+            for value in bands["Discography"]
+        ]
+
+    bands.to_parquet(prefix + "_bands.parquet", index=False)
+    tracks.to_parquet(prefix + "_tracks.parquet", index=False)
+
+
+"""
+Reads the bands table, indexed by band key.
+
+params:
+    prefix - the path the two files are named from
+"""
+def read_bands(prefix):
+    bands = apply_schema(pandas.read_parquet(prefix + "_bands.parquet"))
+    bands = bands.set_index("Band key")
+    bands.index.name = None
+
+    # parquet hands lists back as arrays
+    if "Discography" in bands.columns:
+        bands["Discography"] = [value.tolist() if value is not None else None for value in bands["Discography"]]
+    return bands
+
+
+"""
+Reads the tracks table.
+
+params:
+    prefix - the path the two files are named from
+    columns - only read these columns (DEFAULT=None for all of them)
+"""
+def read_tracks(prefix, columns=None):
+    return pandas.read_parquet(prefix + "_tracks.parquet", columns=columns)
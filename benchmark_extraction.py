@@ -0,0 +1,97 @@
+"""
+Checks and benchmarks the two ways the selenium path reads a band page.
+
+Every saved band page in a directory (saved from the browser as a complete page,
+so the discography table is part of the file) is loaded in a headless Firefox and
+read with both MetalScrape.read_band_elements and MetalScrape.read_band_script.
+The two results must be identical. For each we count the WebDriver round trips
+and the time spent reading the page.
+
+usage: python benchmark_extraction.py <directory of saved band pages>
+
+fixtures/extraction/bands holds a few synthetic ones written in the layout of the
+site's band pages, check_extraction.py checks the results against what they were
+written from.
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import os
+import sys
+import time
+from selenium import webdriver
+from selenium.webdriver.firefox.options import Options
+from MetalScrape import MetalScrape
+
+
+"""
+Wraps a driver's execute method so every command sent to the browser is counted.
+
+params:
+    driver - the selenium driver
+"""
+def count_round_trips(driver):
+    counter = {"calls": 0}
+    execute = driver.execute
+
+    def counted(driver_command, params=None):
+        counter["calls"] += 1
+        return execute(driver_command, params)
+
+    driver.execute = counted
+    return counter
+
+
+"""
+Reads every page with both extraction modes and prints the comparison.
+
+params:
+    directory - directory holding saved band pages
+"""
+def run(directory):
+    pages = sorted(f for f in os.listdir(directory) if f.endswith(".html"))
+    if not pages:
+        print("No saved band pages in " + directory)
+        exit(-1)
+
+    options = Options()
+    options.add_argument("-headless")
+    driver = webdriver.Firefox(options=options)
+    counter = count_round_trips(driver)
+
+    # skip the constructor, it starts a full scrape
+    scraper = MetalScrape.__new__(MetalScrape)
+
+    totals = {"elements": [0, 0.0], "script": [0, 0.0]}
+    mismatches = 0
+
+    for page in pages:
+        driver.get("file://" + os.path.abspath(os.path.join(directory, page)))
+
+        results = dict()
+        for mode, read in (("elements", scraper.read_band_elements), ("script", scraper.read_band_script)):
+            counter["calls"] = 0
+            start = time.perf_counter()
+            results[mode] = read(driver)
+            totals[mode][1] += time.perf_counter() - start
+            totals[mode][0] += counter["calls"]
+
+        if results["elements"] != results["script"]:
+            mismatches += 1
+            print("MISMATCH " + page)
+            print("    elements: " + str(results["elements"]))
+            print("    script:   " + str(results["script"]))
+
+    driver.quit()
+
+    print(str(len(pages)) + " pages, " + str(mismatches) + " mismatches")
+    for mode in totals:
+        calls, seconds = totals[mode]
+        print("{:<9} {:>8.1f} round trips/band {:>8.1f} ms/band".format(mode, calls / len(pages), 1000 * seconds / len(pages)))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: python benchmark_extraction.py <directory of saved band pages>")
+        exit(-1)
+    run(sys.argv[1])
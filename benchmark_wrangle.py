@@ -0,0 +1,145 @@
+"""
+Benchmarks MetalScrapeWrangle.py against FakeSpotify, so no credentials or network
+are needed.
+
+The wrangle runs with its real rate limiter, response cache and batcher in front
+of the fake. For spotify_artist_search and get_top_tracks we report bands per
+second, api calls per band, 429s, and the p50/p99 time it took to match a band
+or get an artist's top tracks. Since the fake knows which artist each band really
+is, we also report how many matches were right.
+
+usage: python benchmark_wrangle.py [--bands N] [--workers N] [--latency S] [--error-rate P] ...
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import argparse
+import contextlib
+import io
+import json
+import time
+from itertools import islice
+import pandas
+from FakeSpotify import FakeSpotify
+from MetalScrapeWrangle import MetalWrangle
+from SpotifyCache import ResponseCache
+
+
+"""
+Wraps a method so the time of every call is recorded.
+
+params:
+    method - the bound method
+    times - list the seconds of each call are appended to
+"""
+def timed(method, times):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            times.append(time.perf_counter() - start)
+    return wrapper
+
+
+"""
+Returns the value below which a share of the values fall.
+
+params:
+    values - the values
+    share - between 0 and 1
+"""
+def percentile(values, share):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+"""
+Runs one stage of the wrangle and prints its numbers.
+
+params:
+    name - the stage's name
+    stage - the method that runs the stage
+    fake - the FakeSpotify
+    bands - the number of bands in the stage
+    times - the list the timed method fills
+"""
+def run_stage(name, stage, fake, bands, times):
+    fake.reset()
+
+    # the stages print every row index, which would drown out the report
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        stage()
+    seconds = time.perf_counter() - start
+
+    calls, limited = fake.calls()
+    total = sum(calls.values())
+    print(name)
+    print("    {:.1f} s, {:.1f} bands/sec".format(seconds, bands / seconds))
+    print("    {:.2f} api calls/band ({}), {} 429s".format(total / bands, ", ".join(
+        endpoint + " " + str(calls[endpoint]) for endpoint in sorted(calls)), sum(limited.values())))
+    print("    p50 {:.0f} ms, p99 {:.0f} ms per {}".format(
+        1000 * percentile(times, 0.5), 1000 * percentile(times, 0.99), "band" if name == "spotify_artist_search" else "artist"))
+
+
+"""
+Builds the wrangle in front of the fake and benchmarks both stages.
+
+params:
+    args - the parsed command line
+"""
+def run(args):
+    fake = FakeSpotify(args.json, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                       max_rate=args.max_rate, retry_after=args.retry_after, seed=args.seed)
+
+    with open(args.json, "r") as file:
+        scraped = json.load(file)
+    if args.bands is not None:
+        scraped = dict(islice(scraped.items(), args.bands))
+
+    # skip the constructor, it reads and writes csvs and authorizes with spotify
+    wrangle = MetalWrangle.__new__(MetalWrangle)
+    wrangle._workers = args.workers
+    wrangle._cache = ResponseCache(args.cache) if args.cache is not None else None
+    wrangle.wrap_spotify(fake)
+
+    wrangle.build_df(scraped)
+    wrangle.append_country_codes()
+    bands = len(wrangle._df)
+
+    match_times = []
+    wrangle.match_artist = timed(wrangle.match_artist, match_times)
+    run_stage("spotify_artist_search", wrangle.spotify_artist_search, fake, bands, match_times)
+
+    expected = [fake.expected(url) for url in wrangle._df["URL"]]
+    found = [None if pandas.isnull(artist_id) else artist_id for artist_id in wrangle._df["Spotify ID"]]
+    right = sum(1 for want, got in zip(expected, found) if want is not None and got == want)
+    wrong = sum(1 for want, got in zip(expected, found) if got is not None and got != want)
+    missed = sum(1 for want, got in zip(expected, found) if want is not None and got is None)
+    print("    {} right, {} wrong, {} missed of {} on spotify".format(right, wrong, missed, sum(want is not None for want in expected)))
+
+    track_times = []
+    wrangle.artist_top_tracks = timed(wrangle.artist_top_tracks, track_times)
+    run_stage("get_top_tracks", wrangle.get_top_tracks, fake, bands, track_times)
+
+    if wrangle._cache is not None:
+        print("cache: " + str(wrangle._cache.stats()))
+        wrangle._cache.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the wrangle against a local fake of the Spotify API.")
+    parser.add_argument("--json", default="metal-scrape-reis-gadsden_by_R.json", help="json from MetalScrape.py")
+    parser.add_argument("--bands", type=int, default=200, help="bands to wrangle, the first of the json")
+    parser.add_argument("--workers", type=int, default=1, help="bands matched at once")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds each call takes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many seconds added to each call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="chance a call gets a 429")
+    parser.add_argument("--max-rate", type=float, default=None, help="calls per second above which calls get a 429")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After sent with a 429")
+    parser.add_argument("--cache", default=None, help="sqlite file to cache responses in, none by default")
+    parser.add_argument("--seed", type=int, default=0, help="changes the generated data")
+    run(parser.parse_args())
@@ -0,0 +1,103 @@
+"""
+Checks the concurrent http path against FakeSite, a local stand-in for the site
+that serves the pages in fixtures/extraction.
+
+The stand-in lists every fixture band several times and answers each request
+after a fixed latency, so the pool has enough bands to keep all its workers busy
+and their requests overlap. The band urls are collected from the stand-in's list
+feed with collect_band_urls, a page at a time so the pages have to be put back
+together, and the bands are scraped with a BandPool. Every band must come back, in
+list order, and read the same as expected.json says, and every release page the
+discographies link to that is in the fixtures must read the same as well. While
+the pool runs, more than one request must be in flight at once, but never more
+than per_host.
+
+usage: python check_band_pool.py [--fixtures DIR] [--workers N] [--per-host N] [--copies N] [--latency S]
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import argparse
+import json
+import os
+import threading
+from FakeSite import FakeSite
+from MetalFetch import BandFetcher, BandPool, FetchError, collect_band_urls
+from check_extraction import mismatch
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check BandPool and collect_band_urls against a local stand-in.")
+    parser.add_argument("--fixtures", default=os.path.join("fixtures", "extraction"), help="the fixture pages")
+    parser.add_argument("--workers", type=int, default=4, help="band pages fetched at once")
+    parser.add_argument("--per-host", type=int, default=2, help="most band pages fetched at once from the stand-in")
+    parser.add_argument("--copies", type=int, default=8, help="times each fixture band is listed")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds each request takes")
+    args = parser.parse_args()
+
+    # the check is that requests overlap, which takes two of each
+    if args.workers < 2 or args.per_host < 2:
+        parser.error("--workers and --per-host must be at least 2")
+
+    with open(os.path.join(args.fixtures, "expected.json"), "r", encoding="utf-8") as file:
+        expected = json.load(file)
+
+    site = FakeSite(args.fixtures, copies=args.copies, latency=args.latency).start()
+    mismatches = 0
+    try:
+        # two bands a page so the feed takes more than one page
+        urls = collect_band_urls("R", 100, workers=args.workers, page_size=2, base=site.base())
+        band_ids = [site.fixture_id(url.rstrip("/").split("/")[-1]) for url in urls]
+        want = sorted(expected["bands"]) * args.copies
+        if sorted(band_ids) != sorted(want):
+            mismatches += mismatch("band urls", sorted(band_ids), sorted(want))
+
+        release_urls = []
+        lock = threading.Lock()
+
+        def on_release(url):
+            with lock:
+                release_urls.append(url)
+
+        # only the pool's requests count towards the peak
+        site.reset()
+        pool = BandPool(workers=args.workers, per_host=args.per_host, base=site.base())
+        bands, failed = pool.scrape(urls, on_release=on_release)
+        peak = site.stats()["peak"]
+        if not 1 < peak <= args.per_host:
+            mismatches += mismatch("requests in flight at once", peak, "more than 1, at most " + str(args.per_host))
+        if failed:
+            mismatches += mismatch("failed bands", failed, [])
+        if list(bands) != [url for url in urls if url not in failed]:
+            mismatches += mismatch("band order", list(bands), urls)
+
+        for url, band_info in bands.items():
+            band_id = site.fixture_id(url.rstrip("/").split("/")[-1])
+            if band_info != expected["bands"].get(band_id):
+                mismatches += mismatch("pool band " + band_id, band_info, expected["bands"].get(band_id))
+
+        # only some of the releases linked to have a page in the fixtures, every
+        # copy of a band links to the same ones
+        fetcher = BandFetcher(base=site.base())
+        checked = 0
+        for url in dict.fromkeys(release_urls):
+            release_id = url.rstrip("/").split("/")[-1]
+            if release_id not in expected["releases"]:
+                continue
+            try:
+                release_info = fetcher.fetch_release(url)
+            except FetchError as e:
+                release_info = str(e)
+            if release_info != expected["releases"][release_id]:
+                mismatches += mismatch("release " + release_id, release_info, expected["releases"][release_id])
+            checked += 1
+
+        print("bands: " + str(len(urls)) + " listed, " + str(len(bands)) + " scraped, " + str(len(failed)) + " failed")
+        print("releases: " + str(len(set(release_urls))) + " linked, " + str(checked) + " checked")
+        print("pool: at most " + str(peak) + " requests in flight, per_host " + str(args.per_host))
+        print(str(mismatches) + " mismatches")
+    finally:
+        site.close()
+
+    if mismatches:
+        exit(-1)
@@ -0,0 +1,138 @@
+"""
+Checks every way we read a band page against the pages in fixtures/extraction.
+
+The pages there are synthetic. They were written by hand in the layout of the
+site's pages from the data of a few bands in metal-scrape-reis-gadsden_by_R.json,
+and their release ids and track rows are made up, so they are not saved copies of
+the site. expected.json was made from the same data, so a clean run only shows
+the extraction reads that layout the way we expect. It says nothing about the
+live site until the pages are replaced with real saved ones, which save_fixtures.py
+does, taking the expected band_info from the per element selenium path.
+
+    bands/<id>.html       - band pages with the discography table in them, as the browser has them
+    discography/<id>.html - the discography tables the band pages load, as the http engine gets them
+    releases/<id>.html    - release pages
+    expected.json         - the band_info of each band, and the dictionary of each release
+
+The http engine (BandFetcher.parse_band and parse_release) is always checked. With
+--selenium the band pages are also loaded in a headless Firefox and read with
+MetalScrape.read_band_elements and MetalScrape.read_band_script, the round trips
+and time of each are reported by benchmark_extraction.py.
+
+usage: python check_extraction.py [--fixtures DIR] [--selenium]
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import argparse
+import json
+import os
+from MetalFetch import BandFetcher
+
+
+"""
+Returns the text of a page.
+
+params:
+    path - the file
+"""
+def read_page(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return file.read()
+
+
+"""
+Prints a mismatch and returns 1, so it can be added to a count.
+
+params:
+    name - what was read
+    got - what it was read as
+    want - what it should have been read as
+"""
+def mismatch(name, got, want):
+    print("MISMATCH " + name)
+    print("    got:  " + json.dumps(got, ensure_ascii=False))
+    print("    want: " + json.dumps(want, ensure_ascii=False))
+    return 1
+
+
+"""
+Reads the pages with the http engine and returns the number of mismatches.
+
+params:
+    directory - the fixtures directory
+    expected - the contents of expected.json
+"""
+def check_http(directory, expected):
+    fetcher = BandFetcher()
+    mismatches = 0
+
+    for band_id, want in expected["bands"].items():
+        got = fetcher.parse_band(read_page(os.path.join(directory, "bands", band_id + ".html")),
+                                 read_page(os.path.join(directory, "discography", band_id + ".html")))
+        if got != want:
+            mismatches += mismatch("http band " + band_id, got, want)
+
+    for release_id, want in expected["releases"].items():
+        got = fetcher.parse_release(read_page(os.path.join(directory, "releases", release_id + ".html")))
+        if got != want:
+            mismatches += mismatch("http release " + release_id, got, want)
+
+    return mismatches
+
+
+"""
+Reads the band pages with both selenium extraction modes and returns the
+number of mismatches.
+
+params:
+    directory - the fixtures directory
+    expected - the contents of expected.json
+"""
+def check_selenium(directory, expected):
+    # only needed here, the http check runs without a browser
+    from selenium import webdriver
+    from selenium.webdriver.firefox.options import Options
+    from MetalScrape import MetalScrape
+
+    options = Options()
+    options.add_argument("-headless")
+    driver = webdriver.Firefox(options=options)
+
+    # skip the constructor, it starts a full scrape
+    scraper = MetalScrape.__new__(MetalScrape)
+
+    mismatches = 0
+    try:
+        for band_id, want in expected["bands"].items():
+            driver.get("file://" + os.path.abspath(os.path.join(directory, "bands", band_id + ".html")))
+            for mode, read in (("elements", scraper.read_band_elements), ("script", scraper.read_band_script)):
+                got = read(driver)
+                if got != want:
+                    mismatches += mismatch(mode + " band " + band_id, got, want)
+    finally:
+        driver.quit()
+
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the band page extraction against the fixture pages.")
+    parser.add_argument("--fixtures", default=os.path.join("fixtures", "extraction"), help="the fixture pages")
+    parser.add_argument("--selenium", action="store_true", help="also check the selenium modes, needs Firefox")
+    args = parser.parse_args()
+
+    with open(os.path.join(args.fixtures, "expected.json"), "r", encoding="utf-8") as file:
+        expected = json.load(file)
+
+    pages = len(expected["bands"]) + len(expected["releases"])
+    mismatches = check_http(args.fixtures, expected)
+    print("http: " + str(pages) + " pages, " + str(mismatches) + " mismatches")
+
+    if args.selenium:
+        selenium_mismatches = check_selenium(args.fixtures, expected)
+        print("selenium: " + str(2 * len(expected["bands"])) + " reads, " + str(selenium_mismatches) + " mismatches")
+        mismatches += selenium_mismatches
+
+    if mismatches:
+        exit(-1)
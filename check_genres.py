@@ -0,0 +1,63 @@
+"""
+Checks that genre_tokens reads metal-archives and spotify genres the same way, and
+that a band overlaps a spotify artist the way MetalWrangle.rank_candidates scores it.
+
+    - eras, separators and case are dropped
+    - the word "metal" is dropped, unless it is the only word of a genre
+    - a band whose genre is only "Metal" overlaps an artist spotify lists as "metal"
+
+usage: python check_genres.py
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import numpy
+from GenreVocabulary import GenreVocabulary, genre_tokens
+
+
+"""
+Prints a failed check and returns 1, so it can be added to a count.
+
+params:
+    name - what was checked
+    got - what it was
+    want - what it should have been
+"""
+def failed(name, got, want):
+    print("FAILED " + name)
+    print("    got:  " + repr(got))
+    print("    want: " + repr(want))
+    return 1
+
+
+# genre strings and the tokens they read as
+cases = [
+    ("Heavy/Thrash Metal", ["heavy", "thrash"]),
+    ("Death Metal (early); Gothic Rock (later)", ["death", "gothic rock"]),
+    ("german thrash metal", ["german thrash"]),
+    ("Metal", ["metal"]),
+    ("Metal (early); Rock (later)", ["metal", "rock"]),
+    ("Heavy Metal/Metal", ["heavy", "metal"]),
+    (None, []),
+]
+
+
+if __name__ == "__main__":
+    failures = 0
+
+    for genre, want in cases:
+        got = genre_tokens(genre)
+        if got != want:
+            failures += failed("tokens of " + repr(genre), got, want)
+
+    # the overlap of a band with its candidates, as rank_candidates adds it up
+    vocabulary = GenreVocabulary()
+    band = vocabulary.encode("Metal")
+    candidates = vocabulary.matrix(["metal, hard rock", "pop"], intern=False)
+    got = numpy.asarray(candidates[:, band].sum(axis=1)).ravel().tolist()
+    if got != [1, 0]:
+        failures += failed("overlap of a Metal band", got, [1, 0])
+
+    print(str(len(cases)) + " genres, " + str(failures) + " failures")
+    if failures:
+        exit(-1)
@@ -0,0 +1,104 @@
+"""
+Checks CachedSpotify and ResponseCache against a stand-in that answers from a
+script, so no credentials or network are needed.
+
+    - a response is cached and a repeat of the call is a hit
+    - a batch of ids only requests the ids that are not cached yet
+    - an id that comes back None is not cached, it is asked for again by the next
+      batch and its result is cached once it has one
+    - a response older than its endpoint's time to live is requested again
+
+usage: python check_spotify_cache.py
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import os
+import tempfile
+import time
+from SpotifyCache import CachedSpotify, ResponseCache
+
+
+"""
+Class that answers audio_features and artist_top_tracks from dictionaries and
+records the ids or artists of every call.
+"""
+class ScriptedSpotify:
+    # the audio features of each track id, a missing id is answered with None
+    features = None
+
+    # the ids of every audio_features call
+    calls = None
+
+    def __init__(self):
+        self.features = dict()
+        self.calls = []
+
+    def audio_features(self, tracks):
+        self.calls.append(list(tracks))
+        return [self.features.get(track_id) for track_id in tracks]
+
+    def artist_top_tracks(self, artist_id, country="US"):
+        self.calls.append(artist_id)
+        return {"tracks": [{"id": artist_id + ":1", "name": "Track 1"}]}
+
+
+"""
+Prints a failed check and returns 1, so it can be added to a count.
+
+params:
+    name - what was checked
+    got - what it was
+    want - what it should have been
+"""
+def failed(name, got, want):
+    print("FAILED " + name)
+    print("    got:  " + repr(got))
+    print("    want: " + repr(want))
+    return 1
+
+
+if __name__ == "__main__":
+    failures = 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        spotify = ScriptedSpotify()
+        cache = ResponseCache(os.path.join(directory, "cache.db"), ttl={"artist_top_tracks": 0.5})
+        cached = CachedSpotify(spotify, cache)
+
+        # a repeat of a call is a hit
+        cached.artist_top_tracks("a")
+        cached.artist_top_tracks("a")
+        if spotify.calls != ["a"]:
+            failures += failed("repeat is a hit", spotify.calls, ["a"])
+
+        # past its time to live the response is requested again
+        time.sleep(0.6)
+        cached.artist_top_tracks("a")
+        if spotify.calls != ["a", "a"]:
+            failures += failed("expired response is requested again", spotify.calls, ["a", "a"])
+
+        # t2 comes back None the first time
+        spotify.calls = []
+        spotify.features = {"t1": {"id": "t1"}, "t3": {"id": "t3"}}
+        got = cached.audio_features(["t1", "t2", "t3"])
+        if got != [{"id": "t1"}, None, {"id": "t3"}]:
+            failures += failed("first batch", got, [{"id": "t1"}, None, {"id": "t3"}])
+
+        # only the id without features is asked for again, and it has them now
+        spotify.features["t2"] = {"id": "t2"}
+        got = cached.audio_features(["t1", "t2", "t3"])
+        if got != [{"id": "t1"}, {"id": "t2"}, {"id": "t3"}]:
+            failures += failed("second batch", got, [{"id": "t1"}, {"id": "t2"}, {"id": "t3"}])
+
+        # and once it has them they are cached like the rest
+        cached.audio_features(["t1", "t2", "t3"])
+        want = [["t1", "t2", "t3"], ["t2"]]
+        if spotify.calls != want:
+            failures += failed("a None result is not cached", spotify.calls, want)
+
+        cache.close()
+
+    print(str(failures) + " failures")
+    if failures:
+        exit(-1)
@@ -0,0 +1,122 @@
+"""
+Checks that the call budget of MetalScrapeWrangle.py holds, with and without shards.
+
+Both stages of the wrangle are run against FakeSpotify with a budget, without a
+response cache so every call reaches the fake. The calls the fake answers are
+counted across every shard's process, and a run must never make more calls than
+its budget, whether it finishes or stops with BudgetSpent.
+
+The shards are forked, so they inherit the fake this check puts in place of the
+spotify client. This only runs where fork is available.
+
+usage: python check_wrangle_budget.py [--json FILE] [--bands N] [--budgets N N ...] [--shards N N ...]
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+from itertools import islice
+from FakeSpotify import FakeSpotify
+from MetalScrapeWrangle import BudgetSpent, MetalWrangle
+
+
+"""
+Class that passes every call on to the fake and counts it in a counter shared
+by every process.
+"""
+class CountingSpotify:
+    # the fake
+    _spotify = None
+
+    # the shared counter
+    _calls = None
+
+    """
+    Constructor for a CountingSpotify object.
+
+    params:
+        spotify - the fake
+        calls - a multiprocessing.Value the calls are counted in
+    """
+    def __init__(self, spotify, calls):
+        self._spotify = spotify
+        self._calls = calls
+
+    def __getattr__(self, name):
+        method = getattr(self._spotify, name)
+
+        def counted(*args, **kwargs):
+            with self._calls.get_lock():
+                self._calls.value += 1
+            return method(*args, **kwargs)
+        return counted
+
+
+"""
+Runs both stages with a budget and returns the calls made and whether the budget ran out.
+
+params:
+    scraped - the bands, as MetalScrape.py writes them
+    fake - the FakeSpotify
+    budget - the call budget
+    shards - the number of shards
+"""
+def run(scraped, fake, budget, shards):
+    calls = multiprocessing.Value("i", 0)
+
+    # every wrangle, the shards' included, talks to the fake
+    MetalWrangle.authorize_spotify = lambda self: self.wrap_spotify(CountingSpotify(fake, calls))
+
+    # skip the constructor, it reads and writes csvs in the working directory
+    wrangle = MetalWrangle.__new__(MetalWrangle)
+    wrangle._workers = 1
+    wrangle._shards = shards
+    wrangle._budget = budget
+    wrangle.authorize_spotify()
+    wrangle.build_df(scraped)
+    wrangle.append_country_codes()
+
+    spent = False
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                wrangle.run_stage("search", os.path.join(directory, "search.csv"))
+                wrangle.run_stage("top_tracks", os.path.join(directory, "tracks.csv"))
+        except BudgetSpent:
+            spent = True
+
+    return calls.value, spent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the wrangle stays within its call budget.")
+    parser.add_argument("--json", default="metal-scrape-reis-gadsden_by_R.json", help="json from MetalScrape.py")
+    parser.add_argument("--bands", type=int, default=60, help="bands to wrangle, the first of the json")
+    parser.add_argument("--budgets", type=int, nargs="+", default=[50, 140, 280], help="the budgets to check")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 3], help="the shard counts to check")
+    args = parser.parse_args()
+
+    multiprocessing.set_start_method("fork")
+
+    with open(args.json, "r") as file:
+        scraped = dict(islice(json.load(file).items(), args.bands))
+    fake = FakeSpotify(args.json, latency=0)
+
+    over = 0
+    for shards in args.shards:
+        for budget in args.budgets:
+            calls, spent = run(scraped, fake, budget, shards)
+            print("shards " + str(shards) + ", budget " + str(budget) + ": " + str(calls) + " calls"
+                  + (", budget spent" if spent else ", finished"))
+            if calls > budget:
+                print("OVER BUDGET")
+                over += 1
+
+    if over:
+        exit(-1)
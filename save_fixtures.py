@@ -0,0 +1,105 @@
+"""
+Saves real pages from the site as the fixtures check_extraction.py and
+benchmark_extraction.py read, replacing the synthetic ones in fixtures/extraction.
+
+For every band url given:
+
+    bands/<id>.html       - the band page as a headless Firefox has it once the
+                            discography table is loaded (the browser's DOM)
+    discography/<id>.html - the discography table, as the http engine gets it
+    releases/<id>.html    - the first --releases release pages the discography links to
+
+expected.json gets the band_info MetalScrape.read_band_elements, the per element
+selenium path, reads from each loaded band page, so the http engine and the single
+script call are both checked against the selenium scrape the repo started with.
+There is no selenium path for release pages, their expected dictionaries are what
+BandFetcher.parse_release reads and only guard against later changes.
+
+Once saved, run
+    python check_extraction.py --selenium
+    python benchmark_extraction.py fixtures/extraction/bands
+for the mismatches of every mode and the round trips per band.
+
+usage: python save_fixtures.py [--out DIR] [--releases N] <band url> [<band url> ...]
+
+git: https://github.com/reismgadsden/MetalScrape
+"""
+# needed imports
+import argparse
+import json
+import os
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.firefox.options import Options
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as ec
+from MetalFetch import BandFetcher
+from MetalScrape import MetalScrape
+
+
+"""
+Writes the text of a page.
+
+params:
+    path - the file
+    text - the page
+"""
+def write_page(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Save real band, discography and release pages as fixtures.")
+    parser.add_argument("urls", nargs="+", help="band page urls")
+    parser.add_argument("--out", default=os.path.join("fixtures", "extraction"), help="the fixtures directory")
+    parser.add_argument("--releases", type=int, default=1, help="release pages saved per band")
+    args = parser.parse_args()
+
+    # the pages of an earlier save are removed so none of them is checked against
+    # an expected.json that no longer describes it
+    for folder in ("bands", "discography", "releases"):
+        directory = os.path.join(args.out, folder)
+        if os.path.isdir(directory):
+            for page in os.listdir(directory):
+                if page.endswith(".html"):
+                    os.remove(os.path.join(directory, page))
+
+    fetcher = BandFetcher()
+    expected = {"bands": dict(), "releases": dict()}
+
+    options = Options()
+    options.add_argument("-headless")
+    driver = webdriver.Firefox(options=options)
+
+    # skip the constructor, it starts a full scrape
+    scraper = MetalScrape.__new__(MetalScrape)
+
+    try:
+        for url in args.urls:
+            band_id = url.rstrip("/").split("/")[-1]
+
+            # the same wait as MetalScrape.read_band_page, the table is loaded after the page
+            driver.get(url)
+            WebDriverWait(driver, 30).until(
+                ec.presence_of_element_located((By.CSS_SELECTOR, "table.display.discog tbody tr"))
+            )
+            write_page(os.path.join(args.out, "bands", band_id + ".html"), driver.page_source)
+            expected["bands"][band_id] = scraper.read_band_elements(driver)
+
+            discog_page = fetcher.get_page(fetcher.discography_url(url))
+            write_page(os.path.join(args.out, "discography", band_id + ".html"), discog_page)
+
+            for release_url in fetcher.parse_release_urls(discog_page)[:args.releases]:
+                release_id = release_url.rstrip("/").split("/")[-1]
+                release_page = fetcher.get_page(release_url)
+                write_page(os.path.join(args.out, "releases", release_id + ".html"), release_page)
+                expected["releases"][release_id] = fetcher.parse_release(release_page)
+
+            print("saved " + url)
+    finally:
+        driver.quit()
+
+    with open(os.path.join(args.out, "expected.json"), "w", encoding="utf-8") as file:
+        json.dump(expected, file, ensure_ascii=False, indent=4)